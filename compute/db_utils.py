@@ -1,4 +1,7 @@
 import os
+import uuid
+import struct
+import numpy as np
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
@@ -18,33 +21,378 @@ def get_db_connection():
     return conn
 
 
+# Bulk loading: COPY FROM STDIN into an unlogged staging table, then one
+# INSERT ... SELECT merges (or replaces) the target. One stream per load
+# instead of one round trip per row with executemany.
+
+COPY_CHUNK_ROWS = 1000
+
+PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+PGCOPY_TRAILER = struct.pack('!h', -1)
+
+_BINARY_PACKERS = {
+    'int4': struct.Struct('!i').pack,
+    'int8': struct.Struct('!q').pack,
+    'float8': struct.Struct('!d').pack,
+    'text': lambda v: v.encode('utf-8'),
+    'bytea': bytes,
+}
+
+_TEXT_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+class CopyStream:
+    # File-like wrapper over an iterator of byte chunks, read() is what copy_expert calls
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = bytearray()
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buf) < size:
+            try:
+                self._buf += next(self._chunks)
+            except StopIteration:
+                break
+        if size < 0 or size >= len(self._buf):
+            data = bytes(self._buf)
+            self._buf.clear()
+        else:
+            data = bytes(self._buf[:size])
+            del self._buf[:size]
+        return data
+
+
+def _text_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        # bytea hex input, backslash doubled for the COPY text format
+        return '\\\\x' + bytes(value).hex()
+    return str(value).translate(_TEXT_ESCAPES)
+
+
+def _text_chunks(rows):
+    lines = []
+    for row in rows:
+        lines.append('\t'.join(_text_value(v) for v in row))
+        if len(lines) >= COPY_CHUNK_ROWS:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def _binary_chunks(rows, types):
+    packers = [_BINARY_PACKERS[t] for t in types]
+    field_count = struct.pack('!h', len(types))
+    yield PGCOPY_HEADER
+
+    parts = []
+    for n, row in enumerate(rows, 1):
+        parts.append(field_count)
+        for pack, value in zip(packers, row):
+            if value is None:
+                parts.append(b'\xff\xff\xff\xff')
+            else:
+                data = pack(value)
+                parts.append(struct.pack('!i', len(data)))
+                parts.append(data)
+        if n % COPY_CHUNK_ROWS == 0:
+            yield b''.join(parts)
+            parts = []
+    parts.append(PGCOPY_TRAILER)
+    yield b''.join(parts)
+
+
+def bulk_load(conn, table, columns, rows, key_columns=None, mode="upsert", types=None):
+    # mode="upsert": INSERT ... ON CONFLICT (key_columns) DO UPDATE, rows must be unique per key
+    # mode="replace": TRUNCATE target and INSERT everything from staging, in the caller's transaction
+    # types (e.g. ('text', 'int4', 'bytea')) switches to binary COPY, otherwise text COPY is used
+    # The caller commits.
+    stage = f"{table}_stage_{uuid.uuid4().hex[:12]}"
+    cols = ", ".join(columns)
+
+    # Created inside the caller's transaction: if anything fails the rollback drops it too
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE UNLOGGED TABLE {stage} (LIKE {table} INCLUDING DEFAULTS);")
+
+        if types:
+            stream = CopyStream(_binary_chunks(rows, types))
+            cur.copy_expert(f"COPY {stage} ({cols}) FROM STDIN WITH (FORMAT binary)", stream)
+        else:
+            stream = CopyStream(_text_chunks(rows))
+            cur.copy_expert(f"COPY {stage} ({cols}) FROM STDIN", stream)
+
+        if mode == "replace":
+            cur.execute(f"TRUNCATE TABLE {table};")
+            cur.execute(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {stage};")
+        elif mode == "upsert":
+            updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in columns if c not in key_columns)
+            conflict = ", ".join(key_columns)
+            action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+            cur.execute(f"""
+                INSERT INTO {table} ({cols}) SELECT {cols} FROM {stage}
+                ON CONFLICT ({conflict}) {action};
+            """)
+        else:
+            raise ValueError(f"Unknown bulk_load mode: {mode}")
+
+        loaded = cur.rowcount
+        cur.execute(f"DROP TABLE {stage};")
+
+    return loaded
+
+
+# Serving keeps per-document arrays in memory and reloads them when this number changes.
+# Every step that replaces serving data (documents, inverted_index, pagerank, metadata, doc_texts) bumps it.
+def publish_index_version(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO config (key, value) VALUES ('index_version', 1)
+            ON CONFLICT (key) DO UPDATE SET value = config.value + 1
+            RETURNING value;
+        """)
+        version = int(cur.fetchone()[0])
+    conn.commit()
+    return version
+
+
+# Doc renumbering (compute/indexing/reorder_docs.py). The ingestion ids in corpus.jsonl,
+# doc_dict.tsv, the run files, edges.tsv and the PageRank nodes never change; doc_order maps
+# them to the doc_id of the doc_id-keyed tables and the posting lists. Every step writing
+# those maps its ids with load_doc_order() / map_doc_ids(), so re-running one after a reorder
+# writes the current numbering. doc_order is empty until the first reorder.
+def load_doc_order(conn):
+    # -> the doc_id of every ingestion id (dense int64 array), None while the ids are the same
+    with conn.cursor() as cur:
+        cur.execute("SELECT source_id, doc_id FROM doc_order")
+        rows = cur.fetchall()
+    if not rows:
+        return None
+    pairs = np.array(rows, dtype=np.int64)
+    order = np.arange(pairs[:, 0].max() + 1, dtype=np.int64)
+    order[pairs[:, 0]] = pairs[:, 1]
+    return order
+
+
+def map_doc_ids(order, ids):
+    # ingestion ids (an int or an int array) -> doc ids; ids past the map (docs added after
+    # the last reorder) keep their number
+    if order is None:
+        return ids
+    if np.isscalar(ids):
+        return int(order[ids]) if ids < order.size else ids
+    ids = np.asarray(ids, dtype=np.int64)
+    in_range = ids < order.size
+    return np.where(in_range, order[np.where(in_range, ids, 0)], ids)
+
+
+def save_doc_order(conn, order):
+    # replaces the map and bumps doc_order_version (term segments written under another
+    # version are stale, see compute/export_segments.py); in the caller's transaction
+    bulk_load(conn, "doc_order", ("source_id", "doc_id"), enumerate(order.tolist()),
+              mode="replace", types=("int4", "int4"))
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO config (key, value) VALUES ('doc_order_version', 1)
+            ON CONFLICT (key) DO UPDATE SET value = config.value + 1
+            RETURNING value;
+        """)
+        return int(cur.fetchone()[0])
+
+
+def doc_order_version(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT value FROM config WHERE key = 'doc_order_version'")
+        row = cur.fetchone()
+    return int(row[0]) if row else 0
+
+
+# Stored functions for SQL pushdown retrieval (serving "pushdown" mode).
+# postings_decode expands one compute/utils/postings_codec.py blob (v1 or v2) into
+# (doc_id, tf) rows with set-based SQL: payload bytes -> varints -> per-block gaps / tfs.
+# bm25_pr_topk scores all postings of the query terms next to the data and returns only
+# the docs whose base score can still reach the top-k after a title boost <= boost_max,
+# same contract as the retrievers in serving/scoring.py.
+SEARCH_FUNCTIONS_SQL = """
+CREATE OR REPLACE FUNCTION postings_decode(p_postings BYTEA)
+RETURNS TABLE(doc_id BIGINT, tf BIGINT)
+LANGUAGE plpgsql IMMUTABLE STRICT AS $$
+DECLARE
+    -- assigning detoasts once; get_byte on a TOASTed argument would detoast it on every call
+    blob BYTEA := p_postings;
+BEGIN
+    RETURN QUERY
+    WITH header AS (
+        SELECT get_byte(blob, 0) AS version,
+               get_byte(blob, 1) + get_byte(blob, 2) * 256
+                   + get_byte(blob, 3) * 65536 + get_byte(blob, 4)::bigint * 16777216 AS df,
+               get_byte(blob, 9) + get_byte(blob, 10) * 256
+                   + get_byte(blob, 11) * 65536 + get_byte(blob, 12)::bigint * 16777216 AS payload_len
+    ),
+    layout AS (
+        SELECT df, payload_len, (df + 127) / 128 AS num_blocks,
+               CASE version WHEN 1 THEN 13 ELSE 17 END AS header_size,
+               CASE version WHEN 1 THEN 8 ELSE 12 END AS dir_entry_size
+        FROM header
+    ),
+    payload AS (
+        SELECT i, get_byte(blob, (l.header_size + l.num_blocks * l.dir_entry_size + i)::int) AS byte
+        FROM layout l, generate_series(0, l.payload_len - 1) AS i
+    ),
+    varint_bytes AS (
+        -- varint number = terminating bytes (< 128) seen before this byte
+        SELECT i, byte,
+               coalesce(sum((byte < 128)::int) OVER (ORDER BY i ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0) AS v
+        FROM payload
+    ),
+    varints AS (
+        SELECT v, sum(((byte & 127)::bigint) << (7 * (i - first_i))::int) AS value
+        FROM (SELECT v, i, byte, min(i) OVER (PARTITION BY v) AS first_i FROM varint_bytes) b
+        GROUP BY v
+    ),
+    roles AS (
+        -- block j holds n gaps then n tfs, n = 128 except for the last block
+        SELECT x.value, x.block, x.w, x.n,
+               128 * x.block + CASE WHEN x.w < x.n THEN x.w ELSE x.w - x.n END AS idx
+        FROM (
+            SELECT vs.value, blk.block, vs.v - 256 * blk.block AS w,
+                   CASE WHEN blk.block = l.num_blocks - 1 THEN l.df - 128 * (l.num_blocks - 1) ELSE 128 END AS n
+            FROM varints vs, layout l,
+                 LATERAL (SELECT least(vs.v / 256, l.num_blocks - 1) AS block) blk
+        ) x
+    ),
+    gaps AS (
+        SELECT r.idx,
+               CASE WHEN r.block = 0 THEN 0 ELSE
+                   get_byte(blob, (l.header_size + (r.block - 1) * l.dir_entry_size)::int)
+                   + get_byte(blob, (l.header_size + (r.block - 1) * l.dir_entry_size + 1)::int) * 256
+                   + get_byte(blob, (l.header_size + (r.block - 1) * l.dir_entry_size + 2)::int) * 65536
+                   + get_byte(blob, (l.header_size + (r.block - 1) * l.dir_entry_size + 3)::int)::bigint * 16777216
+               END + sum(r.value) OVER (PARTITION BY r.block ORDER BY r.idx) AS doc
+        FROM roles r, layout l
+        WHERE r.w < r.n
+    )
+    SELECT g.doc::bigint, t.value::bigint
+    FROM gaps g JOIN roles t ON t.idx = g.idx AND t.w >= t.n;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION bm25_pr_topk(
+    p_terms TEXT[], p_n_docs INTEGER, p_avgdl DOUBLE PRECISION, p_k1 DOUBLE PRECISION, p_b DOUBLE PRECISION,
+    p_bm25_weight DOUBLE PRECISION, p_pr_weight DOUBLE PRECISION, p_boost_max DOUBLE PRECISION, p_k INTEGER)
+RETURNS TABLE(doc_id BIGINT, base DOUBLE PRECISION, bm25 DOUBLE PRECISION)
+LANGUAGE sql STABLE AS $$
+    WITH terms AS (
+        SELECT t.postings,
+               ln(CASE WHEN (p_n_docs - t.df + 0.5) / (t.df + 0.5) + 1 <= 0 THEN 1.00001
+                       ELSE (p_n_docs - t.df + 0.5) / (t.df + 0.5) + 1 END) AS idf
+        FROM inverted_index t
+        WHERE t.term = ANY(p_terms)
+    ),
+    scored AS (
+        SELECT d.doc_id,
+               sum(t.idf * ((d.tf * (p_k1 + 1))
+                   / (d.tf + p_k1 * (1 - p_b + p_b * (coalesce(nullif(m.length, 0), p_avgdl) / p_avgdl))))) AS bm25
+        FROM terms t
+        CROSS JOIN LATERAL postings_decode(t.postings) d
+        LEFT JOIN metadata m ON m.doc_id = d.doc_id
+        GROUP BY d.doc_id
+    ),
+    based AS (
+        -- PageRank through float4 like the serving doc stats, log-normalized as in search()
+        SELECT s.doc_id, s.bm25,
+               p_bm25_weight * s.bm25 + CASE WHEN p_pr_weight = 0 THEN 0
+                   ELSE p_pr_weight * ln(1 + coalesce(r.score, 0)::real::double precision * 10000000) END AS base
+        FROM scored s
+        LEFT JOIN pagerank r ON r.doc_id = s.doc_id
+        -- only docs serving can show (DocStats.showable) count toward the k-th best score
+        JOIN documents t ON t.doc_id = s.doc_id
+        WHERE t.title IS NOT NULL AND left(t.title, 5) <> '_born'
+    ),
+    threshold AS (
+        SELECT min(top.base) AS theta FROM (SELECT base FROM based ORDER BY base DESC LIMIT p_k) top
+    )
+    SELECT b.doc_id, b.base, b.bm25
+    FROM based b, threshold th
+    WHERE b.base * p_boost_max >= th.theta - abs(th.theta) * 1e-9
+    ORDER BY b.base DESC, b.doc_id
+$$;
+"""
+
+
+def install_search_functions(conn):
+    with conn.cursor() as cur:
+        cur.execute(SEARCH_FUNCTIONS_SQL)
+    conn.commit()
+
+
 def init_tables():
     conn = get_db_connection()
     cur = conn.cursor()
 
-    # Inverted Index table
+    # Inverted Index table, postings encoded by compute/utils/postings_codec.py,
+    # positions (NULL unless indexed with INDEX_POSITIONS=1) by compute/utils/positions_codec.py,
+    # tier-1 champion lists (NULL for short lists) by compute/utils/champions.py
     cur.execute("""
             CREATE TABLE IF NOT EXISTS inverted_index (
                 term TEXT PRIMARY KEY,
                 df INTEGER, 
-                postings JSONB
+                max_tf INTEGER,
+                postings BYTEA,
+                positions BYTEA,
+                champions BYTEA,
+                champion_bound DOUBLE PRECISION,
+                champion_pr_weight DOUBLE PRECISION
             );
         """)
+    cur.execute("ALTER TABLE inverted_index ADD COLUMN IF NOT EXISTS positions BYTEA;")
+    cur.execute("ALTER TABLE inverted_index ADD COLUMN IF NOT EXISTS champions BYTEA;")
+    cur.execute("ALTER TABLE inverted_index ADD COLUMN IF NOT EXISTS champion_bound DOUBLE PRECISION;")
+    cur.execute("ALTER TABLE inverted_index ADD COLUMN IF NOT EXISTS champion_pr_weight DOUBLE PRECISION;")
+    # stored uncompressed (the codec already is): serving reads single blocks with substring(),
+    # which then only fetches the TOAST chunks holding them
+    cur.execute("ALTER TABLE inverted_index ALTER COLUMN positions SET STORAGE EXTERNAL;")
+
+    # Doc dictionary: the only place titles are stored, everything else joins on doc_id
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS documents (
+            doc_id INTEGER PRIMARY KEY,
+            title TEXT UNIQUE,
+            title_terms BYTEA
+        );
+    """)
 
     # Pagerank table
     cur.execute("""
         CREATE TABLE IF NOT EXISTS pagerank (
-            doc_id TEXT PRIMARY KEY,
+            doc_id INTEGER PRIMARY KEY,
             score DOUBLE PRECISION
         );
     """)
 
-    # MetaData table
+    # MetaData table: kept narrow, serving scans it for document lengths
     cur.execute("""
         CREATE TABLE IF NOT EXISTS metadata (
-            doc_id TEXT PRIMARY KEY,
-            length INTEGER,
-            text TEXT
+            doc_id INTEGER PRIMARY KEY,
+            length INTEGER
+        );
+    """)
+
+    # Article texts, term_offsets encoded by compute/utils/term_offsets.py
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS doc_texts (
+            doc_id INTEGER PRIMARY KEY,
+            text TEXT,
+            term_offsets BYTEA
+        );
+    """)
+
+    # Ingestion id -> doc_id, written by compute/indexing/reorder_docs.py, see load_doc_order()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS doc_order (
+            source_id INTEGER PRIMARY KEY,
+            doc_id INTEGER NOT NULL
         );
     """)
 
@@ -57,8 +405,9 @@ def init_tables():
     """)
 
     conn.commit()
+    install_search_functions(conn)
     conn.close()
-    print("PostgreSQL tables initialized.")
+    print("PostgreSQL tables and search functions initialized.")
 
 
 if __name__ == "__main__":
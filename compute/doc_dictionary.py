@@ -0,0 +1,92 @@
+import json
+import os
+import sys
+from tqdm import tqdm
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compute.db_utils import get_db_connection, bulk_load, publish_index_version, load_doc_order, map_doc_ids
+from compute.utils.title_terms import title_signature, encode_signature
+
+# Global doc dictionary: doc_id (dense int) <-> title
+# Articles get their doc_id at ingestion (corpus.jsonl "doc_id" field).
+# Link targets that are not articles (red links, redirects) still are PageRank nodes,
+# so they get ids after the last article id.
+# Each title is analyzed here once; the token signature feeds the serving title boost.
+# doc_dict.tsv keeps these ingestion ids, the documents table gets them through doc_order
+# (compute/indexing/reorder_docs.py renumbers documents).
+
+DATA_DIR = "/app/data"
+INPUT_FILE = os.path.join(DATA_DIR, "intermediate", "corpus.jsonl")
+DOC_DICT_FILE = os.path.join(DATA_DIR, "intermediate", "doc_dict.tsv")
+
+
+def load_title_to_id(path=DOC_DICT_FILE):
+    title_to_id = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) < 2: continue
+            title_to_id[parts[1]] = int(parts[0])
+    return title_to_id
+
+
+def build_doc_dictionary():
+    print(f"Building doc dictionary from {INPUT_FILE}...")
+
+    if not os.path.exists(INPUT_FILE):
+        print(f"Input file not found: {INPUT_FILE}")
+        return
+
+    title_to_id = {}
+    link_targets = []
+    max_doc_id = -1
+
+    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
+        for line in tqdm(f, desc="Scanning Docs"):
+            try:
+                doc = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+            doc_id = doc['doc_id']
+            max_doc_id = max(max_doc_id, doc_id)
+            # first one wins if two pages normalize to the same title
+            if doc['id'] not in title_to_id:
+                title_to_id[doc['id']] = doc_id
+            link_targets.extend(doc.get('out_links', []))
+
+    num_docs = len(title_to_id)
+    next_id = max_doc_id + 1
+    for target in link_targets:
+        if target not in title_to_id:
+            title_to_id[target] = next_id
+            next_id += 1
+
+    print(f"Dictionary Stats: {num_docs} docs, {len(title_to_id) - num_docs} link-only titles.")
+
+    rows = sorted(((doc_id, title) for title, doc_id in title_to_id.items()), key=lambda x: x[0])
+
+    os.makedirs(os.path.dirname(DOC_DICT_FILE), exist_ok=True)
+    with open(DOC_DICT_FILE, 'w', encoding='utf-8') as f_out:
+        for doc_id, title in rows:
+            f_out.write(f"{doc_id}\t{title}\n")
+    print(f"Saved to {DOC_DICT_FILE}")
+
+    print("Loading 'documents' table...")
+    conn = get_db_connection()
+    doc_order = load_doc_order(conn)
+    signed_rows = (
+        (map_doc_ids(doc_order, doc_id), title, encode_signature(title_signature(title)))
+        for doc_id, title in tqdm(rows, desc="Title Signatures")
+    )
+    bulk_load(conn, "documents", ("doc_id", "title", "title_terms"), signed_rows,
+              mode="replace", types=("int4", "text", "bytea"))
+    conn.commit()
+    publish_index_version(conn)
+    conn.close()
+    print("Doc dictionary complete!")
+
+
+if __name__ == "__main__":
+    build_doc_dictionary()
@@ -5,11 +5,15 @@ from tqdm import tqdm
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from compute.db_utils import get_db_connection
+from compute.db_utils import get_db_connection, bulk_load, publish_index_version, load_doc_order, map_doc_ids
 from compute.utils.tokenizer import analyzer
+from compute.utils.term_offsets import first_offsets, encode_offsets
+from compute.utils.doc_store import DocStoreWriter
 
 DATA_DIR = "/app/data"
 INPUT_FILE = os.path.join(DATA_DIR, "intermediate", "corpus.jsonl")
+# compressed text store for the backend's snippets (compute/utils/doc_store.py), "" to skip it
+DOC_STORE_DIR = os.getenv("DOC_STORE_DIR", os.path.join(DATA_DIR, "docstore"))
 
 
 def clean_text(text):
@@ -19,47 +23,14 @@ def clean_text(text):
     return text.replace('\x00', '')
 
 
-def export_metadata():
-    print(f"Connecting to PostgreSQL...")
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-    except Exception as e:
-        print(f"Database connection failed: {e}")
-        return
-
-    print(" Truncating 'metadata' table...")
-    try:
-        cur.execute("TRUNCATE TABLE metadata;")
-        conn.commit()
-    except Exception as e:
-        print(f"Truncate warning: {e}")
-        conn.rollback()
-
-    print(f"Extracting metadata from {INPUT_FILE} (using NLTK Analyzer)...")
-
-    if not os.path.exists(INPUT_FILE):
-        print(f"Input file not found: {INPUT_FILE}")
-        return
-
-    batch_data = []
-    BATCH_SIZE = 2000
-
-    total_length = 0
-    doc_count = 0
-
-    insert_sql = """
-        INSERT INTO metadata (doc_id, length, text)
-        VALUES (%s, %s, %s)
-        ON CONFLICT (doc_id) DO UPDATE
-        SET length = EXCLUDED.length, text = EXCLUDED.text;
-    """
+def read_metadata_rows(stats, doc_order=None):
+    # doc_order: ingestion id -> doc_id map of renumbered documents (compute/db_utils.py)
     # tqdm for progress bar
     with open(INPUT_FILE, 'r', encoding='utf-8') as f:
         for line in tqdm(f, desc="Processing & Tokenizing"):
             try:
                 doc = json.loads(line)
-                doc_id = doc['id']
+                doc_id = map_doc_ids(doc_order, doc['doc_id'])
 
                 raw_text = doc.get('text', "")
                 clean_content = clean_text(raw_text)
@@ -67,11 +38,8 @@ def export_metadata():
                 # use the same analyzer as indexing
                 tokens = analyzer.analyze(clean_content)
                 length = len(tokens)
-
-                total_length += length
-                doc_count += 1
-
-                batch_data.append((doc_id, length, clean_content))
+                # where each term first occurs, snippets fetch only the text around it
+                term_offsets = encode_offsets(first_offsets(clean_content))
 
             except json.JSONDecodeError:
                 continue
@@ -79,23 +47,59 @@ def export_metadata():
                 # print(f" Error: {e}")
                 continue
 
-            if len(batch_data) >= BATCH_SIZE:
-                try:
-                    cur.executemany(insert_sql, batch_data)
-                    conn.commit()
-                except Exception as e:
-                    conn.rollback()
-                    print(f" Batch insert failed: {e}")
-                batch_data = []
-
-    if batch_data:
-        try:
-            cur.executemany(insert_sql, batch_data)
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            print(f" Final batch failed: {e}")
+            stats['total_length'] += length
+            stats['doc_count'] += 1
+            yield doc_id, length, clean_content, term_offsets
+
+
+def export_metadata():
+    print(f"Connecting to PostgreSQL...")
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+    except Exception as e:
+        print(f"Database connection failed: {e}")
+        return
+
+    print(f"Extracting metadata from {INPUT_FILE} (using NLTK Analyzer)...")
+
+    if not os.path.exists(INPUT_FILE):
+        print(f"Input file not found: {INPUT_FILE}")
+        return
+
+    stats = {'total_length': 0, 'doc_count': 0}
+
+    # Texts go to 'doc_texts' (and the doc store), lengths to the narrow 'metadata' rows that
+    # serving scans; COPY streams into staging, both tables are replaced in one transaction
+    lengths = []
+    doc_order = load_doc_order(conn)
+
+    def text_rows():
+        for doc_id, length, text, term_offsets in read_metadata_rows(stats, doc_order):
+            lengths.append((doc_id, length))
+            yield doc_id, text, term_offsets
+
+    store = DocStoreWriter(DOC_STORE_DIR) if DOC_STORE_DIR else None
+    try:
+        rows = store.tee(text_rows()) if store else text_rows()
+        bulk_load(conn, "doc_texts", ("doc_id", "text", "term_offsets"), rows, mode="replace")
+        bulk_load(conn, "metadata", ("doc_id", "length"), lengths, mode="replace")
+        # metadata used to hold the text too
+        cur.execute("ALTER TABLE metadata DROP COLUMN IF EXISTS text, DROP COLUMN IF EXISTS term_offsets;")
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        if store: store.abort()
+        print(f" Bulk load failed: {e}")
+        return
+
+    if store:
+        docs = store.close()
+        print(f"Doc store written to {DOC_STORE_DIR}: {docs} texts, {store.codec}, "
+              f"{store.block_offsets[-1] / 1e6:.1f} MB compressed from {store.position / 1e6:.1f} MB")
 
+    total_length = stats['total_length']
+    doc_count = stats['doc_count']
     avg_dl = total_length / doc_count if doc_count > 0 else 0.0
     print(f"Statistics: Total Docs={doc_count}, AvgDL={avg_dl:.2f}")
 
@@ -106,6 +110,7 @@ def export_metadata():
             ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value;
         """, ('avgdl', avg_dl))
         conn.commit()
+        print(f"Published index version {publish_index_version(conn)}")
     except Exception as e:
         conn.rollback()
         print(f"️ Config update failed: {e}")
@@ -0,0 +1,152 @@
+import os
+import sys
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compute.db_utils import get_db_connection, doc_order_version
+from compute.utils.bm25 import bm25_tf_norm
+from compute.utils.postings_codec import PostingsReader, encode_postings
+from compute.utils.positions_codec import encode_positions, doc_chunks
+from compute.utils.term_offsets import decode_offsets, byte_offsets
+from compute.utils.segments import (SegmentWriter, TermSegment, DocSegment, write_doc_segment, write_manifest,
+                                    partition_name, shard_name, term_partition)
+from serving.doc_stats import DocStats
+
+# Last step of a segment build (run_full_pipeline.py --segments): the reducers already wrote
+# the term segments, this writes the per-doc arrays and texts from Postgres, then the manifest.
+# Term segments written before compute/indexing/reorder_docs.py renumbered the documents (their
+# doc_order_version is not the current one) are rebuilt from inverted_index first.
+# With --shards N it also splits the segments by doc_id % N into shard-NN/ directories
+# for scatter-gather serving (serving/shard_coordinator.py).
+# Re-run it after any later pipeline step (PageRank, metadata) to refresh the segments.
+
+DATA_DIR = "/app/data"
+SEGMENT_DIR = os.getenv("INDEX_SEGMENT_DIR", os.path.join(DATA_DIR, "segments"))
+NUM_PARTITIONS = 16
+
+
+def read_texts(conn):
+    # named cursor: rows are streamed from the server instead of fetched all at once
+    with conn.cursor(name="segment_texts") as cur:
+        cur.itersize = 2000
+        cur.execute("SELECT doc_id, text, term_offsets FROM doc_texts")
+        for doc_id, text, blob in cur:
+            offsets = None
+            if text and blob is not None:
+                # Postgres offsets count characters, the segment slices utf-8 bytes
+                hashes, positions = decode_offsets(blob)
+                offsets = (hashes, byte_offsets(text, positions))
+            yield doc_id, text, offsets
+
+
+def rebuild_partitions(conn, partitions, version):
+    # rewrite the term segments of these partitions from the posting lists in Postgres;
+    # "C" collation sorts terms by their utf-8 bytes, the order of a segment dictionary
+    writers = {p: SegmentWriter(SEGMENT_DIR, p, version) for p in partitions}
+    try:
+        with conn.cursor(name="segment_terms") as cur:
+            cur.itersize = 500
+            cur.execute('SELECT term, df, postings, positions FROM inverted_index '
+                        'WHERE postings IS NOT NULL ORDER BY term COLLATE "C"')
+            for term, df, postings, positions in cur:
+                writer = writers.get(term_partition(term, NUM_PARTITIONS))
+                if writer is not None:
+                    writer.add(term, df, bytes(postings), bytes(positions) if positions is not None else None)
+    except Exception:
+        for writer in writers.values(): writer.abort()
+        raise
+    for writer in writers.values(): writer.close()
+
+
+def split_partition(partition_id, stats, num_shards):
+    # Re-encode every posting list of one partition as num_shards doc-partitioned lists.
+    # Shard dictionaries keep the collection df, so shards compute the same idf.
+    source = TermSegment(SEGMENT_DIR, partition_id)
+    writers = [SegmentWriter(os.path.join(SEGMENT_DIR, shard_name(s)), partition_id, source.doc_order_version)
+               for s in range(num_shards)]
+    avgdl = stats.index_avgdl or stats.avgdl
+    try:
+        for i in range(len(source)):
+            term = source.term(i).decode('utf-8')
+            doc_ids, tfs = PostingsReader(source.blob(i)).decode()
+            positions = source.positions_blob(i)
+            chunks = doc_chunks(positions, tfs) if positions is not None else None
+            # raw lengths like the reducer (0 if unknown), so block bounds stay valid upper bounds
+            lengths = np.zeros(doc_ids.size, dtype=np.float64)
+            in_range = doc_ids < stats.lengths.size
+            lengths[in_range] = stats.lengths[doc_ids[in_range]]
+            impacts = bm25_tf_norm(tfs.astype(np.float64), lengths, avgdl)
+
+            shard_of = doc_ids % num_shards
+            for shard, writer in enumerate(writers):
+                mask = shard_of == shard
+                if mask.any():
+                    shard_positions = None
+                    if chunks is not None:
+                        shard_positions = encode_positions([chunks[j] for j in np.flatnonzero(mask)])
+                    writer.add(term, int(source.dfs[i]), encode_postings(doc_ids[mask], tfs[mask], impacts[mask]),
+                               shard_positions)
+    except Exception:
+        for writer in writers: writer.abort()
+        raise
+    for writer in writers: writer.close()
+
+
+def export_shards(stats, manifest, num_shards):
+    docs = DocSegment(SEGMENT_DIR)
+    for partition_id in manifest["partitions"]:
+        print(f"Splitting partition {partition_id} into {num_shards} shards...")
+        split_partition(partition_id, stats, num_shards)
+
+    for shard in range(num_shards):
+        directory = os.path.join(SEGMENT_DIR, shard_name(shard))
+        texts = ((doc_id, docs.text(doc_id), docs.term_offsets(doc_id))
+                 for doc_id in range(shard, len(stats.titles), num_shards))
+        write_doc_segment(directory, stats, texts)
+        write_manifest(directory, dict(manifest, shard=shard, num_shards=num_shards))
+    print(f" {num_shards} shards exported to {SEGMENT_DIR}/{shard_name(0)}..")
+
+
+def export_segments(num_shards=0):
+    partitions = [p for p in range(NUM_PARTITIONS)
+                  if os.path.exists(os.path.join(SEGMENT_DIR, partition_name(p) + ".seg"))]
+    if not partitions:
+        print(f"No term segments in {SEGMENT_DIR}, run the reducers with INDEX_SEGMENTS=1 first.")
+        return
+
+    print(f"Connecting to PostgreSQL...")
+    conn = get_db_connection()
+    try:
+        version = doc_order_version(conn)
+        stale = [p for p in partitions if TermSegment(SEGMENT_DIR, p).doc_order_version != version]
+        if stale:
+            print(f"Rebuilding {len(stale)} term segments written before the documents were renumbered...")
+            rebuild_partitions(conn, stale, version)
+        stats = DocStats.load(conn)
+        print(f"Writing doc segment for {len(stats.titles)} ordinals (index version {stats.version})...")
+        write_doc_segment(SEGMENT_DIR, stats, read_texts(conn))
+    finally:
+        conn.close()
+
+    manifest = {
+        "index_version": stats.version,
+        "n_docs": stats.N,
+        "avgdl": stats.avgdl,
+        "index_avgdl": stats.index_avgdl,
+        "num_partitions": NUM_PARTITIONS,
+        "partitions": partitions,
+    }
+    write_manifest(SEGMENT_DIR, manifest)
+    print(f" Segments exported to {SEGMENT_DIR} ({len(partitions)} partitions)")
+
+    if num_shards:
+        export_shards(stats, manifest, num_shards)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, default=0, help="Also write N document-partitioned shards")
+    args = parser.parse_args()
+    export_segments(args.shards)
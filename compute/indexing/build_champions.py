@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from compute.db_utils import get_db_connection, bulk_load, publish_index_version
+from compute.utils.postings_codec import PostingsReader
+from compute.utils.bm25 import bm25_tf_norm
+from compute.utils.champions import (CHAMPION_LIST_SIZE, build_champions, dense_pagerank, pr_norm_values,
+                                     pagerank_fingerprint, save_champions_pagerank)
+
+# Rebuilds the tier-1 champion lists (compute/utils/champions.py) of every long posting list
+# from the stored postings and the current PageRank scores. The reducers build them as well, but
+# in a full pipeline they run before PageRank exists, so run_full_pipeline.py runs this once
+# PageRank and the metadata are exported. Re-run it after recomputing PageRank: until then
+# serving ignores the champion lists. Impacts are recomputed from the metadata lengths and the
+# reducers' avgdl (config.index_avgdl), the same values the stored block bounds were made with.
+
+BATCH_SIZE = 500
+
+
+def load_inputs(cur):
+    cur.execute("SELECT doc_id, length FROM metadata")
+    rows = cur.fetchall()
+    lengths = np.zeros(max([r[0] for r in rows] + [-1]) + 1, dtype=np.float64)
+    if rows:
+        ids, values = zip(*rows)
+        lengths[list(ids)] = values
+
+    cur.execute("SELECT key, value FROM config WHERE key IN ('avgdl', 'index_avgdl')")
+    config = dict(cur.fetchall())
+    avgdl = float(config.get('index_avgdl') or config.get('avgdl') or 100.0)
+
+    cur.execute("SELECT doc_id, score FROM pagerank")
+    pagerank = dense_pagerank(cur.fetchall())
+    return lengths, avgdl, len(rows), pagerank
+
+
+def champion_rows(read_cur, lengths, avgdl, pr_norm, n_docs, size):
+    # (term, champions, bound, pr_weight) for every term streamed from read_cur
+    for term, blob in read_cur:
+        doc_ids, tfs = PostingsReader(bytes(blob)).decode()
+        doc_lengths = np.zeros(doc_ids.size)
+        in_range = doc_ids < lengths.size
+        doc_lengths[in_range] = lengths[doc_ids[in_range]]
+        impacts = bm25_tf_norm(tfs.astype(np.float64), doc_lengths, avgdl)
+
+        champions = build_champions(doc_ids, tfs, impacts, pr_norm, n_docs, size)
+        if champions is not None:
+            yield (term,) + champions
+
+
+def build_all(size=CHAMPION_LIST_SIZE):
+    conn = get_db_connection()
+    write_conn = get_db_connection()
+    start = time.time()
+    try:
+        with conn.cursor() as cur:
+            lengths, avgdl, n_docs, pagerank = load_inputs(cur)
+        print(f"Building champion lists of up to {size} postings: {n_docs} docs, "
+              f"{np.count_nonzero(pagerank)} PageRank scores, AvgDL={avgdl:.2f}", flush=True)
+
+        with write_conn.cursor() as cur:
+            # lists that got short enough (or a larger CHAMPION_LIST_SIZE) are their own tier 1
+            cur.execute("""
+                UPDATE inverted_index SET champions = NULL, champion_bound = NULL, champion_pr_weight = NULL
+                WHERE champions IS NOT NULL AND df <= %s
+            """, (size,))
+
+        # server-side cursor, the postings stream through while COPY writes on the other connection
+        read_cur = conn.cursor(name="build_champions")
+        read_cur.itersize = BATCH_SIZE
+        read_cur.execute("SELECT term, postings FROM inverted_index WHERE df > %s AND postings IS NOT NULL",
+                         (size,))
+        rows = champion_rows(read_cur, lengths, avgdl, pr_norm_values(pagerank), n_docs, size)
+        count_terms = bulk_load(
+            write_conn, "inverted_index", ("term", "champions", "champion_bound", "champion_pr_weight"), rows,
+            key_columns=("term",), types=("text", "bytea", "float8", "float8")
+        )
+        read_cur.close()
+
+        save_champions_pagerank(write_conn, pagerank_fingerprint(pagerank))
+        write_conn.commit()
+        version = publish_index_version(write_conn)
+        print(f"Champion lists of {count_terms} terms built in {time.time() - start:.1f}s, "
+              f"index version {version}", flush=True)
+    except Exception:
+        write_conn.rollback()
+        raise
+    finally:
+        conn.close()
+        write_conn.close()
+
+
+if __name__ == "__main__":
+    build_all()
@@ -1,7 +1,5 @@
 import os
 import json
-import pickle
-import hashlib
 import redis
 import sys
 from collections import Counter
@@ -9,6 +7,9 @@ from collections import Counter
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 from compute.utils.tokenizer import analyzer
+from compute.utils.run_files import write_run
+from compute.utils.positions_codec import encode_doc_positions
+from compute.utils.segments import term_partition
 
 
 NUM_PARTITIONS = 16
@@ -20,6 +21,10 @@ REDIS_HOST = os.getenv("REDIS_HOST", "redis")
 Q_SOURCE = 'queue:indexing:mapper'
 Q_PROCESSING = 'queue:indexing:mapper:processing'
 
+# INDEX_POSITIONS=1: also record where each term occurs, for phrase queries.
+# Run records are then (term, doc_id, tf, delta-encoded positions) instead of (term, doc_id, tf)
+INDEX_POSITIONS = os.getenv("INDEX_POSITIONS", "0") == "1"
+
 
 def ensure_dirs():
     os.makedirs(TEMP_DIR, exist_ok=True)
@@ -32,6 +37,7 @@ def process_task(task):
     read_bytes = task['read_bytes']
 
     buckets = [[] for _ in range(NUM_PARTITIONS)]
+    doc_lengths = []
 
     with open(INPUT_FILE, 'rb') as f:
         f.seek(start_offset)
@@ -44,19 +50,27 @@ def process_task(task):
         if not line.strip(): continue
         try:
             doc = json.loads(line)
-            doc_id = doc['id']
+            doc_id = doc['doc_id']
             text = doc.get('text', '')
 
 
             tokens = analyzer.analyze(text)
 
 
-            term_counts = Counter(tokens)
-            # print(f"Term counts {term_counts}")
-            for term, tf in term_counts.items():
-                h = int(hashlib.md5(term.encode()).hexdigest(), 16)
-                p_idx = h % NUM_PARTITIONS
-                buckets[p_idx].append((term, doc_id, tf))
+            doc_lengths.append((doc_id, len(tokens)))
+
+            if INDEX_POSITIONS:
+                term_positions = {}
+                for position, term in enumerate(tokens):
+                    term_positions.setdefault(term, []).append(position)
+                for term, positions in term_positions.items():
+                    buckets[term_partition(term, NUM_PARTITIONS)].append(
+                        (term, doc_id, len(positions), encode_doc_positions(positions)))
+            else:
+                term_counts = Counter(tokens)
+                # print(f"Term counts {term_counts}")
+                for term, tf in term_counts.items():
+                    buckets[term_partition(term, NUM_PARTITIONS)].append((term, doc_id, tf))
 
             doc_count += 1
         except json.JSONDecodeError:
@@ -68,11 +82,13 @@ def process_task(task):
 
         data.sort(key=lambda x: x[0])
 
-        filename = f"part-task{task_id}-r{p_idx}.pkl"
+        # framed sorted run, read back frame by frame by the reducer
+        filename = f"part-task{task_id}-r{p_idx}.run"
         path = os.path.join(TEMP_DIR, filename)
+        write_run(path, data)
 
-        with open(path, 'wb') as out_f:
-            pickle.dump(data, out_f)
+    # doc lengths for the reducer's BM25 block upper bounds
+    write_run(os.path.join(TEMP_DIR, f"doclens-task{task_id}.run"), doc_lengths)
 
     print(f"[Mapper] Task {task_id} done. {doc_count} docs.")
 
@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from compute.db_utils import get_db_connection, publish_index_version
+from compute.utils.postings_codec import encode_postings
+
+# One-off migration of an existing inverted_index from JSONB {doc_id: tf} postings
+# to the binary codec. Re-running the indexing pipeline gives the same result, this just
+# avoids a full re-index. Old title-keyed postings are mapped through the documents table.
+# The key format is decided once for the whole table (--keys, by default title-keyed as soon
+# as any key isn't a number): a numeric title like "1984" must not be read as doc id 1984.
+# The JSONB column is dropped, or kept as postings_json with --keep-old.
+
+BATCH_SIZE = 2000
+
+
+def get_postings_type(cur):
+    cur.execute("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'inverted_index' AND column_name = 'postings'
+    """)
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def has_title_keys(cur):
+    # any key that isn't a plain number means the table is keyed by title
+    cur.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM inverted_index, jsonb_object_keys(postings::jsonb) AS key
+            WHERE key !~ '^[0-9]+$'
+        )
+    """)
+    return cur.fetchone()[0]
+
+
+def load_title_map(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT title, doc_id FROM documents")
+        return {title: doc_id for title, doc_id in cur.fetchall()}
+
+
+def convert_postings(postings_dict, title_map):
+    # title_map is None for a doc-id keyed table
+    merged = {}
+    skipped = 0
+    for key, tf in postings_dict.items():
+        doc_id = int(key) if title_map is None else title_map.get(key)
+        if doc_id is None:
+            skipped += 1
+            continue
+        merged[doc_id] = merged.get(doc_id, 0) + tf
+
+    doc_ids = sorted(merged)
+    tfs = [merged[doc_id] for doc_id in doc_ids]
+    return doc_ids, tfs, skipped
+
+
+def migrate(drop_old=True, keys="auto"):
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    data_type = get_postings_type(cur)
+    if data_type is None:
+        print("inverted_index.postings not found, nothing to migrate.")
+        return
+    if data_type == 'bytea':
+        print("inverted_index.postings is already BYTEA, nothing to migrate.")
+        return
+
+    print(f"Migrating inverted_index.postings ({data_type} -> bytea)...")
+    cur.execute("ALTER TABLE inverted_index ADD COLUMN IF NOT EXISTS max_tf INTEGER;")
+    cur.execute("ALTER TABLE inverted_index ADD COLUMN IF NOT EXISTS postings_bin BYTEA;")
+    conn.commit()
+
+    if keys == "auto":
+        keys = "titles" if has_title_keys(cur) else "ids"
+        conn.commit()
+    if keys == "titles":
+        title_map = load_title_map(conn)
+        print(f"Postings are keyed by title, loaded {len(title_map)} titles.")
+    else:
+        title_map = None
+        print("Postings are keyed by doc id.")
+
+    # Server-side cursor so the whole table is never held in memory
+    read_cur = conn.cursor(name="migrate_postings")
+    read_cur.itersize = BATCH_SIZE
+    read_cur.execute("SELECT term, postings FROM inverted_index WHERE postings_bin IS NULL")
+
+    write_conn = get_db_connection()
+    write_cur = write_conn.cursor()
+    update_sql = "UPDATE inverted_index SET df = %s, max_tf = %s, postings_bin = %s WHERE term = %s"
+
+    batch_data = []
+    count_terms = 0
+    total_skipped = 0
+
+    for term, postings_dict in read_cur:
+        if isinstance(postings_dict, str):
+            postings_dict = json.loads(postings_dict)
+
+        doc_ids, tfs, skipped = convert_postings(postings_dict or {}, title_map)
+        total_skipped += skipped
+        max_tf = max(tfs) if tfs else 0
+
+        batch_data.append((len(doc_ids), max_tf, encode_postings(doc_ids, tfs), term))
+        count_terms += 1
+
+        if len(batch_data) >= BATCH_SIZE:
+            write_cur.executemany(update_sql, batch_data)
+            write_conn.commit()
+            batch_data = []
+            print(f"   Migrated {count_terms} terms...", end='\r')
+
+    if batch_data:
+        write_cur.executemany(update_sql, batch_data)
+        write_conn.commit()
+
+    read_cur.close()
+    conn.commit()
+    print(f"\nMigrated {count_terms} terms ({total_skipped} postings without a known doc id dropped).")
+
+    # serving, the reducers and bm25_pr_topk read postings as bytea, so swap either way
+    print("Swapping columns...")
+    if drop_old:
+        cur.execute("ALTER TABLE inverted_index DROP COLUMN postings;")
+    else:
+        cur.execute("ALTER TABLE inverted_index RENAME COLUMN postings TO postings_json;")
+    cur.execute("ALTER TABLE inverted_index RENAME COLUMN postings_bin TO postings;")
+    conn.commit()
+    # a new version, so running servers reload and drop their cached postings and results
+    print(f"Published index version {publish_index_version(conn)}")
+
+    write_cur.close()
+    write_conn.close()
+    cur.close()
+    conn.close()
+    print("Postings migration complete!")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keep-old", action="store_true", help="Keep the JSONB column as postings_json")
+    parser.add_argument("--keys", choices=["auto", "ids", "titles"], default="auto",
+                        help="Posting keys are doc ids or titles (auto: titles if any key isn't a number)")
+    args = parser.parse_args()
+
+    migrate(drop_old=not args.keep_old, keys=args.keys)
@@ -1,32 +1,136 @@
 import os
-import pickle
 import glob
 import heapq
 import sys
 import json
 import redis
 import time
+import numpy as np
 from itertools import groupby
-from psycopg2.extras import Json
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-from compute.db_utils import get_db_connection
+from compute.db_utils import (get_db_connection, bulk_load, publish_index_version, load_doc_order, map_doc_ids,
+                              doc_order_version)
+from compute.utils.postings_codec import encode_postings
+from compute.utils.positions_codec import encode_positions
+from compute.utils.run_files import read_run
+from compute.utils.segments import SegmentWriter
+from compute.utils.bm25 import bm25_tf_norm
+from compute.utils.champions import (build_champions, dense_pagerank, pr_norm_values, pagerank_fingerprint,
+                                     save_champions_pagerank)
 
 NUM_PARTITIONS = 16
 DATA_DIR = "/app/data"
 TEMP_DIR = os.path.join(DATA_DIR, "temp_shuffle")
 
+# INDEX_SEGMENTS=1: also write each partition as an mmap-able segment (compute/utils/segments.py)
+WRITE_SEGMENTS = os.getenv("INDEX_SEGMENTS", "0") == "1"
+SEGMENT_DIR = os.getenv("INDEX_SEGMENT_DIR", os.path.join(DATA_DIR, "segments"))
+
 REDIS_HOST = os.getenv("REDIS_HOST", "redis")
 Q_SOURCE = 'queue:indexing:reducer'
 Q_PROCESSING = 'queue:indexing:reducer:processing'
 Q_DEAD = 'queue:indexing:reducer:dead'
 
 
+_doc_stats = None
+_pagerank = None
+
+
+def load_doc_stats(conn):
+    # Doc lengths written by the mappers, dense array indexed by doc id, and the doc_order map
+    # (compute/db_utils.py) with its version: the run files carry ingestion ids, after
+    # compute/indexing/reorder_docs.py the lists are written in its numbering.
+    # Loaded once per worker process and reused for every partition.
+    global _doc_stats
+    if _doc_stats is not None:
+        return _doc_stats
+
+    pairs = []
+    for fname in glob.glob(os.path.join(TEMP_DIR, "doclens-task*.run")):
+        pairs.extend(read_run(fname))
+    if not pairs:
+        raise RuntimeError("No doclens runs found, mappers must finish before reducing.")
+
+    doc_order, order_version = load_doc_order(conn), doc_order_version(conn)
+    doc_ids = map_doc_ids(doc_order, np.array([p[0] for p in pairs], dtype=np.int64))
+    lengths = np.array([p[1] for p in pairs], dtype=np.float64)
+
+    doc_lengths = np.zeros(doc_ids.max() + 1, dtype=np.float64)
+    doc_lengths[doc_ids] = lengths
+    avgdl = float(lengths.mean())
+
+    print(f"[Reducer] Loaded {len(doc_ids)} doc lengths, AvgDL={avgdl:.2f}", flush=True)
+    _doc_stats = (doc_lengths, avgdl, len(doc_ids), doc_order, order_version)
+    return _doc_stats
+
+
+def load_pagerank(conn):
+    # (pr_norm_values, fingerprint) of the pagerank table for the champion lists, once per worker.
+    # A first indexing run has no PageRank yet: champions then go by BM25 alone, and
+    # compute/indexing/build_champions.py re-ranks them once PageRank is exported.
+    global _pagerank
+    if _pagerank is None:
+        with conn.cursor() as cur:
+            cur.execute("SELECT doc_id, score FROM pagerank")
+            pagerank = dense_pagerank(cur.fetchall())
+        print(f"[Reducer] Loaded {np.count_nonzero(pagerank)} PageRank scores for champion lists", flush=True)
+        _pagerank = (pr_norm_values(pagerank), pagerank_fingerprint(pagerank))
+    return _pagerank
+
+
+def save_index_avgdl(conn, avgdl):
+    # serving compares this with its own avgdl to keep the stored bounds valid
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO config (key, value) VALUES (%s, %s)
+            ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value;
+        """, ('index_avgdl', avgdl))
+
+
+def reduce_terms(merged_stream, doc_lengths, avgdl, pr_norm=None, n_docs=None, doc_order=None):
+    # One row per term: (term, df, max_tf, encoded postings with block-max BM25 impacts,
+    # encoded positions or None, champions, champion bound, champion pr_weight).
+    # Positions come from mappers run with INDEX_POSITIONS=1, champion lists
+    # (compute/utils/champions.py) are built for long lists when pr_norm is given.
+    # doc_order maps the records' ingestion ids to doc ids, see load_doc_stats().
+    for term, group in groupby(merged_stream, key=lambda x: x[0]):
+        if len(term.encode('utf-8')) > 512: continue
+
+        postings_map = {}
+        positions_map = {}
+        for record in group:
+            doc_id, tf = map_doc_ids(doc_order, record[1]), record[2]
+            if doc_id in postings_map:
+                # a doc seen twice can't keep ordered positions, the term is indexed without them
+                positions_map[doc_id] = None
+            elif len(record) > 3:
+                positions_map[doc_id] = record[3]
+            postings_map[doc_id] = postings_map.get(doc_id, 0) + tf
+
+        df = len(postings_map)
+        doc_ids = sorted(postings_map)
+        tfs = [postings_map[doc_id] for doc_id in doc_ids]
+        max_tf = max(tfs)
+
+        impacts = bm25_tf_norm(np.asarray(tfs, dtype=np.float64), doc_lengths[doc_ids], avgdl)
+
+        positions = None
+        if len(positions_map) == df and all(c is not None for c in positions_map.values()):
+            positions = encode_positions([positions_map[doc_id] for doc_id in doc_ids])
+
+        champions = None
+        if pr_norm is not None:
+            champions = build_champions(doc_ids, tfs, impacts, pr_norm, n_docs)
+
+        yield (term, df, max_tf, encode_postings(doc_ids, tfs, impacts), positions) + (champions or (None,) * 3)
+
+
 def run_reducer_task(partition_id):
 
     print(f"[Reducer] Processing Partition {partition_id}...", flush=True)
 
-    pattern = os.path.join(TEMP_DIR, f"part-task*-r{partition_id}.pkl")
+    pattern = os.path.join(TEMP_DIR, f"part-task*-r{partition_id}.run")
     files = glob.glob(pattern)
 
     if not files:
@@ -34,62 +138,50 @@ def run_reducer_task(partition_id):
         return
 
     conn = None
-    cursor = None
-    file_handles = []
+    iterators = []
+    segment = None
 
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
+        doc_lengths, avgdl, n_docs, doc_order, order_version = load_doc_stats(conn)
+        pr_norm, pr_fingerprint = load_pagerank(conn)
+        save_index_avgdl(conn, avgdl)
+        save_champions_pagerank(conn, pr_fingerprint)
+        # commit right away, holding the config row lock would serialize the reducers
+        conn.commit()
 
-        iterators = []
-        for fname in files:
-            f = open(fname, 'rb')
-            file_handles.append(f)
-            iterators.append(pickle.load(f))
+        # each run is read one frame at a time, memory stays O(#runs x frame size)
+        iterators = [read_run(fname) for fname in files]
 
         # K-way merge sorted iterators
         merged_stream = heapq.merge(*iterators, key=lambda x: x[0])
 
-        sql = """
-            INSERT INTO inverted_index (term, df, postings)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (term) DO UPDATE 
-            SET df = EXCLUDED.df, postings = EXCLUDED.postings;
-        """
-
-        batch_data = []
-        BATCH_SIZE = 3000
-        count_terms = 0
-
-        for term, group in groupby(merged_stream, key=lambda x: x[0]):
-            if len(term.encode('utf-8')) > 512: continue
-
-            postings_map = {}
-            for _, doc_id, tf in group:
-                postings_map[doc_id] = postings_map.get(doc_id, 0) + tf
-
-            df = len(postings_map)
-
-
-            batch_data.append((term, df, Json(postings_map)))
-            count_terms += 1
-
-            if len(batch_data) >= BATCH_SIZE:
-                cursor.executemany(sql, batch_data)
-                batch_data = []
+        rows = reduce_terms(merged_stream, doc_lengths, avgdl, pr_norm, n_docs, doc_order)
+        if WRITE_SEGMENTS:
+            segment = SegmentWriter(SEGMENT_DIR, partition_id, order_version)
+            rows = segment.tee(rows)
 
-        if batch_data:
-            cursor.executemany(sql, batch_data)
+        # rows are streamed straight into binary COPY, nothing is batched in memory
+        count_terms = bulk_load(
+            conn, "inverted_index",
+            ("term", "df", "max_tf", "postings", "positions", "champions", "champion_bound", "champion_pr_weight"),
+            rows, key_columns=("term",),
+            types=("text", "int4", "int4", "bytea", "bytea", "bytea", "float8", "float8")
+        )
 
         conn.commit()
+        if segment is not None:
+            segment.close()
+            segment = None
+        publish_index_version(conn)
         print(f"[Reducer] Partition {partition_id} Done. ({count_terms} terms)", flush=True)
 
     except Exception as e:
         if conn: conn.rollback()
+        if segment is not None: segment.abort()
         raise e
     finally:
-        for f in file_handles: f.close()
-        if cursor: cursor.close()
+        for it in iterators: it.close()
         if conn: conn.close()
 
 # If failed, retry or mark dead, send task back to redis
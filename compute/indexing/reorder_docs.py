@@ -0,0 +1,159 @@
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from compute.db_utils import (get_db_connection, bulk_load, publish_index_version, load_doc_order, map_doc_ids,
+                              save_doc_order, doc_order_version)
+from compute.utils.postings_codec import PostingsReader, encode_postings
+from compute.utils.positions_codec import encode_positions, doc_chunks
+from compute.utils.bm25 import bm25_tf_norm
+from compute.utils.champions import dense_pagerank
+from compute.utils.doc_store import remap_doc_store, apply_doc_store_remap
+
+# Post-PageRank reindex: renumbers all documents by descending PageRank (ties keep their old
+# order) and rewrites every doc_id-keyed table, the posting lists (postings, positions) and the
+# doc store to the new numbering. Posting lists then run from the highest PageRank down, so
+# the pr_norm of a block's first doc bounds the PageRank of the rest of the list, and the
+# "ordered" retrieval mode (serving/scoring.py) stops scanning once that bound shows the top k
+# is final.
+#
+# Runs after PageRank and metadata export, before compute/indexing/build_champions.py (champion
+# lists are dropped here) and compute/export_segments.py, which rebuilds the term segments the
+# reducers wrote in the old numbering. corpus.jsonl, doc_dict.tsv, the run files and the edges
+# keep their ingestion ids: the ingestion id -> doc_id map is saved to doc_order with the
+# renumbered tables, and the steps writing doc ids (doc dictionary, reducers, PageRank and
+# metadata export) map through it, so any of them can be re-run afterwards. A later reorder
+# composes with the saved map. Running it twice on the same PageRank changes nothing.
+#
+# The doc store is renumbered into a staged file before the commit and swapped in after it; if
+# the swap never happens the next run finishes it, a file staged for a rolled back run is
+# dropped (compute/utils/doc_store.py).
+
+DATA_DIR = "/app/data"
+DOC_STORE_DIR = os.getenv("DOC_STORE_DIR", os.path.join(DATA_DIR, "docstore"))
+
+BATCH_SIZE = 500
+DOC_TABLES = ("documents", "metadata", "pagerank", "doc_texts")
+
+
+def pagerank_order(cur):
+    # -> old_of_new: the old id of every new id, over all ids used by any doc_id-keyed table
+    size = 0
+    for table in DOC_TABLES:
+        cur.execute(f"SELECT max(doc_id) FROM {table}")
+        size = max(size, (cur.fetchone()[0] or -1) + 1)
+    cur.execute("SELECT doc_id, score FROM pagerank")
+    pagerank = np.zeros(size, dtype=np.float32)
+    scores = dense_pagerank(cur.fetchall())
+    pagerank[:scores.size] = scores
+    return np.lexsort((np.arange(size), -pagerank))
+
+
+def load_lengths(cur, old_of_new):
+    # metadata lengths in the new numbering, and the reducers' avgdl the stored impacts used
+    cur.execute("SELECT doc_id, length FROM metadata")
+    rows = cur.fetchall()
+    lengths = np.zeros(old_of_new.size, dtype=np.float64)
+    if rows:
+        ids, values = zip(*rows)
+        lengths[list(ids)] = values
+    cur.execute("SELECT key, value FROM config WHERE key IN ('avgdl', 'index_avgdl')")
+    config = dict(cur.fetchall())
+    return lengths[old_of_new], float(config.get('index_avgdl') or config.get('avgdl') or 100.0)
+
+
+def renumber_table(cur, table, old_ids, new_ids):
+    # through negative ids, so no row ever collides with one not renumbered yet
+    cur.execute(f"""
+        UPDATE {table} t SET doc_id = -1 - m.new_id
+        FROM unnest(%s::int[], %s::int[]) AS m(old_id, new_id)
+        WHERE t.doc_id = m.old_id
+    """, (old_ids, new_ids))
+    cur.execute(f"UPDATE {table} SET doc_id = -1 - doc_id WHERE doc_id < 0")
+
+
+def reordered_rows(read_cur, new_of_old, lengths, avgdl):
+    # (term, postings, positions, champions, bound, pr_weight) in the new numbering, block
+    # impacts recomputed like the reducer does; champion lists are rebuilt separately
+    for term, blob, positions in read_cur:
+        doc_ids, tfs = PostingsReader(bytes(blob)).decode()
+        new_ids = new_of_old[doc_ids]
+        order = np.argsort(new_ids, kind='stable')
+        new_ids, new_tfs = new_ids[order], tfs[order]
+        impacts = bm25_tf_norm(new_tfs.astype(np.float64), lengths[new_ids], avgdl)
+
+        if positions is not None:
+            chunks = doc_chunks(bytes(positions), tfs)
+            positions = encode_positions([chunks[i] for i in order.tolist()])
+        yield term, encode_postings(new_ids, new_tfs, impacts), positions, None, None, None
+
+
+def composed_order(current, new_of_old):
+    # the doc_order after this reorder: ingestion id -> current doc_id -> new doc_id
+    size = max(new_of_old.size, current.size if current is not None else 0)
+    return map_doc_ids(new_of_old, map_doc_ids(current, np.arange(size, dtype=np.int64)))
+
+
+def reorder_docs(old_of_new=None):
+    # old_of_new: the old id of every new id, PageRank order by default
+    conn = get_db_connection()
+    write_conn = get_db_connection()
+    start = time.time()
+    try:
+        if DOC_STORE_DIR and apply_doc_store_remap(DOC_STORE_DIR, doc_order_version(conn)):
+            print(f"   Finished the doc store renumbering of the last run in {DOC_STORE_DIR}", flush=True)
+
+        with conn.cursor() as cur:
+            if old_of_new is None:
+                old_of_new = pagerank_order(cur)
+            lengths, avgdl = load_lengths(cur, old_of_new)
+        new_of_old = np.empty_like(old_of_new)
+        new_of_old[old_of_new] = np.arange(old_of_new.size)
+
+        moved = np.flatnonzero(new_of_old != np.arange(new_of_old.size))
+        if not moved.size:
+            print("Documents already in PageRank order, nothing to do.", flush=True)
+            return
+        print(f"Renumbering {moved.size} of {old_of_new.size} doc ids by PageRank...", flush=True)
+
+        with write_conn.cursor() as cur:
+            old_ids, new_ids = moved.tolist(), new_of_old[moved].tolist()
+            for table in DOC_TABLES:
+                renumber_table(cur, table, old_ids, new_ids)
+                print(f"   {table}: {cur.rowcount} rows", flush=True)
+
+        # server-side cursor, lists stream through while COPY writes on the other connection
+        read_cur = conn.cursor(name="reorder_postings")
+        read_cur.itersize = BATCH_SIZE
+        read_cur.execute("SELECT term, postings, positions FROM inverted_index WHERE postings IS NOT NULL")
+        count_terms = bulk_load(
+            write_conn, "inverted_index",
+            ("term", "postings", "positions", "champions", "champion_bound", "champion_pr_weight"),
+            reordered_rows(read_cur, new_of_old, lengths, avgdl), key_columns=("term",),
+            types=("text", "bytea", "bytea", "bytea", "float8", "float8")
+        )
+        read_cur.close()
+        print(f"   inverted_index: {count_terms} posting lists rewritten", flush=True)
+
+        version = save_doc_order(write_conn, composed_order(load_doc_order(write_conn), new_of_old))
+        staged = DOC_STORE_DIR and remap_doc_store(DOC_STORE_DIR, old_of_new, version)
+        write_conn.commit()
+        if staged and apply_doc_store_remap(DOC_STORE_DIR, version):
+            print(f"   Doc store in {DOC_STORE_DIR} renumbered", flush=True)
+
+        version = publish_index_version(write_conn)
+        print(f"Documents renumbered in {time.time() - start:.1f}s, index version {version}. "
+              f"Rebuild champion lists (compute/indexing/build_champions.py) and segments next.", flush=True)
+    except Exception:
+        # a doc store remap staged for the rolled back version is dropped by the next run
+        write_conn.rollback()
+        raise
+    finally:
+        conn.close()
+        write_conn.close()
+
+
+if __name__ == "__main__":
+    reorder_docs()
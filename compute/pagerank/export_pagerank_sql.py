@@ -5,7 +5,7 @@ import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-from compute.db_utils import get_db_connection
+from compute.db_utils import get_db_connection, bulk_load, publish_index_version, load_doc_order, map_doc_ids
 
 
 REDIS_HOST = os.getenv("REDIS_HOST", "redis")
@@ -34,31 +34,20 @@ def export_pr_sql():
         print(f" Database connection failed: {e}")
         return
 
-    print(" Truncating 'pagerank' table...")
-    cur.execute("TRUNCATE TABLE pagerank;")
-
-
-    print(" Inserting PageRank scores...")
-
-    sql = """
-        INSERT INTO pagerank (doc_id, score) 
-        VALUES (%s, %s)
-        ON CONFLICT (doc_id) DO UPDATE 
-        SET score = EXCLUDED.score;
-    """
-
-    data_tuples = [(k, float(v)) for k, v in raw_data.items()]
-    BATCH_SIZE = 10000
-
-    for i in range(0, len(data_tuples), BATCH_SIZE):
-        batch = data_tuples[i: i + BATCH_SIZE]
-        cur.executemany(sql, batch)
-        print(f"   Processed {min(i + BATCH_SIZE, len(data_tuples))}...", end='\r')
-
+    print(" Loading PageRank scores (COPY + replace)...")
+    # PageRank nodes are ingestion ids (edges.tsv), renumbered documents get their doc_id
+    doc_order = load_doc_order(conn)
+    data_tuples = ((map_doc_ids(doc_order, int(k)), float(v)) for k, v in raw_data.items())
+    loaded = bulk_load(conn, "pagerank", ("doc_id", "score"), data_tuples,
+                       mode="replace", types=("int4", "float8"))
     conn.commit()
-
+    print(f"   Loaded {loaded} rows, index version {publish_index_version(conn)}.")
     print("\n === TOP 10 PAGES BY PAGERANK (FROM DB) ===")
-    cur.execute("SELECT doc_id, score FROM pagerank ORDER BY score DESC LIMIT 10")
+    cur.execute("""
+        SELECT d.title, p.score FROM pagerank p
+        JOIN documents d ON d.doc_id = p.doc_id
+        ORDER BY p.score DESC LIMIT 10
+    """)
     for rank, (doc_id, score) in enumerate(cur.fetchall(), 1):
         print(f"{rank:<3} {score:.8f}  {doc_id}")
 
@@ -1,8 +1,15 @@
 import json
 import os
+import sys
 from tqdm import tqdm
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from compute.doc_dictionary import load_title_to_id, DOC_DICT_FILE
+
 # Generating edges.tsv from corpus.jsonl for pagerank calculation
+# Edges (and so PageRank nodes) are ingestion ids like corpus.jsonl and doc_dict.tsv, also after
+# compute/indexing/reorder_docs.py; export_pagerank_sql.py maps them to doc ids.
 
 
 DATA_DIR = "/app/data"
@@ -17,6 +24,12 @@ def extract_edges():
         print(" Error: corpus.jsonl not found!")
         return
 
+    if not os.path.exists(DOC_DICT_FILE):
+        print(" Error: doc_dict.tsv not found! Run compute/doc_dictionary.py first.")
+        return
+
+    # edges are written as integer doc ids
+    title_to_id = load_title_to_id()
     edge_count = 0
 
     with open(INPUT_FILE, 'r', encoding='utf-8') as f_in, \
@@ -25,10 +38,12 @@ def extract_edges():
         for line in tqdm(f_in, desc="Processing"):
             try:
                 doc = json.loads(line)
-                source_id = doc['id']
+                source_id = doc['doc_id']
                 out_links = doc.get('out_links', [])
 
-                for target_id in out_links:
+                for target in out_links:
+                    target_id = title_to_id.get(target)
+                    if target_id is None: continue
                     # Exclude self edge!! Otherwise PR will explode.
                     if source_id != target_id:
                         f_out.write(f"{source_id}\t{target_id}\n")
@@ -29,7 +29,8 @@ def load_graph():
             try:
                 parts = line.strip().split('\t')
                 if len(parts) < 2: continue
-                u, v = parts[0], parts[1]
+                # integer doc ids from the doc dictionary, keeps Redis hashes and link lists small
+                u, v = int(parts[0]), int(parts[1])
 
                 if u not in adj_list: adj_list[u] = []
                 adj_list[u].append(v)
@@ -0,0 +1,133 @@
+import redis
+import os
+import sys
+import csv
+import time
+import argparse
+import numpy as np
+import scipy.sparse as sp
+
+# Single-node PageRank engine, alternative to the Redis BSP cluster (controller.py + worker.py)
+# Loads edges.tsv into a CSR matrix and runs the same damping / dangling / L1 convergence logic
+# as vectorized sparse mat-vec products. Writes the result to pr:ranks:current so
+# export_pagerank_sql.py keeps working unchanged.
+
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+EDGE_FILE = "/app/data/edges.tsv"
+MAX_ITERATIONS = 100
+DAMPING_FACTOR = 0.85
+CONVERGENCE_THRESHOLD = 1e-06
+LOG_FILE = "/app/log/output/pr_convergence_matrix.csv"
+BATCH_SIZE = 5000
+
+
+def load_graph(edge_file):
+    # Map node ids to dense indices, keep duplicate edges (worker.py scatters once per link occurrence)
+    print(f"Loading graph from {edge_file}...")
+    node_index = {}
+    nodes = []
+    src = []
+    dst = []
+
+    with open(edge_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) < 2: continue
+            u, v = int(parts[0]), int(parts[1])
+
+            for node in (u, v):
+                if node not in node_index:
+                    node_index[node] = len(nodes)
+                    nodes.append(node)
+
+            src.append(node_index[u])
+            dst.append(node_index[v])
+
+    n = len(nodes)
+    src = np.asarray(src, dtype=np.int64)
+    dst = np.asarray(dst, dtype=np.int64)
+
+    out_degree = np.bincount(src, minlength=n).astype(np.float64)
+
+    # M[v, u] = (#links u->v) / out_degree(u); duplicates are summed by the COO -> CSR conversion
+    weights = 1.0 / out_degree[src]
+    matrix = sp.coo_matrix((weights, (dst, src)), shape=(n, n)).tocsr()
+
+    print(f"Graph Stats: {n} Nodes, {len(src)} Edges.")
+    return nodes, matrix, out_degree == 0
+
+
+def compute_pagerank(matrix, dangling_mask, log_file=None):
+    n = matrix.shape[0]
+    ranks = np.full(n, 1.0 / n, dtype=np.float64)
+
+    if log_file:
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        with open(log_file, mode='w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Round', 'Duration_Seconds', 'Diff_Value'])
+
+    for round_id in range(1, MAX_ITERATIONS + 1):
+        start_time = time.time()
+
+        # Same update as controller.py: base value carries teleport + dangling mass
+        dangling_sum = ranks[dangling_mask].sum()
+        base_value = (1.0 - DAMPING_FACTOR + (DAMPING_FACTOR * dangling_sum)) / n
+
+        new_ranks = base_value + DAMPING_FACTOR * matrix.dot(ranks)
+        total_diff = np.abs(new_ranks - ranks).sum()
+        ranks = new_ranks
+
+        duration = time.time() - start_time
+        print(f"  -> Round {round_id} Done. Time: {duration:.4f}s, Diff: {total_diff:.6f}")
+        if log_file:
+            with open(log_file, mode='a', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow([round_id, round(duration, 4), f"{total_diff:.10f}"])
+
+        if total_diff < CONVERGENCE_THRESHOLD:
+            print(f"Converged at Round {round_id}! (Diff {total_diff} < {CONVERGENCE_THRESHOLD})")
+            break
+
+    return ranks
+
+
+def save_ranks(r, nodes, ranks):
+    print(" Writing ranks to pr:ranks:current...")
+    r.delete("pr:ranks:current")
+
+    pipe = r.pipeline()
+    for i in range(0, len(nodes), BATCH_SIZE):
+        chunk = {nodes[j]: float(ranks[j]) for j in range(i, min(i + BATCH_SIZE, len(nodes)))}
+        pipe.hset("pr:ranks:current", mapping=chunk)
+        pipe.execute()
+
+    pipe.set("sys:node_count", len(nodes))
+    pipe.execute()
+
+
+def run_matrix_pagerank(edge_file=EDGE_FILE, log_file=LOG_FILE):
+    if not os.path.exists(edge_file):
+        print(f"Edge file not found: {edge_file}. Run extract_edges.py first.")
+        sys.exit(1)
+
+    print(f"CONVERGENCE_THRESHOLD = {CONVERGENCE_THRESHOLD}")
+    start_time = time.time()
+    nodes, matrix, dangling_mask = load_graph(edge_file)
+    print(f"Graph loaded in {time.time() - start_time:.2f}s")
+
+    ranks = compute_pagerank(matrix, dangling_mask, log_file)
+
+    r = redis.Redis(host=REDIS_HOST, port=6379, decode_responses=True)
+    save_ranks(r, nodes, ranks)
+
+    print(f"\nPageRank Completed in {time.time() - start_time:.2f}s.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--edges", default=EDGE_FILE)
+    parser.add_argument("--log", default=LOG_FILE)
+    args = parser.parse_args()
+
+    run_matrix_pagerank(args.edges, args.log)
@@ -0,0 +1,22 @@
+# BM25 shared by the reducer (index-time score bounds) and serving (query-time scoring)
+# Both sides must use the same k1 / b, otherwise the stored upper bounds are not valid.
+
+import math
+
+K1 = 1.5
+B = 0.4
+
+
+def bm25_idf(n_docs, doc_freq):
+    val = (n_docs - doc_freq + 0.5) / (doc_freq + 0.5) + 1
+
+    # Prevent log(0) issue
+    if val <= 0: val = 1.00001
+    return math.log(val)
+
+
+def bm25_tf_norm(tf, doc_length, avgdl, k1=K1, b=B):
+    # Works on python numbers and numpy arrays alike; always < k1 + 1
+    numerator = tf * (k1 + 1)
+    denominator = tf + k1 * (1 - b + b * (doc_length / avgdl))
+    return numerator / denominator
@@ -0,0 +1,87 @@
+# Tier-1 "champion lists": per term, the CHAMPION_LIST_SIZE postings with the highest static score
+#
+#     static(d) = impact(d) + pr_weight * pr_norm(d)
+#
+# impact is the BM25 term-frequency part stored in the postings (compute/utils/bm25.py), pr_norm
+# the log-normalized PageRank serving uses (serving/doc_stats.py). pr_weight = BETA / (ALPHA * idf)
+# makes static(d) proportional to a one-term query's base score alpha * bm25 + beta * pr_norm
+# with serving's default weights, so the champions are that query's best docs.
+#
+# Stored next to the full list (inverted_index.champions, .champion_bound, .champion_pr_weight):
+# the champions as an ordinary posting list in doc order (compute/utils/postings_codec.py), the
+# term's pr_weight, and the bound: the highest static score of a doc left out. A doc outside the
+# champion list therefore has impact <= bound - pr_weight * pr_norm(d), which is what lets serving
+# tell whether the champions alone already give the exact top k (serving/scoring.py).
+# Lists of at most CHAMPION_LIST_SIZE postings get no champion list, they are their own tier 1.
+#
+# The bound only holds for the PageRank scores it was computed with: config.champions_pagerank
+# keeps a fingerprint of them, and serving ignores the champion lists once PageRank changes
+# (until compute/indexing/build_champions.py rebuilds them).
+
+import os
+import hashlib
+import numpy as np
+
+from compute.utils.bm25 import bm25_idf
+from compute.utils.postings_codec import encode_postings
+
+CHAMPION_LIST_SIZE = int(os.getenv("CHAMPION_LIST_SIZE", "2000"))
+
+# serving's default alpha / beta (serving/search_engine.py)
+ALPHA = 0.7
+BETA = 0.3
+
+PR_SCALE = 10000000
+
+
+def pr_norm_values(pagerank):
+    # pagerank: dense float32 scores indexed by doc id -> log-normalized, as float64
+    return np.log(1 + pagerank.astype(np.float64) * PR_SCALE)
+
+
+def dense_pagerank(rows):
+    # (doc_id, score) rows of the pagerank table -> dense float32 array indexed by doc id
+    rows = list(rows)
+    size = max([doc_id for doc_id, _ in rows] + [-1]) + 1
+    pagerank = np.zeros(size, dtype=np.float32)
+    if rows:
+        ids, values = zip(*rows)
+        pagerank[list(ids)] = values
+    return pagerank
+
+
+def pagerank_fingerprint(pagerank):
+    # 48-bit hash of the scores (trailing zeros ignored), small enough for a config value
+    nonzero = np.flatnonzero(pagerank)
+    scores = np.ascontiguousarray(pagerank[:nonzero[-1] + 1] if nonzero.size else pagerank[:0], dtype=np.float32)
+    return int(hashlib.sha1(scores.tobytes()).hexdigest()[:12], 16)
+
+
+def save_champions_pagerank(conn, fingerprint):
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO config (key, value) VALUES (%s, %s)
+            ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value;
+        """, ('champions_pagerank', fingerprint))
+
+
+def build_champions(doc_ids, tfs, impacts, pr_norm, n_docs, size=CHAMPION_LIST_SIZE):
+    # one term's full list (doc_ids ascending, tfs, impacts) and pr_norm_values() of all docs
+    # -> (champion postings, bound, pr_weight), or None if the list is short enough as it is
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    if doc_ids.size <= size:
+        return None
+    tfs = np.asarray(tfs, dtype=np.int64)
+    impacts = np.asarray(impacts, dtype=np.float64)
+
+    pr_weight = BETA / (ALPHA * bm25_idf(n_docs, doc_ids.size))
+    pr = np.zeros(doc_ids.size)
+    in_range = doc_ids < pr_norm.size
+    pr[in_range] = pr_norm[doc_ids[in_range]]
+    static = impacts + pr_weight * pr
+
+    # highest static scores, ties to the lower doc id; kept in doc order
+    order = np.lexsort((doc_ids, -static))
+    champions = np.sort(order[:size])
+    bound = float(static[order[size:]].max())
+    return encode_postings(doc_ids[champions], tfs[champions], impacts[champions]), bound, pr_weight
@@ -0,0 +1,280 @@
+# Compressed document store for article text, written by compute/export_metadata.py and
+# mmap'd by the backend (serving/search_engine.py) for snippets, so they never touch Postgres.
+#
+# All texts are concatenated (utf-8) into one stream that is cut into fixed-size blocks,
+# each compressed on its own; reading a byte range decompresses only the blocks it overlaps,
+# so a snippet window costs one or two blocks whatever the article length.
+#
+# Files in a doc store directory (DOC_STORE_DIR):
+#   docstore.blocks   compressed blocks back to back
+#   docstore.terms    per doc first-occurrence term offsets (compute/utils/term_offsets.py layout,
+#                       byte offsets into the doc text), 8-byte aligned
+#   docstore.seg      section file (compute/utils/segments.py): block_offsets u64[nb+1] into
+#                       docstore.blocks, text_starts/text_ends u64[n] into the stream,
+#                       term_starts u64[n] into docstore.terms, term_counts u32[n], dictionary
+#   docstore.json     codec, block size, doc count; written last, readers start from it
+#   docstore.seg.remap a renumbered docstore.seg waiting for its reorder to commit, see remap_doc_store()
+#
+# zstd with a dictionary trained on the first documents when zstandard is installed,
+# otherwise zlib with those documents as preset dictionary.
+
+import os
+import json
+import zlib
+import threading
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from compute.utils.segments import write_sections, read_sections, map_file
+from compute.utils.term_offsets import decode_offsets, byte_offsets
+
+STORE_NAME = "docstore"
+MANIFEST_FILE = "docstore.json"
+# staged docstore.seg of a renumbering, see remap_doc_store()
+REMAP_SUFFIX = ".remap"
+BLOCK_SIZE = int(os.getenv("DOC_STORE_BLOCK_KB", "16")) * 1024
+TRAIN_BYTES = 8 * 1024 * 1024
+ZSTD_DICT_SIZE = 112 * 1024
+ZSTD_LEVEL = 9
+ZLIB_DICT_SIZE = 32 * 1024  # zlib only looks back 32KB
+
+
+def _pad(n):
+    return (8 - n % 8) % 8
+
+
+class DocStoreWriter:
+    # Streams texts to disk; the first TRAIN_BYTES are held back to train the dictionary.
+    # Per-doc arrays are kept in memory, indexed by doc_id.
+
+    def __init__(self, directory, block_size=BLOCK_SIZE):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.path = os.path.join(directory, STORE_NAME)
+        self.block_size = block_size
+        self.codec = "zstd" if zstandard is not None else "zlib"
+
+        self._blocks = open(self.path + ".blocks.tmp", 'wb')
+        self._terms = open(self.path + ".terms.tmp", 'wb')
+        self._buffer = bytearray()  # uncompressed stream not yet cut into blocks
+        self._compress = None
+        self.dictionary = b''
+
+        self.position = 0
+        self.terms_position = 0
+        self.block_offsets = [0]
+        self.text_ranges = {}
+        self.term_ranges = {}
+
+    def add(self, doc_id, text, offsets=None):
+        # offsets: term offsets blob with character offsets, as stored in doc_texts.term_offsets
+        if not text: return
+        data = text.encode('utf-8')
+        self.text_ranges[doc_id] = (self.position, self.position + len(data))
+        self.position += len(data)
+        self._buffer += data
+
+        if offsets is not None:
+            hashes, positions = decode_offsets(offsets)
+            blob = (hashes.astype('<i8').tobytes() +
+                    byte_offsets(text, positions).astype('<u4').tobytes())
+            self._terms.write(blob + b'\0' * _pad(len(blob)))
+            self.term_ranges[doc_id] = (self.terms_position, hashes.size)
+            self.terms_position += len(blob) + _pad(len(blob))
+
+        if self._compress is None:
+            if len(self._buffer) >= TRAIN_BYTES:
+                self._train()
+        else:
+            self._flush_blocks(final=False)
+
+    def tee(self, rows):
+        # pass (doc_id, text, term offsets) rows through, recording them on the way
+        for row in rows:
+            self.add(*row)
+            yield row
+
+    def _train(self):
+        samples = [bytes(self._buffer[i:i + 4096]) for i in range(0, len(self._buffer), 4096)]
+        if self.codec == "zstd":
+            try:
+                self.dictionary = zstandard.train_dictionary(ZSTD_DICT_SIZE, samples).as_bytes()
+            except zstandard.ZstdError:
+                # too little text to train on
+                self.dictionary = b''
+            dict_data = zstandard.ZstdCompressionDict(self.dictionary) if self.dictionary else None
+            compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dict_data)
+            self._compress = compressor.compress
+        else:
+            self.dictionary = bytes(self._buffer[:ZLIB_DICT_SIZE])
+            dictionary = self.dictionary
+
+            def compress(data):
+                c = zlib.compressobj(9, zdict=dictionary) if dictionary else zlib.compressobj(9)
+                return c.compress(data) + c.flush()
+            self._compress = compress
+        self._flush_blocks(final=False)
+
+    def _flush_blocks(self, final):
+        size = self.block_size
+        start = 0
+        while len(self._buffer) - start >= size or (final and start < len(self._buffer)):
+            block = self._compress(bytes(self._buffer[start:start + size]))
+            self._blocks.write(block)
+            self.block_offsets.append(self.block_offsets[-1] + len(block))
+            start += size
+        del self._buffer[:start]
+
+    def close(self, manifest=None):
+        if self._compress is None:
+            self._train()
+        self._flush_blocks(final=True)
+        self._blocks.close()
+        self._terms.close()
+        os.replace(self.path + ".blocks.tmp", self.path + ".blocks")
+        os.replace(self.path + ".terms.tmp", self.path + ".terms")
+
+        n = max(list(self.text_ranges) + list(self.term_ranges), default=-1) + 1
+        text_starts = np.zeros(n, dtype=np.uint64)
+        text_ends = np.zeros(n, dtype=np.uint64)
+        term_starts = np.zeros(n, dtype=np.uint64)
+        term_counts = np.zeros(n, dtype=np.uint32)
+        for doc_id, (start, end) in self.text_ranges.items():
+            text_starts[doc_id], text_ends[doc_id] = start, end
+        for doc_id, (start, count) in self.term_ranges.items():
+            term_starts[doc_id], term_counts[doc_id] = start, count
+
+        write_sections(self.path + ".seg", {
+            "block_offsets": np.array(self.block_offsets, dtype=np.uint64),
+            "text_starts": text_starts,
+            "text_ends": text_ends,
+            "term_starts": term_starts,
+            "term_counts": term_counts,
+            "dictionary": np.frombuffer(self.dictionary, dtype=np.uint8),
+        })
+        # a remap staged for the store this one replaces would renumber it twice
+        discard_doc_store_remap(self.directory)
+
+        manifest = dict(manifest or {}, codec=self.codec, block_size=self.block_size, n_docs=len(self.text_ranges))
+        tmp_path = os.path.join(self.directory, MANIFEST_FILE + ".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.directory, MANIFEST_FILE))
+        return len(self.text_ranges)
+
+    def abort(self):
+        for f, name in ((self._blocks, ".blocks.tmp"), (self._terms, ".terms.tmp")):
+            f.close()
+            if os.path.exists(self.path + name):
+                os.remove(self.path + name)
+
+
+def remap_doc_store(directory, old_of_new, doc_order_version):
+    # Stages a renumbering of the docs of a store (compute/indexing/reorder_docs.py): doc i gets
+    # the text and term offsets of doc old_of_new[i]. Only docstore.seg changes, the blocks stay
+    # as they are; the new one is written next to it as docstore.seg.remap, tagged with the
+    # doc_order_version it belongs to, and apply_doc_store_remap() swaps it in once that
+    # version is committed. Returns False if the directory has no store.
+    if not os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+        return False
+    path = os.path.join(directory, STORE_NAME) + ".seg"
+    _, arrays = read_sections(path)
+    sections = dict(arrays)
+    for name in ("text_starts", "text_ends", "term_starts", "term_counts"):
+        old = arrays[name]
+        remapped = np.zeros(old_of_new.size, dtype=old.dtype)
+        in_range = old_of_new < old.size
+        remapped[in_range] = old[old_of_new[in_range]]
+        sections[name] = remapped
+    sections["doc_order_version"] = np.array([doc_order_version], dtype=np.uint64)
+    write_sections(path + REMAP_SUFFIX, sections)
+    return True
+
+
+def apply_doc_store_remap(directory, doc_order_version):
+    # Swaps in a staged remap if it belongs to doc_order_version (the committed one), drops it
+    # otherwise (its reorder rolled back). True if one was swapped in.
+    path = os.path.join(directory, STORE_NAME) + ".seg"
+    if not os.path.exists(path + REMAP_SUFFIX):
+        return False
+    _, arrays = read_sections(path + REMAP_SUFFIX)
+    if int(arrays["doc_order_version"][0]) != doc_order_version:
+        discard_doc_store_remap(directory)
+        return False
+    os.replace(path + REMAP_SUFFIX, path)
+    return True
+
+
+def discard_doc_store_remap(directory):
+    path = os.path.join(directory, STORE_NAME) + ".seg" + REMAP_SUFFIX
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class DocStore:
+    # Read side; same text()/text_bytes()/term_offsets() as compute/utils/segments.DocSegment
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, MANIFEST_FILE), 'r') as f:
+            self.manifest = json.load(f)
+        path = os.path.join(directory, STORE_NAME)
+        self._map, self.arrays = read_sections(path + ".seg")
+        self.blocks = map_file(path + ".blocks")
+        self.terms = map_file(path + ".terms")
+        self.block_size = self.manifest["block_size"]
+        self.codec = self.manifest["codec"]
+        self.dictionary = self.arrays["dictionary"].tobytes()
+
+        if self.codec == "zstd" and zstandard is None:
+            raise RuntimeError("doc store is zstd-compressed but zstandard is not installed")
+        self._dict_data = zstandard.ZstdCompressionDict(self.dictionary) if self.codec == "zstd" and self.dictionary else None
+        # zstd decompression contexts are not thread-safe, one per thread
+        self._local = threading.local()
+
+    def _decompress(self, block):
+        if self.codec == "zstd":
+            decompressor = getattr(self._local, "decompressor", None)
+            if decompressor is None:
+                decompressor = self._local.decompressor = zstandard.ZstdDecompressor(dict_data=self._dict_data)
+            return decompressor.decompress(block)
+        d = zlib.decompressobj(zdict=self.dictionary) if self.dictionary else zlib.decompressobj()
+        return d.decompress(block) + d.flush()
+
+    def _read(self, start, end):
+        # bytes [start, end) of the uncompressed stream
+        if end <= start:
+            return b''
+        offsets = self.arrays["block_offsets"]
+        first, last = start // self.block_size, (end - 1) // self.block_size
+        data = b''.join(self._decompress(self.blocks[int(offsets[i]):int(offsets[i + 1])])
+                        for i in range(first, last + 1))
+        base = first * self.block_size
+        return data[start - base:end - base]
+
+    def _text_range(self, doc_id):
+        starts, ends = self.arrays["text_starts"], self.arrays["text_ends"]
+        if doc_id >= starts.size:
+            return 0, 0
+        return int(starts[doc_id]), int(ends[doc_id])
+
+    def text(self, doc_id):
+        start, end = self._text_range(doc_id)
+        return self._read(start, end).decode('utf-8') if end > start else None
+
+    def text_bytes(self, doc_id, offset, length):
+        # utf-8 bytes [offset, offset + length) of one text, may split a character at either end
+        start, end = self._text_range(doc_id)
+        return self._read(min(start + offset, end), min(start + offset + length, end))
+
+    def term_offsets(self, doc_id):
+        # (sorted term hashes, byte offsets into the text), None if the doc has none
+        counts = self.arrays["term_counts"]
+        if doc_id >= counts.size or counts[doc_id] == 0:
+            return None
+        start, n = int(self.arrays["term_starts"][doc_id]), int(counts[doc_id])
+        return decode_offsets(self.terms[start:start + n * 12])
@@ -0,0 +1,89 @@
+# Positional postings, stored next to the frequency postings of a term (inverted_index.positions)
+#
+# Layout (little endian), version 1:
+#   header    : version (u8), df (u32), payload length (u32)
+#   directory : byte offset (u32) into the payload of each block of BLOCK_SIZE docs
+#   payload   : per doc, in the doc order of the posting list, its positions as varints:
+#               the first position, then the gaps between consecutive positions
+#
+# A position is the index of a token in the analyzed text (compute/utils/tokenizer.py), so
+# stop words are not counted. A doc has tf positions and its blocks line up with the blocks of
+# the posting list (compute/utils/postings_codec.py): the positions of a few docs are read by
+# finding their blocks in the posting list and decoding only those, the rest is never touched.
+
+import struct
+import numpy as np
+
+from compute.utils.postings_codec import BLOCK_SIZE, decode_varints
+
+POSITIONS_VERSION = 1
+
+HEADER = struct.Struct('<BII')
+DIR_DTYPE = np.dtype('<u4')
+
+
+def encode_doc_positions(positions):
+    # positions of one term in one doc, ascending -> the doc's part of the payload.
+    # Pure python: called by the mapper for every (term, doc) pair, mostly with a handful of
+    # positions, where numpy setup cost dominates
+    out = bytearray()
+    previous = 0
+    for position in positions:
+        gap = position - previous
+        previous = position
+        while gap >= 0x80:
+            out.append((gap & 0x7f) | 0x80)
+            gap >>= 7
+        out.append(gap)
+    return bytes(out)
+
+
+def encode_positions(chunks):
+    # chunks: encode_doc_positions() of every doc of a posting list, in its doc-id order
+    df = len(chunks)
+    payload = b''.join(chunks)
+    sizes = np.fromiter((len(c) for c in chunks), dtype=np.int64, count=df)
+    starts = np.concatenate([[0], np.cumsum(sizes)])[np.arange(0, df, BLOCK_SIZE)]
+    return HEADER.pack(POSITIONS_VERSION, df, len(payload)) + starts.astype(DIR_DTYPE).tobytes() + payload
+
+
+def directory_size(df):
+    # bytes of header + directory, the part of a blob to read before any block
+    return HEADER.size + (df + BLOCK_SIZE - 1) // BLOCK_SIZE * DIR_DTYPE.itemsize
+
+
+def read_directory(head):
+    # head: at least directory_size(df) leading bytes of a blob -> (df, payload length, block offsets)
+    version, df, payload_len = HEADER.unpack_from(head, 0)
+    if version != POSITIONS_VERSION:
+        raise ValueError(f"Unsupported positions format version {version}")
+    num_blocks = (df + BLOCK_SIZE - 1) // BLOCK_SIZE
+    offsets = np.frombuffer(head, dtype=DIR_DTYPE, count=num_blocks, offset=HEADER.size).astype(np.int64)
+    return df, payload_len, offsets
+
+
+def block_range(df, payload_len, offsets, block_idx):
+    # (start, end) byte range of one block within the blob
+    base = directory_size(df)
+    end = offsets[block_idx + 1] if block_idx + 1 < offsets.size else payload_len
+    return base + int(offsets[block_idx]), base + int(end)
+
+
+def decode_block_positions(buf, tfs):
+    # bytes of one block (or of several blocks joined) and the tfs of their docs
+    # -> positions of all those docs back to back (doc i owns tfs[i] of them)
+    values = decode_varints(buf, int(tfs.sum()))
+    ends = np.cumsum(values)
+    firsts = np.concatenate([[0], np.cumsum(tfs)[:-1]])
+    return ends - np.repeat(ends[firsts] - values[firsts], tfs)
+
+
+def doc_chunks(blob, tfs):
+    # the per-doc parts of a whole blob, e.g. to split a list by doc (compute/export_segments.py)
+    df, payload_len, _ = read_directory(blob)
+    payload = np.frombuffer(blob, dtype=np.uint8, count=payload_len, offset=directory_size(df))
+    value_ends = np.flatnonzero(payload < 0x80) + 1
+    ends = value_ends[np.cumsum(tfs) - 1]
+    starts = np.concatenate([[0], ends[:-1]])
+    data = payload.tobytes()
+    return [data[s:e] for s, e in zip(starts.tolist(), ends.tolist())]
@@ -0,0 +1,247 @@
+# Binary postings codec, replaces the JSONB {doc_id: tf} postings
+#
+# Layout (little endian), version 2:
+#   header      : version (u8), df (u32), max_tf (u32), payload length (u32), max impact (f32)
+#   directory   : one (last_doc_id u32, byte offset u32, block max impact f32) entry per block
+#   payload     : blocks of BLOCK_SIZE postings, each block = doc-id gaps (varint) then tfs (varint)
+#
+# Doc ids are sorted ascending. The first gap of a block is relative to the last doc id
+# of the previous block (0 for the first block), so every block can be decoded on its own.
+# The directory lets readers skip blocks without touching their bytes.
+#
+# "Impact" is the BM25 term-frequency part (compute/utils/bm25.py bm25_tf_norm), idf is
+# applied at query time. Block / list maxima are rounded up so they stay valid upper bounds;
+# lists encoded without impacts store +inf. Version 1 (no impacts) is still readable.
+
+import struct
+import numpy as np
+
+FORMAT_VERSION = 2
+BLOCK_SIZE = 128
+
+HEADER_V1 = struct.Struct('<BIII')
+HEADER = struct.Struct('<BIIIf')
+DIR_DTYPE_V1 = np.dtype([('last_doc', '<u4'), ('offset', '<u4')])
+DIR_DTYPE = np.dtype([('last_doc', '<u4'), ('offset', '<u4'), ('max_impact', '<f4')])
+
+
+def varint_sizes(values):
+    nbytes = np.ones(values.shape, dtype=np.int64)
+    for shift in (7, 14, 21, 28, 35):
+        nbytes += values >= (1 << shift)
+    return nbytes
+
+
+def encode_varints(values, nbytes=None):
+    # Vectorized LEB128: 7 bits per byte, high bit set on every byte but the last
+    values = np.asarray(values, dtype=np.uint64)
+    if values.size == 0:
+        return b''
+    if nbytes is None:
+        nbytes = varint_sizes(values)
+
+    ends = np.cumsum(nbytes)
+    starts = ends - nbytes
+    out = np.zeros(int(ends[-1]), dtype=np.uint8)
+
+    for k in range(int(nbytes.max())):
+        mask = nbytes > k
+        chunk = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        more = (nbytes[mask] - 1 > k).astype(np.uint64) << np.uint64(7)
+        out[starts[mask] + k] = (chunk | more).astype(np.uint8)
+
+    return out.tobytes()
+
+
+def decode_varints(buf, count=None):
+    # Vectorized LEB128 decode of the first `count` varints (all if None)
+    arr = np.frombuffer(buf, dtype=np.uint8)
+    ends = np.flatnonzero(arr < 0x80)
+    if count is not None:
+        ends = ends[:count]
+    if ends.size == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    arr = arr[:ends[-1] + 1]
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+
+    lengths = ends - starts + 1
+    pos = np.arange(arr.size) - np.repeat(starts, lengths)
+    parts = (arr & 0x7f).astype(np.uint64) << (np.uint64(7) * pos.astype(np.uint64))
+    return np.add.reduceat(parts, starts).astype(np.int64)
+
+
+def iter_varints(buf, offset=0):
+    # Pure python decoder, used for lazy iteration where numpy setup cost dominates
+    value = 0
+    shift = 0
+    for i in range(offset, len(buf)):
+        b = buf[i]
+        value |= (b & 0x7f) << shift
+        if b < 0x80:
+            yield value
+            value = 0
+            shift = 0
+        else:
+            shift += 7
+
+
+def interleave_blocks(gaps, tfs):
+    # Per block: BLOCK_SIZE gaps followed by the same number of tfs
+    df = gaps.size
+    full = df // BLOCK_SIZE * BLOCK_SIZE
+    parts = [np.hstack([gaps[:full].reshape(-1, BLOCK_SIZE), tfs[:full].reshape(-1, BLOCK_SIZE)]).ravel()]
+    if full < df:
+        parts.append(gaps[full:])
+        parts.append(tfs[full:])
+    return np.concatenate(parts)
+
+
+def deinterleave_blocks(values, count):
+    full = count // BLOCK_SIZE * BLOCK_SIZE
+    blocks = values[:2 * full].reshape(-1, 2 * BLOCK_SIZE)
+    gaps = [blocks[:, :BLOCK_SIZE].ravel()]
+    tfs = [blocks[:, BLOCK_SIZE:].ravel()]
+    if full < count:
+        tail = count - full
+        gaps.append(values[2 * full:2 * full + tail])
+        tfs.append(values[2 * full + tail:2 * count])
+    return np.concatenate(gaps), np.concatenate(tfs)
+
+
+def round_up_f32(values):
+    values = np.asarray(values, dtype=np.float64)
+    rounded = values.astype(np.float32)
+    low = rounded < values
+    rounded[low] = np.nextafter(rounded[low], np.float32(np.inf))
+    return rounded
+
+
+def encode_postings(doc_ids, tfs, impacts=None):
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    tfs = np.asarray(tfs, dtype=np.int64)
+    df = int(doc_ids.size)
+    max_tf = int(tfs.max()) if df else 0
+
+    if df == 0:
+        return HEADER.pack(FORMAT_VERSION, 0, 0, 0, 0.0)
+
+    order = np.argsort(doc_ids, kind='stable')
+    doc_ids = doc_ids[order]
+    tfs = tfs[order]
+    if impacts is None:
+        impacts = np.full(df, np.inf)
+    else:
+        impacts = np.asarray(impacts, dtype=np.float64)[order]
+
+    # Gaps against the previous doc id; at a block boundary that is the previous block's last doc
+    gaps = np.diff(doc_ids, prepend=0)
+    values = interleave_blocks(gaps, tfs).astype(np.uint64)
+    nbytes = varint_sizes(values)
+    payload = encode_varints(values, nbytes)
+
+    block_starts = np.arange(0, df, BLOCK_SIZE)
+    value_starts = 2 * block_starts
+    byte_ends = np.cumsum(nbytes)
+    offsets = np.concatenate([[0], byte_ends])[value_starts]
+    last_docs = doc_ids[np.minimum(block_starts + BLOCK_SIZE, df) - 1]
+
+    block_max = round_up_f32(np.maximum.reduceat(impacts, block_starts))
+
+    directory = np.empty(block_starts.size, dtype=DIR_DTYPE)
+    directory['last_doc'] = last_docs
+    directory['offset'] = offsets
+    directory['max_impact'] = block_max
+
+    header = HEADER.pack(FORMAT_VERSION, df, max_tf, len(payload), float(block_max.max()))
+    return header + directory.tobytes() + payload
+
+
+def read_header(blob):
+    version = blob[0]
+    if version == FORMAT_VERSION:
+        _, df, max_tf, payload_len, max_impact = HEADER.unpack_from(blob, 0)
+    elif version == 1:
+        _, df, max_tf, payload_len = HEADER_V1.unpack_from(blob, 0)
+        max_impact = float('inf')
+    else:
+        raise ValueError(f"Unsupported postings format version {version}")
+    return df, max_tf, payload_len, max_impact
+
+
+class PostingsReader:
+    # Lazy reader over one encoded posting list; blocks are only decoded when asked for
+
+    def __init__(self, blob):
+        self.blob = memoryview(blob)
+        self.df, self.max_tf, self.payload_len, self.max_impact = read_header(self.blob)
+        # df for idf; a shard's slice of a list is scored with the df of the whole collection
+        self.collection_df = self.df
+        self.num_blocks = (self.df + BLOCK_SIZE - 1) // BLOCK_SIZE
+
+        if self.blob[0] == 1:
+            header_size, dir_dtype = HEADER_V1.size, DIR_DTYPE_V1
+        else:
+            header_size, dir_dtype = HEADER.size, DIR_DTYPE
+
+        dir_end = header_size + self.num_blocks * dir_dtype.itemsize
+        directory = np.frombuffer(self.blob[header_size:dir_end], dtype=dir_dtype)
+        self.block_last_doc = directory['last_doc'].astype(np.int64)
+        self.block_offset = directory['offset'].astype(np.int64)
+        if 'max_impact' in dir_dtype.names:
+            self.block_max_impact = directory['max_impact'].astype(np.float64)
+        else:
+            self.block_max_impact = np.full(self.num_blocks, np.inf)
+        self.payload_start = dir_end
+
+    def block_len(self, block_idx):
+        if block_idx == self.num_blocks - 1:
+            return self.df - block_idx * BLOCK_SIZE
+        return BLOCK_SIZE
+
+    def block_bytes(self, block_idx):
+        start = self.payload_start + int(self.block_offset[block_idx])
+        if block_idx + 1 < self.num_blocks:
+            end = self.payload_start + int(self.block_offset[block_idx + 1])
+        else:
+            end = self.payload_start + self.payload_len
+        return self.blob[start:end]
+
+    def decode_block(self, block_idx):
+        n = self.block_len(block_idx)
+        values = decode_varints(self.block_bytes(block_idx), 2 * n)
+        base = int(self.block_last_doc[block_idx - 1]) if block_idx > 0 else 0
+        doc_ids = np.cumsum(values[:n]) + base
+        return doc_ids, values[n:]
+
+    def decode(self, limit=None):
+        # Decode the first `limit` postings (all if None), touching only the blocks needed
+        count = self.df if limit is None else min(limit, self.df)
+        if count == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        num_blocks = (count - 1) // BLOCK_SIZE + 1
+        if num_blocks < self.num_blocks:
+            end = self.payload_start + int(self.block_offset[num_blocks])
+        else:
+            end = self.payload_start + self.payload_len
+        decoded = min(num_blocks * BLOCK_SIZE, self.df)
+
+        values = decode_varints(self.blob[self.payload_start:end], 2 * decoded)
+        gaps, tfs = deinterleave_blocks(values, decoded)
+        return np.cumsum(gaps)[:count], tfs[:count]
+
+    def __iter__(self):
+        for block_idx in range(self.num_blocks):
+            n = self.block_len(block_idx)
+            values = list(iter_varints(self.block_bytes(block_idx)))
+            doc_id = int(self.block_last_doc[block_idx - 1]) if block_idx > 0 else 0
+            for i in range(n):
+                doc_id += values[i]
+                yield doc_id, values[n + i]
+
+
+def decode_postings(blob, limit=None):
+    return PostingsReader(blob).decode(limit)
@@ -0,0 +1,41 @@
+# Sorted run files for the indexing shuffle
+# A run is a sequence of frames: 4-byte little endian length + pickled list of records.
+# Readers only hold one frame per run in memory, so the reducer can k-way merge
+# any number of runs with memory bounded by (#runs x frame size).
+
+import os
+import pickle
+import struct
+
+FRAME_HEADER = struct.Struct('<I')
+FRAME_RECORDS = 4096
+READ_BUFFER = 256 * 1024
+
+
+def write_run(path, records, frame_records=FRAME_RECORDS):
+    # records must already be sorted; written to a temp file first so a crashed
+    # mapper never leaves a half-written run behind for the reducer
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        for i in range(0, len(records), frame_records):
+            frame = pickle.dumps(records[i: i + frame_records], protocol=pickle.HIGHEST_PROTOCOL)
+            f.write(FRAME_HEADER.pack(len(frame)))
+            f.write(frame)
+    os.replace(tmp_path, path)
+
+
+def read_run(path, buffer_size=READ_BUFFER):
+    with open(path, 'rb', buffering=buffer_size) as f:
+        while True:
+            header = f.read(FRAME_HEADER.size)
+            if not header:
+                return
+            if len(header) < FRAME_HEADER.size:
+                raise IOError(f"Truncated frame header in {path}")
+
+            (length,) = FRAME_HEADER.unpack(header)
+            frame = f.read(length)
+            if len(frame) < length:
+                raise IOError(f"Truncated frame in {path}")
+
+            yield from pickle.loads(frame)
@@ -0,0 +1,315 @@
+# Immutable on-disk index segments, served with mmap by serving/segment_search_engine.py.
+# Postgres stays the system of record; a segment directory is a read-only copy of one index.
+#
+# Files in a segment directory (INDEX_SEGMENT_DIR):
+#   part-NN.seg       term dictionary of reducer partition NN, terms sorted by their utf-8 bytes:
+#                       term_offsets u64[n+1] into term_bytes, postings_offsets u64[n+1], df u32[n],
+#                       doc_order_version u64[1] of the doc numbering the lists are in (see
+#                       compute/indexing/reorder_docs.py; missing in older segments, read as 0)
+#   part-NN.postings  encoded posting lists (compute/utils/postings_codec.py) back to back
+#   part-NN.positions encoded positions (compute/utils/positions_codec.py) back to back, empty for
+#                       terms indexed without positions; the .seg file then has positions_offsets u64[n+1]
+#   docs.seg          per-doc arrays indexed by doc ordinal (serving/doc_stats.py): lengths, pagerank,
+#                       titles (offsets + utf-8 bytes), title hashes (CSR), text ranges in docs.text,
+#                       first-occurrence term offsets (CSR of hashes + byte offsets into each text)
+#   docs.text         document texts back to back (utf-8), for snippets
+#   manifest.json     index version, avgdl, partitions...; written last, readers start from it
+#   shard-NN/         optional document-partitioned copies (doc_id % num_shards == NN) for
+#                       scatter-gather serving; dfs and doc stats stay collection-wide
+#
+# A .seg file is a small section table followed by 8-byte aligned little endian arrays:
+#   magic (4 bytes), table length (u32), JSON table {name: [dtype, offset, count]}, arrays
+# Readers map the file and wrap each section with np.frombuffer, nothing is copied or parsed.
+# Every file is written under a temp name and renamed, a reader never sees half a file.
+
+import os
+import json
+import mmap
+import struct
+import bisect
+import hashlib
+import numpy as np
+
+SEGMENT_MAGIC = b'SEG1'
+TABLE_HEADER = struct.Struct('<4sI')
+ALIGN = 8
+MANIFEST_FILE = "manifest.json"
+
+
+def term_partition(term, num_partitions):
+    # reducer partition of a term, shared by the mappers and segment readers
+    return int(hashlib.md5(term.encode()).hexdigest(), 16) % num_partitions
+
+
+def partition_name(partition_id):
+    return f"part-{partition_id:02d}"
+
+
+def shard_name(shard_id):
+    return f"shard-{shard_id:02d}"
+
+
+def _aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write_sections(path, sections):
+    # sections: {name: 1-d numpy array}, stored little endian
+    arrays = {name: np.ascontiguousarray(arr, dtype=np.dtype(arr.dtype).newbyteorder('<'))
+              for name, arr in sections.items()}
+
+    # offsets depend on the table size, which depends on the offsets: fix the table width first
+    table = {name: [arr.dtype.str, 0, int(arr.size)] for name, arr in arrays.items()}
+    width = len(json.dumps(table)) + 16 * len(table)
+    offset = _aligned(TABLE_HEADER.size + width)
+    for name, arr in arrays.items():
+        table[name][1] = offset
+        offset = _aligned(offset + arr.nbytes)
+    raw_table = json.dumps(table).encode('utf-8').ljust(width)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(TABLE_HEADER.pack(SEGMENT_MAGIC, width))
+        f.write(raw_table)
+        for name, arr in arrays.items():
+            f.seek(table[name][1])
+            f.write(arr.tobytes())
+        f.truncate(offset)
+    os.replace(tmp_path, path)
+
+
+def map_file(path):
+    # read-only mapping; an empty file cannot be mapped, it reads as empty bytes
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_sections(path):
+    # returns (mapping, {name: read-only array view into the mapping})
+    mm = map_file(path)
+    magic, width = TABLE_HEADER.unpack_from(mm, 0)
+    if magic != SEGMENT_MAGIC:
+        raise ValueError(f"{path} is not a segment file")
+    table = json.loads(bytes(mm[TABLE_HEADER.size:TABLE_HEADER.size + width]))
+    sections = {name: np.frombuffer(mm, dtype=np.dtype(dtype), count=count, offset=offset)
+                for name, (dtype, offset, count) in table.items()}
+    return mm, sections
+
+
+class SegmentWriter:
+    # Streams one reducer partition to disk: blobs go straight to the postings file,
+    # only the dictionary arrays are kept in memory. Terms must arrive sorted.
+
+    def __init__(self, directory, partition_id, doc_order_version=0):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, partition_name(partition_id))
+        self.doc_order_version = doc_order_version
+        self._postings = open(self.path + ".postings.tmp", 'wb')
+        self._positions = open(self.path + ".positions.tmp", 'wb')
+        self.terms = []
+        self.dfs = []
+        self.offsets = [0]
+        self.positions_offsets = [0]
+
+    def add(self, term, df, blob, positions=None):
+        self._postings.write(blob)
+        self.terms.append(term.encode('utf-8'))
+        self.dfs.append(df)
+        self.offsets.append(self.offsets[-1] + len(blob))
+        if positions:
+            self._positions.write(positions)
+        self.positions_offsets.append(self.positions_offsets[-1] + len(positions or b''))
+
+    def tee(self, rows):
+        # pass compute/indexing/reducer.py rows (term, df, max_tf, postings, positions, ...) through,
+        # recording them on the way
+        for row in rows:
+            self.add(row[0], row[1], row[3], row[4] if len(row) > 4 else None)
+            yield row
+
+    def close(self):
+        self._postings.close()
+        self._positions.close()
+        os.replace(self.path + ".postings.tmp", self.path + ".postings")
+        os.replace(self.path + ".positions.tmp", self.path + ".positions")
+
+        term_lengths = np.array([len(t) for t in self.terms], dtype=np.int64)
+        write_sections(self.path + ".seg", {
+            "term_offsets": np.concatenate([[0], np.cumsum(term_lengths)]).astype(np.uint64),
+            "term_bytes": np.frombuffer(b''.join(self.terms), dtype=np.uint8),
+            "postings_offsets": np.array(self.offsets, dtype=np.uint64),
+            "df": np.array(self.dfs, dtype=np.uint32),
+            "positions_offsets": np.array(self.positions_offsets, dtype=np.uint64),
+            "doc_order_version": np.array([self.doc_order_version], dtype=np.uint64),
+        })
+        return len(self.terms)
+
+    def abort(self):
+        self._postings.close()
+        self._positions.close()
+        for suffix in (".postings.tmp", ".positions.tmp"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+
+class TermSegment:
+    # Read side of one partition; lookups binary search the mapped dictionary
+
+    def __init__(self, directory, partition_id):
+        path = os.path.join(directory, partition_name(partition_id))
+        self._dict_map, sections = read_sections(path + ".seg")
+        self.postings = map_file(path + ".postings")
+        self.term_offsets = sections["term_offsets"]
+        self.term_bytes = sections["term_bytes"]
+        self.postings_offsets = sections["postings_offsets"]
+        self.dfs = sections["df"]
+        # segments written before positions existed have neither the section nor the file
+        self.positions_offsets = sections.get("positions_offsets")
+        self.positions = map_file(path + ".positions") if self.positions_offsets is not None else b''
+        version = sections.get("doc_order_version")
+        self.doc_order_version = int(version[0]) if version is not None else 0
+        self._keys = _SortedTerms(self)
+
+    def __len__(self):
+        return self.dfs.size
+
+    def term(self, i):
+        return self.term_bytes[int(self.term_offsets[i]):int(self.term_offsets[i + 1])].tobytes()
+
+    def find(self, term):
+        key = term.encode('utf-8')
+        i = bisect.bisect_left(self._keys, key)
+        if i < len(self) and self.term(i) == key:
+            return i
+        return None
+
+    def blob(self, i):
+        # zero-copy view of the encoded posting list
+        return memoryview(self.postings)[int(self.postings_offsets[i]):int(self.postings_offsets[i + 1])]
+
+    def positions_blob(self, i):
+        # zero-copy view of the encoded positions, None if the term has none
+        if self.positions_offsets is None:
+            return None
+        start, end = int(self.positions_offsets[i]), int(self.positions_offsets[i + 1])
+        return memoryview(self.positions)[start:end] if end > start else None
+
+    def top_terms(self, limit):
+        # (df, term) of the `limit` highest-df terms
+        order = np.argsort(-self.dfs.astype(np.int64), kind='stable')[:limit]
+        return [(int(self.dfs[i]), self.term(i).decode('utf-8')) for i in order]
+
+
+class _SortedTerms:
+    # sequence view for bisect, materializes only the probed terms
+    def __init__(self, segment):
+        self.segment = segment
+
+    def __len__(self):
+        return len(self.segment)
+
+    def __getitem__(self, i):
+        return self.segment.term(i)
+
+
+def write_doc_segment(directory, stats, texts):
+    # stats: serving DocStats snapshot
+    # texts: (doc_id, text, term offsets) rows; term offsets are (sorted term hashes, utf-8 byte
+    # offsets into text) as in compute/utils/term_offsets.py, or None
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "docs")
+    size = len(stats.titles)
+
+    # docs without text keep an empty (0, 0) range
+    text_starts = np.zeros(size, dtype=np.uint64)
+    text_ends = np.zeros(size, dtype=np.uint64)
+    offset_counts = np.zeros(size, dtype=np.int64)
+    offset_hashes, offset_positions = {}, {}
+    position = 0
+    with open(path + ".text.tmp", 'wb') as f:
+        for doc_id, text, offsets in texts:
+            if doc_id >= size or not text: continue
+            data = text.encode('utf-8')
+            f.write(data)
+            text_starts[doc_id] = position
+            position += len(data)
+            text_ends[doc_id] = position
+            if offsets is not None:
+                offset_hashes[doc_id], offset_positions[doc_id] = offsets
+                offset_counts[doc_id] = len(offsets[0])
+    os.replace(path + ".text.tmp", path + ".text")
+
+    ordered = sorted(offset_hashes)
+    titles = [t.encode('utf-8') if t is not None else b'' for t in stats.titles]
+    title_lengths = np.array([len(t) for t in titles], dtype=np.int64)
+    write_sections(path + ".seg", {
+        "lengths": stats.lengths.astype(np.int32),
+        "pagerank": stats.pagerank.astype(np.float32),
+        "has_title": stats.has_title.astype(np.uint8),
+        "title_offsets": np.concatenate([[0], np.cumsum(title_lengths)]).astype(np.uint64),
+        "title_bytes": np.frombuffer(b''.join(titles), dtype=np.uint8),
+        "title_hash_offsets": stats.title_offsets.astype(np.int64),
+        "title_hashes": stats.title_hashes.astype(np.int64),
+        "text_starts": text_starts,
+        "text_ends": text_ends,
+        "term_offset_index": np.concatenate([[0], np.cumsum(offset_counts)]).astype(np.int64),
+        "term_offset_hashes": np.concatenate([np.zeros(0, dtype=np.int64)] +
+                                             [offset_hashes[d] for d in ordered]).astype(np.int64),
+        "term_offset_positions": np.concatenate([np.zeros(0, dtype=np.uint32)] +
+                                                [offset_positions[d] for d in ordered]).astype(np.uint32),
+    })
+
+
+class DocSegment:
+    def __init__(self, directory):
+        path = os.path.join(directory, "docs")
+        self._map, self.arrays = read_sections(path + ".seg")
+        self.texts = map_file(path + ".text")
+
+    def titles(self):
+        offsets = self.arrays["title_offsets"].astype(np.int64)
+        raw = self.arrays["title_bytes"].tobytes()
+        has_title = self.arrays["has_title"]
+        titles = np.full(has_title.size, None, dtype=object)
+        for i in np.flatnonzero(has_title):
+            titles[i] = raw[offsets[i]:offsets[i + 1]].decode('utf-8')
+        return titles
+
+    def _text_range(self, doc_id):
+        starts, ends = self.arrays["text_starts"], self.arrays["text_ends"]
+        if doc_id >= starts.size:
+            return 0, 0
+        return int(starts[doc_id]), int(ends[doc_id])
+
+    def text(self, doc_id):
+        start, end = self._text_range(doc_id)
+        return self.texts[start:end].decode('utf-8') if end > start else None
+
+    def text_bytes(self, doc_id, offset, length):
+        # utf-8 bytes [offset, offset + length) of one text, may split a character at either end
+        start, end = self._text_range(doc_id)
+        return self.texts[min(start + offset, end):min(start + offset + length, end)]
+
+    def term_offsets(self, doc_id):
+        # (sorted term hashes, byte offsets into the text), None if the doc has none
+        index = self.arrays.get("term_offset_index")
+        if index is None or doc_id + 1 >= index.size:
+            return None
+        lo, hi = int(index[doc_id]), int(index[doc_id + 1])
+        if hi == lo:
+            return None
+        return self.arrays["term_offset_hashes"][lo:hi], self.arrays["term_offset_positions"][lo:hi]
+
+
+def write_manifest(directory, manifest):
+    tmp_path = os.path.join(directory, MANIFEST_FILE + ".tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(directory, MANIFEST_FILE))
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_FILE), 'r') as f:
+        return json.load(f)
@@ -0,0 +1,85 @@
+# First-occurrence offsets for snippets
+# Each article stores, for every distinct analyzed term, the character offset of its first
+# occurrence in the text (doc_texts.term_offsets). Terms are keyed by the 64 bit hash of
+# compute/utils/title_terms.py; the blob is the sorted hashes (little endian int64) followed
+# by their offsets (little endian uint32). Serving picks the snippet window from the offsets
+# of the query terms and fetches only that substring of the article.
+
+import re
+from functools import lru_cache
+
+import numpy as np
+
+from compute.utils.tokenizer import analyzer
+from compute.utils.title_terms import term_hash
+
+# same tokens as TextAnalyzer.analyze, matched on the original text so offsets index into it
+TOKEN_PATTERN = re.compile(r'\b[a-zA-Z0-9]{1,}\b')
+
+
+@lru_cache(maxsize=200000)
+def _term(token):
+    # analyzed term of a lowercased token, None for stop words
+    if token in analyzer.stop_words:
+        return None
+    return token if token.isdigit() else analyzer.stemmer.stem(token)
+
+
+def first_offsets(text):
+    # {term: character offset of its first occurrence}
+    offsets = {}
+    if not text: return offsets
+
+    for match in TOKEN_PATTERN.finditer(text):
+        term = _term(match.group().lower())
+        if term is not None and term not in offsets:
+            offsets[term] = match.start()
+    return offsets
+
+
+def encode_offsets(offsets):
+    hashes = np.array([term_hash(t) for t in offsets], dtype=np.int64)
+    positions = np.array(list(offsets.values()), dtype=np.uint32)
+    order = np.argsort(hashes, kind='stable')
+    return hashes[order].astype('<i8').tobytes() + positions[order].astype('<u4').tobytes()
+
+
+def decode_offsets(blob):
+    # (sorted hashes, offsets); views over the blob
+    n = len(blob) // 12
+    hashes = np.frombuffer(blob, dtype='<i8', count=n)
+    positions = np.frombuffer(blob, dtype='<u4', count=n, offset=n * 8)
+    return hashes, positions
+
+
+def query_positions(hashes, positions, query_hashes):
+    # sorted first-occurrence offsets of the query terms that appear in the document
+    idx = np.searchsorted(hashes, query_hashes)
+    idx[idx >= hashes.size] = 0
+    found = hashes[idx] == query_hashes if hashes.size else np.zeros(len(query_hashes), dtype=bool)
+    return np.sort(positions[idx[found]].astype(np.int64))
+
+
+def best_window(positions, span):
+    # (first, last) offsets of the window of at most span characters holding the most
+    # query terms, the earliest one on ties; None if no query term occurs
+    if len(positions) == 0:
+        return None
+
+    best, best_count, lo = (positions[0], positions[0]), 1, 0
+    for hi in range(1, len(positions)):
+        while positions[hi] - positions[lo] > span:
+            lo += 1
+        if hi - lo + 1 > best_count:
+            best, best_count = (positions[lo], positions[hi]), hi - lo + 1
+    return int(best[0]), int(best[1])
+
+
+def byte_offsets(text, positions):
+    # character offsets -> utf-8 byte offsets into the same text
+    positions = np.asarray(positions, dtype=np.int64)
+    if text.isascii():
+        return positions
+    widths = np.fromiter((len(c.encode('utf-8')) for c in text), dtype=np.int64, count=len(text))
+    starts = np.concatenate([[0], np.cumsum(widths)])
+    return starts[positions]
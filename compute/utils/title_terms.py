@@ -0,0 +1,30 @@
+# Title token signatures for the title-match boost
+# A title is analyzed once at index time (same analyzer as queries), each distinct token is
+# hashed to 64 bits and the sorted hashes are stored as packed little endian int64
+# (documents.title_terms). Serving compares them with hashed query tokens, no stemming per query.
+
+import hashlib
+import numpy as np
+
+from compute.utils.tokenizer import analyzer
+
+
+def term_hash(term):
+    # stable across processes, unlike hash()
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+
+def term_hashes(terms):
+    return np.array(sorted({term_hash(t) for t in terms}), dtype=np.int64)
+
+
+def title_signature(title):
+    return term_hashes(analyzer.analyze(title.replace("_", " ")))
+
+
+def encode_signature(hashes):
+    return np.asarray(hashes, dtype='<i8').tobytes()
+
+
+def decode_signature(blob):
+    return np.frombuffer(blob, dtype='<i8').astype(np.int64)
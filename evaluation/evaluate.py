@@ -21,6 +21,7 @@ from compute.db_utils import get_db_connection
 DATA_DIR = "/app/data"
 BENCHMARK_NAME = "dbpedia-entity"
 DATA_PATH = os.path.join(DATA_DIR, "benchmark", BENCHMARK_NAME)
+EVAL_BATCH_SIZE = 500
 
 
 def load_local_doc_ids():
@@ -28,7 +29,7 @@ def load_local_doc_ids():
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute("SELECT doc_id FROM metadata")
+        cur.execute("SELECT d.title FROM metadata m JOIN documents d ON d.doc_id = m.doc_id")
         local_ids = set(row[0] for row in cur.fetchall())
         conn.close()
 
@@ -173,9 +174,13 @@ def run_evaluation():
     print(f"Running search on {len(valid_queries)} queries...")
     run_results = {}
 
-    for qid, query_text in tqdm(valid_queries.items(), desc="Searching"):
-        search_res = engine.search(query_text, topk=100)
-        run_results[qid] = [r['doc_id'] for r in search_res]
+    # batches through search_many: shared postings fetches, queries scored in parallel
+    qids = list(valid_queries)
+    for i in tqdm(range(0, len(qids), EVAL_BATCH_SIZE), desc="Searching"):
+        batch = qids[i: i + EVAL_BATCH_SIZE]
+        batch_results = engine.search_many([valid_queries[qid] for qid in batch], topk=100)
+        for qid, search_res in zip(batch, batch_results):
+            run_results[qid] = [r['doc_id'] for r in search_res]
 
     print("\nCalculating Metrics...")
     final_metrics = calculate_metrics(run_results, valid_qrels)
@@ -78,8 +78,9 @@ def run_manual_evaluation(path: str = QRELS_PATH):
     print(f"Running search for {len(eval_queries)} queries...\n")
 
 
-    for idx, (query, rel_dict) in enumerate(eval_queries):
-        results = engine.search(query, topk=TOPK, alpha=0.5, beta=0.5)
+    batch_results = engine.search_many([query for query, _ in eval_queries], topk=TOPK, alpha=0.5, beta=0.5)
+
+    for idx, ((query, rel_dict), results) in enumerate(zip(eval_queries, batch_results)):
 
 
         ranked_doc_ids = [r["doc_id"].lstrip('_') for r in results]
@@ -54,6 +54,7 @@ def process_wiki_dump():
                         # get rid of very short articles
                         if len(clean_text) > 50:
                             doc = {
+                                "doc_id": count,
                                 "id": normalize_id(title),
                                 "text": clean_text,
                                 "out_links": links
@@ -34,11 +34,11 @@ def parse_worker(task_data):
                 links.append(normalize_id(target))
 
         if len(clean_text) > 50:
-            return json.dumps({
+            return {
                 "id": normalize_id(title),
                 "text": clean_text,
                 "out_links": links
-            })
+            }
     except Exception:
         return None
     return None
@@ -91,7 +91,9 @@ def process_wiki_dump_parallel():
 
                 for res in results:
                     if res:
-                        f_out.write(res + "\n")
+                        # dense integer doc id, assigned once here and used by every later stage
+                        res["doc_id"] = count
+                        f_out.write(json.dumps(res) + "\n")
                         count += 1
                         if count % 1000 == 0:
                             elapsed = time.time() - start_time
@@ -106,7 +108,8 @@ def process_wiki_dump_parallel():
         results = pool.imap_unordered(parse_worker, batch_data)
         for res in results:
             if res:
-                f_out.write(res + "\n")
+                res["doc_id"] = count
+                f_out.write(json.dumps(res) + "\n")
                 count += 1
 
     pool.close()
@@ -147,6 +147,16 @@ def main():
     parser = argparse.ArgumentParser(description="Distributed Search Engine Pipeline")
     parser.add_argument("--file", type=str,
                         help="Path to a local XML file to process. If ignored, downloads SimpleWiki.")
+    parser.add_argument("--pagerank-engine", choices=["bsp", "matrix"], default="bsp",
+                        help="bsp: Redis controller/worker cluster, matrix: single-node sparse matrix engine.")
+    parser.add_argument("--segments", action="store_true",
+                        help="Also write mmap-able index segments to data/segments (SEARCH_ENGINE=segments).")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="With --segments, also split them into N document-partitioned shards.")
+    parser.add_argument("--positions", action="store_true",
+                        help="Also index term positions, for \"phrase\" queries.")
+    parser.add_argument("--pagerank-order", action="store_true",
+                        help="Renumber documents by descending PageRank (SEARCH_RETRIEVAL=ordered stops early).")
     args = parser.parse_args()
 
     total_start = time.time()
@@ -166,12 +176,12 @@ def main():
     wait_for_service("Postgres", "docker-compose exec postgres pg_isready -U admin")
 
 
-    drop_sql = "DROP TABLE IF EXISTS inverted_index; DROP TABLE IF EXISTS pagerank; DROP TABLE IF EXISTS metadata;"
+    drop_sql = "DROP TABLE IF EXISTS inverted_index; DROP TABLE IF EXISTS pagerank; DROP TABLE IF EXISTS metadata; DROP TABLE IF EXISTS doc_texts; DROP TABLE IF EXISTS documents; DROP TABLE IF EXISTS doc_order;"
     run_cmd(f'docker-compose exec postgres psql -U admin -d search_engine -c "{drop_sql}"', "Dropping old tables")
 
     run_cmd("docker-compose exec redis redis-cli FLUSHALL", "Flushing Redis")
 
-    run_cmd("docker-compose run --rm compute-node python compute/db_utils.py", "Initializing DB Tables (JSONB)")
+    run_cmd("docker-compose run --rm compute-node python compute/db_utils.py", "Initializing DB Tables")
 
     log("Step 1.5: Data Preparation")
     # download_data()
@@ -180,6 +190,8 @@ def main():
 
     run_cmd("docker-compose run --rm compute-node python ingestion/run_ingestion_multi_process.py", "Running Ingestion")
 
+    run_cmd("docker-compose run --rm compute-node python compute/doc_dictionary.py", "Building Doc Dictionary")
+
 
     log("Step 3: Distributed Indexing")
 
@@ -187,6 +199,8 @@ def main():
     cmd = 'docker-compose run --rm compute-node sh -c "rm -rf /app/data/temp_shuffle/*"'
 
     run_cmd(cmd, "Cleaning temp files inside Docker")
+    if args.segments:
+        run_cmd('docker-compose run --rm compute-node sh -c "rm -rf /app/data/segments/*"', "Cleaning old segments")
 
     run_cmd("docker-compose run --rm compute-node python compute/indexing/controller.py --phase all",
             "Publishing Map&Reduce Tasks")
@@ -194,7 +208,8 @@ def main():
     print(f"    Launching {NUM_MAPPERS} Mappers...")
 
     for i in range(NUM_MAPPERS):
-        subprocess.run("docker-compose run -d compute-node python compute/indexing/mapper.py", shell=True)
+        env = "-e INDEX_POSITIONS=1 " if args.positions else ""
+        subprocess.run(f"docker-compose run -d {env}compute-node python compute/indexing/mapper.py", shell=True)
 
     print("    Waiting for Mappers to finish (Monitor via Docker PS)...")
     wait_start = time.time()
@@ -226,7 +241,8 @@ def main():
 
     for i in range(NUM_MAPPERS):
 
-        cmd = "docker-compose run -d compute-node python compute/indexing/reducer.py"
+        env = "-e INDEX_SEGMENTS=1 " if args.segments else ""
+        cmd = f"docker-compose run -d {env}compute-node python compute/indexing/reducer.py"
         subprocess.run(cmd, shell=True, check=True)
 
     print("   ⏳ Waiting for Reducers to finish...")
@@ -259,36 +275,52 @@ def main():
 
     # extract_edge
     run_cmd("docker-compose run --rm compute-node python compute/pagerank/extract_edges.py", "Extracting Edges")
-    # load graph to redis
-    run_cmd("docker-compose run --rm compute-node python compute/pagerank/graph_loader.py", "Loading Graph to Redis")
 
-    print(f"    Starting PR Controller + {NUM_PR_WORKERS} Workers...")
-    subprocess.run(f"docker-compose up -d --scale pr-worker={NUM_PR_WORKERS}", shell=True)
+    if args.pagerank_engine == "matrix":
+        run_cmd("docker-compose run --rm compute-node python compute/pagerank/matrix_pagerank.py",
+                "Running Sparse Matrix PageRank")
+    else:
+        # load graph to redis
+        run_cmd("docker-compose run --rm compute-node python compute/pagerank/graph_loader.py", "Loading Graph to Redis")
 
-    print("    Waiting for PageRank convergence...")
-    wait_start = time.time()
-    while True:
-        res = subprocess.run('docker ps -q -f "name=pr-controller"', shell=True, capture_output=True, text=True)
-        if not res.stdout.strip():
-            print("\n    PageRank Controller finished.")
-            break
+        print(f"    Starting PR Controller + {NUM_PR_WORKERS} Workers...")
+        subprocess.run(f"docker-compose up -d --scale pr-worker={NUM_PR_WORKERS}", shell=True)
 
-        if time.time() - wait_start > TIMEOUT_PR:
-            print("    PageRank Timeout!")
-            sys.exit(1)
+        print("    Waiting for PageRank convergence...")
+        wait_start = time.time()
+        while True:
+            res = subprocess.run('docker ps -q -f "name=pr-controller"', shell=True, capture_output=True, text=True)
+            if not res.stdout.strip():
+                print("\n    PageRank Controller finished.")
+                break
+
+            if time.time() - wait_start > TIMEOUT_PR:
+                print("    PageRank Timeout!")
+                sys.exit(1)
 
-        time.sleep(5)
-        print("      Calculation in progress...", end='\r')
+            time.sleep(5)
+            print("      Calculation in progress...", end='\r')
 
     run_cmd("docker-compose run --rm compute-node python compute/pagerank/export_pagerank_sql.py",
             "Exporting PR to Postgres")
 
-    run_cmd("docker-compose stop pr-controller pr-worker", "Stopping PR Cluster")
+    if args.pagerank_engine == "bsp":
+        run_cmd("docker-compose stop pr-controller pr-worker", "Stopping PR Cluster")
 
 
     log("Step 5: Metadata Export")
     run_cmd("docker-compose run --rm compute-node python compute/export_metadata.py",
             "Exporting Text & Length to Postgres")
+    if args.pagerank_order:
+        run_cmd("docker-compose run --rm compute-node python compute/indexing/reorder_docs.py",
+                "Renumbering Documents by PageRank")
+    # the reducers ran before PageRank existed, re-rank the tier-1 champion lists with it
+    run_cmd("docker-compose run --rm compute-node python compute/indexing/build_champions.py",
+            "Building Champion Lists")
+
+    if args.segments:
+        run_cmd(f"docker-compose run --rm compute-node python compute/export_segments.py --shards {args.shards}",
+                "Exporting Index Segments")
 
 
     log("Step 6: Deploying Search Engine")
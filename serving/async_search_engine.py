@@ -0,0 +1,423 @@
+import os
+import re
+import asyncio
+import itertools
+from functools import partial
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncpg
+
+from serving.search_engine import (SearchEngine, SNIPPET_WINDOW, SNIPPET_SLACK, BATCH_TERMS, CHAMPION_COLUMNS,
+                                   SNIPPET_WINDOWS_SQL, POSITIONS_HEAD_SQL, POSITIONS_BLOCKS_SQL, PUSHDOWN_SQL)
+from serving.phrase import plan_phrases, match_phrases
+from compute.utils.positions_codec import directory_size, read_directory, block_range
+from serving.doc_stats import DocStats, LOAD_QUERIES
+from serving.postings_cache import DecodedPostings
+from serving.scoring import survivor_arrays
+from serving.metrics import stage, count
+from serving.deadline import Deadline, AnytimeSearch
+
+# Async variant of SearchEngine for the asyncio serving path (SEARCH_ENGINE=async in serving/main.py).
+# Ranking code is shared with SearchEngine; Postgres I/O goes through its own asyncpg pool,
+# independent lookups (per-term postings, doc stats tables) run concurrently on separate
+# connections, and decoding / scoring run on a thread pool so the event loop stays free.
+# search(), search_anytime(), search_many(), reload_doc_stats() and warm_postings_cache() are
+# coroutines here.
+
+
+def numbered_params(sql):
+    # the same statement for asyncpg, which numbers its parameters ($1, $2, ...) where psycopg2 takes %s
+    n = itertools.count(1)
+    return re.sub("%s", lambda m: f"${next(n)}", sql)
+
+
+SNIPPET_WINDOWS_SQL = numbered_params(SNIPPET_WINDOWS_SQL)
+POSITIONS_HEAD_SQL = numbered_params(POSITIONS_HEAD_SQL)
+POSITIONS_BLOCKS_SQL = numbered_params(POSITIONS_BLOCKS_SQL)
+PUSHDOWN_SQL = numbered_params(PUSHDOWN_SQL)
+
+
+class AsyncSearchEngine(SearchEngine):
+    def __init__(self):
+        self._init_settings()
+        self.pool = None
+        self.pool_min_size = int(os.getenv("ASYNC_PG_POOL_MIN", "4"))
+        self.pool_max_size = int(os.getenv("ASYNC_PG_POOL_MAX", "20"))
+        self.executor = ThreadPoolExecutor(max_workers=int(os.getenv("SCORING_WORKERS", "4")))
+        # asyncio primitives must be created on the serving loop, see start()
+        self._reload_lock = None
+
+    async def start(self):
+        self._reload_lock = asyncio.Lock()
+        await self._initialize_database_pool()
+        await self.reload_doc_stats(force=True)
+        await self.warm_postings_cache()
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+        self.executor.shutdown(wait=False)
+
+    async def _initialize_database_pool(self):
+        print("Initializing asyncpg Connection Pool...", flush=True)
+        max_retries = 10
+        for i in range(max_retries):
+            try:
+                self.pool = await asyncpg.create_pool(
+                    host=self.pg_host, user=self.pg_user, password=self.pg_pass, database=self.pg_db,
+                    min_size=self.pool_min_size, max_size=self.pool_max_size
+                )
+                print("asyncpg Pool created!", flush=True)
+                break
+            except Exception as e:
+                if i == max_retries - 1: raise e
+                print(f"DB not ready yet. Retrying...", flush=True)
+                await asyncio.sleep(2)
+
+    async def _run_cpu(self, fn, *args):
+        # in a copy of the caller's context, so stages timed on the pool land in the request's trace
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, copy_context().run, partial(fn, *args))
+
+    async def _current_index_version(self):
+        value = await self.pool.fetchval("SELECT value FROM config WHERE key=$1", 'index_version')
+        return int(value) if value is not None else 0
+
+    async def reload_doc_stats(self, force=False):
+        async with self._reload_lock:
+            try:
+                if not force and self.stats is not None and await self._current_index_version() == self.stats.version:
+                    return False
+
+                print("Loading doc stats...", flush=True)
+                results = await asyncio.gather(*[self.pool.fetch(sql) for sql in LOAD_QUERIES])
+                stats = await self._run_cpu(DocStats.from_rows, *results)
+            except Exception as e:
+                print(f" Doc stats failed: {e}", flush=True)
+                if self.stats is None:
+                    self.stats = DocStats.empty()
+                return False
+
+            self._swap_doc_stats(stats)
+            return True
+
+    async def _fetch_term(self, term):
+        blob = await self.pool.fetchval("SELECT postings FROM inverted_index WHERE term = $1", term)
+        if not blob:
+            return term, None
+        decoded = await self._run_cpu(self._decode_postings, {term: blob})
+        return term, decoded[term]
+
+    @staticmethod
+    def _decode_postings(blobs):
+        with stage("decode"):
+            return {term: DecodedPostings(blob) for term, blob in blobs.items()}
+
+    async def _get_postings(self, tokens, version):
+        cached, missing = self.postings_cache.get_many(version, tokens)
+        postings = {term: p for term, p in cached.items() if p is not None}
+        count("postings_cache_hits", len(cached))
+        count("postings_cache_misses", len(missing))
+
+        if missing:
+            # one query per term, all in flight at once
+            for term, fetched in await asyncio.gather(*[self._fetch_term(t) for t in missing]):
+                self.postings_cache.put(version, term, fetched)
+                if fetched is not None:
+                    postings[term] = fetched
+        return postings
+
+    async def _get_champions(self, tokens, version):
+        cached, missing = self.champion_cache.get_many(version, tokens)
+        champions = {term: p for term, p in cached.items() if p is not None}
+        if missing:
+            rows = await self.pool.fetch(f"SELECT {CHAMPION_COLUMNS} FROM inverted_index WHERE term = ANY($1::text[])",
+                                         list(missing))
+            fetched = await self._run_cpu(self._decode_champions, [tuple(row) for row in rows])
+            for term in missing:
+                self.champion_cache.put(version, term, fetched.get(term))
+            champions.update(fetched)
+        return champions
+
+    def _decode_champions(self, rows):
+        with stage("decode"):
+            return {term: self._champion_list(blob, df, bound, pr_weight)
+                    for term, df, blob, bound, pr_weight in rows if blob}
+
+    async def _get_postings_within(self, tokens, version, deadline):
+        # concurrent like _get_postings(); lists not in by the deadline are left out (the short
+        # lists of rare terms come in first), but the first one to arrive is always waited for.
+        # Returns (postings, skipped) like SearchEngine._get_postings_within.
+        cached, missing = self.postings_cache.get_many(version, tokens)
+        postings = {term: p for term, p in cached.items() if p is not None}
+        count("postings_cache_hits", len(cached))
+        count("postings_cache_misses", len(missing))
+        if not missing:
+            return postings, []
+
+        tasks = [asyncio.ensure_future(self._fetch_term(t)) for t in missing]
+        done, pending = await asyncio.wait(tasks, timeout=deadline.remaining_ms() / 1000)
+        if not done and not postings:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+
+        for task in done:
+            term, fetched = task.result()
+            self.postings_cache.put(version, term, fetched)
+            if fetched is not None:
+                postings[term] = fetched
+        if pending:
+            count("deadline_skipped_terms", len(pending))
+        return postings, [term for term, task in zip(missing, tasks) if task in pending]
+
+    async def _fetch_position_blocks(self, wanted, postings):
+        # see SearchEngine._fetch_position_blocks
+        terms = list(wanted)
+        rows = await self.pool.fetch(POSITIONS_HEAD_SQL, terms, [directory_size(postings[t].df) for t in terms])
+        heads = {term: read_directory(head) for term, head in rows}
+
+        ranges = [(term, block) + block_range(*heads[term], block) for term in heads for block in wanted[term]]
+        blocks = {term: {} for term in heads}
+        if ranges:
+            rows = await self.pool.fetch(POSITIONS_BLOCKS_SQL, [r[0] for r in ranges], [r[2] + 1 for r in ranges],
+                                         [r[3] - r[2] for r in ranges])
+            for i, data in rows:
+                term, block = ranges[i - 1][:2]
+                blocks[term][block] = data
+        return blocks
+
+    async def _phrase_docs(self, phrases, postings):
+        with stage("phrase"):
+            candidates, wanted = await self._run_cpu(plan_phrases, phrases, postings)
+        if not candidates.size:
+            return candidates
+        count("phrase_candidates", candidates.size)
+        with stage("positions_fetch"):
+            blocks = await self._fetch_position_blocks(wanted, postings)
+        with stage("phrase"):
+            return await self._run_cpu(match_phrases, phrases, postings, candidates, blocks)
+
+    async def warm_postings_cache(self, terms=None, batch_size=50):
+        try:
+            if terms is None:
+                terms = self._warm_file_terms()
+            if terms is None:
+                rows = await self.pool.fetch("SELECT term FROM inverted_index ORDER BY df DESC LIMIT $1",
+                                             self.cache_warm_terms)
+                terms = [row['term'] for row in rows]
+        except Exception as e:
+            print(f" Postings cache warmup failed: {e}", flush=True)
+            return
+
+        version = self.stats.version
+        print(f"Warming postings cache with up to {len(terms)} terms...", flush=True)
+        for i in range(0, len(terms), batch_size):
+            if self.postings_cache.is_full(): break
+            await self._get_postings(terms[i: i + batch_size], version)
+
+        stats = self.postings_cache.stats()
+        print(f" Postings cache warm: {stats['entries']} terms, {stats['bytes_used'] / 1024 / 1024:.1f} MB", flush=True)
+
+    async def _retrieve_pushdown(self, stats, tokens, k, bm25_weight, pr_weight, timeout_ms=None):
+        rows = await self.pool.fetch(PUSHDOWN_SQL, *self._pushdown_params(stats, tokens, k, bm25_weight, pr_weight),
+                                     timeout=timeout_ms / 1000 if timeout_ms is not None else None)
+        return survivor_arrays([tuple(row) for row in rows])
+
+    async def get_snippets_bulk(self, doc_ids, query_tokens):
+        if not doc_ids: return {}
+        return (await self.get_snippets_many([(doc_ids, query_tokens)]))[0]
+
+    async def get_snippets_many(self, requests):
+        if self.doc_store is not None:
+            return await self._run_cpu(
+                lambda: [self.store_snippets(self.doc_store, doc_ids, tokens) for doc_ids, tokens in requests]
+            )
+
+        snippets = [{} for _ in requests]
+        all_ids = sorted({doc_id for doc_ids, _ in requests for doc_id in doc_ids})
+        if not all_ids: return snippets
+
+        rows = await self.pool.fetch("SELECT doc_id, term_offsets FROM doc_texts WHERE doc_id = ANY($1::int[])",
+                                     all_ids)
+        blobs = {row['doc_id']: row['term_offsets'] for row in rows}
+
+        pairs, missing = [], []
+        for n, (doc_ids, tokens) in enumerate(requests):
+            windows, no_offsets = self.snippet_windows(
+                [(doc_id, blobs[doc_id]) for doc_id in doc_ids if doc_id in blobs], tokens)
+            pairs.extend((n, doc_id, window) for doc_id, window in windows.items())
+            missing.extend((n, doc_id) for doc_id in no_offsets)
+
+        if pairs:
+            fragments = await self.pool.fetch(SNIPPET_WINDOWS_SQL, SNIPPET_WINDOW + SNIPPET_SLACK + 1,
+                                              [doc_id for _, doc_id, _ in pairs],
+                                              [window[0] + 1 for _, _, window in pairs])
+            for i, fragment in fragments:
+                n, doc_id, window = pairs[i - 1]
+                snippets[n][doc_id] = self.window_snippet(fragment, *window)
+
+        if missing:
+            rows = await self.pool.fetch("SELECT doc_id, text FROM doc_texts WHERE doc_id = ANY($1::int[])",
+                                         sorted({doc_id for _, doc_id in missing}))
+            texts = {row['doc_id']: row['text'] for row in rows}
+
+            def scan():
+                for n, doc_id in missing:
+                    if doc_id in texts:
+                        snippets[n][doc_id] = self.make_snippet(texts[doc_id], requests[n][1])
+            await self._run_cpu(scan)
+        return snippets
+
+    async def get_raw_text_sample_bulk(self, doc_ids, limit=300):
+        if not doc_ids: return {}
+        if self.doc_store is not None:
+            return await self._run_cpu(self.store_text_samples, self.doc_store, doc_ids, limit)
+
+        rows = await self.pool.fetch(
+            "SELECT doc_id, substr(text, 1, $1) AS sample FROM doc_texts WHERE doc_id = ANY($2::int[])",
+            limit, list(doc_ids)
+        )
+        return {row['doc_id']: row['sample'] for row in rows}
+
+    async def _get_postings_bulk(self, terms, version):
+        # search_many(): uncached lists of many terms in one query instead of one query per term
+        cached, missing = self.postings_cache.get_many(version, terms)
+        postings = {term: p for term, p in cached.items() if p is not None}
+        count("postings_cache_hits", len(cached))
+        count("postings_cache_misses", len(missing))
+
+        if missing:
+            rows = await self.pool.fetch("SELECT term, postings FROM inverted_index WHERE term = ANY($1::text[])",
+                                         list(missing))
+            blobs = {row['term']: row['postings'] for row in rows if row['postings']}
+            fetched = await self._run_cpu(self._decode_postings, blobs)
+            for term in missing:
+                self.postings_cache.put(version, term, fetched.get(term))
+            postings.update(fetched)
+        return postings
+
+    async def search_many(self, queries, topk=20, pagerank=True, use_semantics=False, alpha=None, beta=None,
+                          match=None):
+        # see SearchEngine.search_many; queries are scored concurrently on the SCORING_WORKERS pool
+        stats = self.stats
+        if stats.N == 0 or stats.avgdl == 0.0:
+            await self.reload_doc_stats(force=True)
+            stats = self.stats
+        if stats.N == 0:
+            print("Error: Metadata table is empty!", flush=True)
+            return [[] for _ in queries]
+
+        if alpha is None: alpha = self.alpha
+        if beta is None: beta = self.beta
+        if match is None: match = self.match_mode
+        bm25_weight, pr_weight = (alpha, beta) if pagerank else (1.0, 0.0)
+        k = max(topk, self.semantic_topk) if use_semantics else topk
+
+        with stage("analyze"):
+            keys_of, unique, terms = await self._run_cpu(self._plan_batch, queries)
+
+        postings = {}
+        with stage("postings_fetch"):
+            for chunk in await asyncio.gather(*[self._get_postings_bulk(terms[i: i + BATCH_TERMS], stats.version)
+                                                for i in range(0, len(terms), BATCH_TERMS)]):
+                postings.update(chunk)
+
+        async def rank(key):
+            tokens, phrases = key
+            within = await self._phrase_docs(phrases, postings) if phrases else None
+            return await self._run_cpu(self._rank_batch_query, stats, tokens, postings, k, bm25_weight, pr_weight,
+                                       pagerank, match, within)
+
+        ranked = await asyncio.gather(*[rank(key) for key in unique])
+
+        if use_semantics and self.semantic_model is not None:
+            first_query = {}
+            for query, key in zip(queries, keys_of):
+                first_query.setdefault(key, query)
+            reranked = []
+            for key, scored in zip(unique, ranked):
+                if scored:
+                    cand_ids = [r["doc_id"] for r in scored[:self.semantic_topk]]
+                    raw_text_map = await self.get_raw_text_sample_bulk(cand_ids, limit=300)
+                    scored = await self._run_cpu(self.semantic_rerank, first_query[key], scored, list(key[0]),
+                                                 raw_text_map)
+                reranked.append(scored)
+            ranked = reranked
+        ranked = [scored[:topk] for scored in ranked]
+
+        with stage("snippet"):
+            snippets = await self.get_snippets_many([([r['doc_id'] for r in top], list(tokens))
+                                                     for (tokens, _), top in zip(unique, ranked)])
+        return self._batch_results(keys_of, unique, ranked, snippets)
+
+    async def search(self, query, topk=20, pagerank=True, use_semantics=False, alpha=None, beta=None, match=None):
+        results, _ = await self.search_anytime(query, topk, pagerank, use_semantics, alpha, beta, match=match)
+        return results
+
+    async def search_anytime(self, query, topk=20, pagerank=True, use_semantics=False, alpha=None, beta=None,
+                             deadline_ms=None, match=None):
+        deadline = Deadline(deadline_ms)
+        stats = self.stats
+        if stats.N == 0 or stats.avgdl == 0.0:
+            print(f"Detected N == {stats.N}, avgdl == {stats.avgdl}, attempting to reload stats...", flush=True)
+            await self.reload_doc_stats(force=True)
+            stats = self.stats
+
+        if stats.N == 0:
+            print("Error: Metadata table is empty!", flush=True)
+            return [], False
+
+        with stage("analyze"):
+            # stemming is CPU work, keep it off the event loop
+            tokens, phrases = await self._run_cpu(lambda: (self.query_tokens(query), self.query_phrases(query)))
+        if not tokens: return [], False
+        q = AnytimeSearch(self, stats, tokens, phrases, deadline, topk, pagerank, use_semantics, alpha, beta, match)
+
+        survivors = None
+        if q.wants_champions():
+            with stage("postings_fetch"):
+                champions = await self._get_champions(tokens, stats.version)
+            with stage("score"):
+                survivors = await self._run_cpu(self._rank_champions, stats, tokens, champions, q.k, q.bm25_weight,
+                                                q.pr_weight, q.match)
+
+        if survivors is None and q.wants_pushdown():
+            try:
+                with stage("pushdown"):
+                    survivors = await self._retrieve_pushdown(stats, tokens, q.k, q.bm25_weight, q.pr_weight,
+                                                              timeout_ms=deadline.remaining_ms())
+            except Exception as e:
+                print(f"   Pushdown failed, scoring locally: {e}", flush=True)
+
+        if survivors is None:
+            # wall time of the concurrent per-term queries, decoding included (also timed as decode)
+            with stage("postings_fetch"):
+                if deadline.at is None:
+                    postings = await self._get_postings(tokens, stats.version)
+                else:
+                    postings, skipped = await self._get_postings_within(tokens, stats.version, deadline)
+                    q.skip_terms(skipped)
+            if not postings: return q.finish([])
+            within = await self._phrase_docs(q.phrases, postings) if q.phrases else None
+            with stage("score"):
+                survivors = await self._run_cpu(self.retrieve, stats, q.scored_tokens, postings, q.k, q.bm25_weight,
+                                                q.pr_weight, q.match, within)
+
+        with stage("metadata"):
+            scored_results = await self._run_cpu(self.rank_candidates, stats, tokens, survivors, q.k, pagerank)
+
+        if q.wants_rerank(scored_results):
+            with stage("semantic"):
+                cand_ids = [r["doc_id"] for r in scored_results[:self.semantic_topk]]
+                raw_text_map = await self.get_raw_text_sample_bulk(cand_ids, limit=300)
+                scored_results = await self._run_cpu(self.semantic_rerank, query, scored_results, tokens,
+                                                     raw_text_map)
+
+        top_results, snippet_ids = q.cut(scored_results)
+        with stage("snippet"):
+            snippets_map = await self.get_snippets_bulk(snippet_ids, tokens)
+
+        with stage("metadata"):
+            return q.finish(self.build_results(top_results, q.snippets(snippets_map)))
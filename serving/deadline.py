@@ -0,0 +1,101 @@
+import os
+import time
+
+from serving.metrics import count
+
+# Time budget of one anytime search (deadline_ms on /search). The engines check it between
+# stages: postings are fetched in increasing df order (decreasing IDF) until it runs out, the
+# terms not fetched by then are left out of the scores, and once it is exhausted semantic
+# re-ranking is skipped and only the first hits get snippets. A search that cut anything
+# reports its results as partial. A single stage is never interrupted, so a search can overrun
+# its deadline by up to one stage.
+
+# hits of a search_anytime() that still get a snippet once its deadline has passed
+DEADLINE_SNIPPETS = int(os.getenv("SEARCH_DEADLINE_SNIPPETS", "3"))
+
+
+class Deadline:
+    def __init__(self, ms=None):
+        self.at = time.perf_counter() + ms / 1000 if ms else None
+
+    def expired(self):
+        return self.at is not None and time.perf_counter() >= self.at
+
+    def remaining_ms(self):
+        # None without a deadline, 0 once it has passed
+        if self.at is None:
+            return None
+        return max(0.0, (self.at - time.perf_counter()) * 1000)
+
+
+class AnytimeSearch:
+    # The planning and partial-result bookkeeping of one search_anytime(), shared by SearchEngine
+    # and AsyncSearchEngine; the engines only do the I/O between these steps.
+
+    def __init__(self, engine, stats, tokens, phrases, deadline, topk, pagerank, use_semantics, alpha, beta, match):
+        self.stats = stats
+        self.tokens = tokens
+        # the terms and phrases that are scored, all of them unless the deadline cuts some
+        self.scored_tokens = tokens
+        self.phrases = phrases
+        self.deadline = deadline
+        self.partial = False
+        self.match = engine.match_mode if match is None else match
+        self.use_champions = engine.use_champions
+        self.pushdown = engine.retrieval_mode == "pushdown"
+        self.rerank = use_semantics and engine.semantic_model is not None
+        alpha = engine.alpha if alpha is None else alpha
+        beta = engine.beta if beta is None else beta
+        # base score before the title boost: alpha * BM25 + beta * log-PageRank (or plain BM25)
+        self.bm25_weight, self.pr_weight = (alpha, beta) if pagerank else (1.0, 0.0)
+        self.k = max(topk, engine.semantic_topk) if use_semantics else topk
+        self.topk = topk
+        self.unsnipped = []
+
+    def wants_champions(self):
+        # champion lists only ever rank whole terms, a phrase needs the full lists
+        return (self.use_champions and self.stats.champions_valid and not self.phrases
+                and not self.deadline.expired())
+
+    def wants_pushdown(self):
+        # pushdown ranks the union of the terms, phrases and conjunctions are matched locally
+        return self.pushdown and self.match == "or" and not self.phrases and not self.deadline.expired()
+
+    def skip_terms(self, skipped):
+        # terms the deadline left out are not required by an AND or a phrase either
+        if not skipped:
+            return
+        self.scored_tokens = [t for t in self.tokens if t not in skipped]
+        self.phrases = tuple(p for p in self.phrases if not set(p) & set(skipped))
+        self.partial = True
+
+    def wants_rerank(self, scored_results):
+        if not self.rerank or not scored_results:
+            return False
+        if self.deadline.expired():
+            self.partial = True
+            return False
+        return True
+
+    def cut(self, scored_results):
+        # (top hits, the ids to cut snippets for): only the first DEADLINE_SNIPPETS get one once
+        # the deadline has passed
+        top_results = scored_results[:self.topk]
+        top_ids = [r['doc_id'] for r in top_results]
+        if self.deadline.expired() and len(top_ids) > DEADLINE_SNIPPETS:
+            count("deadline_skipped_snippets", len(top_ids) - DEADLINE_SNIPPETS)
+            self.partial = True
+            self.unsnipped = top_ids[DEADLINE_SNIPPETS:]
+            return top_results, top_ids[:DEADLINE_SNIPPETS]
+        return top_results, top_ids
+
+    def snippets(self, snippets_map):
+        # hits past the snippet cut stay in the results, with an empty snippet
+        for doc_id in self.unsnipped:
+            snippets_map[doc_id] = ""
+        return snippets_map
+
+    def finish(self, results):
+        if self.partial:
+            count("deadline_exceeded")
+        return results, self.partial
@@ -0,0 +1,188 @@
+import numpy as np
+
+from compute.utils.title_terms import title_signature, decode_signature
+from compute.utils.champions import pr_norm_values, pagerank_fingerprint
+
+# Per-document serving data, loaded once per index version instead of queried per search.
+# Arrays are dense and indexed by doc ordinal (the integer doc_id from the doc dictionary):
+#   lengths  int32    metadata.length (0 for link-only titles without an article)
+#   pagerank float32  pagerank.score (0 if the doc has no score)
+#   titles   object   documents.title
+# plus log-normalized PageRank (float64), computed once so scalar and vectorized scoring agree,
+# and title token signatures in CSR form: the hashes of doc i are
+# title_hashes[title_offsets[i]:title_offsets[i + 1]] (see compute/utils/title_terms.py).
+# champions_valid says whether the tier-1 champion lists (compute/utils/champions.py) were built
+# with the loaded PageRank scores, their bounds don't hold otherwise.
+# A DocStats is never modified after loading; reloads build a new one and swap it in,
+# so a query that grabbed a snapshot keeps a consistent view.
+
+# (config, documents, metadata, pagerank) queries, shared by the psycopg2 and asyncpg loaders
+LOAD_QUERIES = (
+    "SELECT key, value FROM config WHERE key IN ('avgdl', 'index_avgdl', 'index_version', 'champions_pagerank')",
+    "SELECT doc_id, title, title_terms FROM documents",
+    "SELECT doc_id, length FROM metadata",
+    "SELECT doc_id, score FROM pagerank",
+)
+
+
+class DocStats:
+    def __init__(self, version, n_docs, avgdl, index_avgdl, lengths, pagerank, titles, title_signatures=None,
+                 title_csr=None, champions_pagerank=None):
+        self.version = version
+        self.N = n_docs
+        self.avgdl = avgdl
+        self.index_avgdl = index_avgdl
+        # block bounds were computed with the reducer's avgdl, BM25 grows with avgdl
+        self.bound_scale = max(1.0, avgdl / index_avgdl) if index_avgdl > 0 else 1.0
+
+        self.lengths = lengths
+        self.pagerank = pagerank
+        self.titles = titles
+        self.has_title = np.array([title is not None for title in titles], dtype=bool)
+        # docs a search may return: titled (a page whose title an earlier page took has none) and
+        # no "_born" pseudo-page. Retrieval drops the others before they count toward the top k
+        self.showable = self.has_title & np.array([title is None or not title.startswith("_born")
+                                                   for title in titles], dtype=bool)
+        self.title_to_ordinal = {title: i for i, title in enumerate(titles) if title is not None}
+
+        if title_csr is not None:
+            # (title_offsets, title_hashes) as stored in an index segment
+            self.title_offsets, self.title_hashes = title_csr
+        else:
+            # signatures missing (older doc dictionary, synthetic stats) are computed here once
+            if title_signatures is None:
+                title_signatures = [None] * len(titles)
+            title_signatures = [
+                sig if sig is not None else (title_signature(title) if title is not None else np.zeros(0, dtype=np.int64))
+                for sig, title in zip(title_signatures, titles)
+            ]
+            counts = np.array([sig.size for sig in title_signatures], dtype=np.int64)
+            self.title_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+            self.title_hashes = np.concatenate(title_signatures + [np.zeros(0, dtype=np.int64)])
+        self.pr_norm_values = pr_norm_values(pagerank)
+        self.max_pr_norm = float(self.pr_norm_values.max()) if pagerank.size else 0.0
+        # highest pr_norm from each doc id on; with docs numbered by PageRank
+        # (compute/indexing/reorder_docs.py) that is the doc's own pr_norm
+        self.pr_norm_suffix_max = np.maximum.accumulate(self.pr_norm_values[::-1])[::-1]
+        self.champions_valid = (champions_pagerank is not None
+                                and int(champions_pagerank) == pagerank_fingerprint(pagerank))
+        self._title_index = None
+
+    @classmethod
+    def empty(cls):
+        return cls(0, 0, 200.0, 0.0, np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32),
+                   np.zeros(0, dtype=object))
+
+    @classmethod
+    def load(cls, conn):
+        results = []
+        with conn.cursor() as cur:
+            for sql in LOAD_QUERIES:
+                cur.execute(sql)
+                results.append(cur.fetchall())
+        return cls.from_rows(*results)
+
+    @classmethod
+    def from_rows(cls, config_rows, title_rows, length_rows, pr_rows):
+        config = {key: value for key, value in config_rows}
+        size = max([r[0] for r in title_rows] + [r[0] for r in length_rows] + [r[0] for r in pr_rows] + [-1]) + 1
+
+        titles = np.full(size, None, dtype=object)
+        title_signatures = [None] * size
+        for doc_id, title, title_terms in title_rows:
+            titles[doc_id] = title
+            if title_terms is not None:
+                title_signatures[doc_id] = decode_signature(title_terms)
+
+        lengths = np.zeros(size, dtype=np.int32)
+        if length_rows:
+            ids, values = zip(*length_rows)
+            lengths[list(ids)] = values
+
+        pagerank = np.zeros(size, dtype=np.float32)
+        if pr_rows:
+            ids, values = zip(*pr_rows)
+            pagerank[list(ids)] = values
+
+        return cls(
+            version=int(config.get('index_version', 0)),
+            n_docs=len(length_rows),
+            avgdl=float(config.get('avgdl', 100.0)),
+            index_avgdl=float(config.get('index_avgdl', 0.0)),
+            lengths=lengths, pagerank=pagerank, titles=titles, title_signatures=title_signatures,
+            champions_pagerank=config.get('champions_pagerank'),
+        )
+
+    @classmethod
+    def from_segment(cls, manifest, docs):
+        # docs: compute/utils/segments.py DocSegment; numeric arrays stay views into the mapping
+        arrays = docs.arrays
+        return cls(
+            version=int(manifest['index_version']),
+            n_docs=int(manifest['n_docs']),
+            avgdl=float(manifest['avgdl']),
+            index_avgdl=float(manifest['index_avgdl']),
+            lengths=arrays['lengths'], pagerank=arrays['pagerank'], titles=docs.titles(),
+            title_csr=(arrays['title_hash_offsets'], arrays['title_hashes']),
+        )
+
+    def doc_length(self, doc_id):
+        if doc_id < len(self.lengths):
+            length = int(self.lengths[doc_id])
+            if length: return length
+        return self.avgdl
+
+    def pr_norm(self, doc_id):
+        return float(self.pr_norm_values[doc_id]) if doc_id < len(self.pr_norm_values) else 0.0
+
+    def pr_norm_bound(self, doc_id):
+        # upper bound of pr_norm() over all doc ids >= doc_id
+        return float(self.pr_norm_suffix_max[doc_id]) if doc_id < self.pr_norm_suffix_max.size else 0.0
+
+    def doc_lengths(self, doc_ids):
+        # vectorized doc_length()
+        lengths = np.zeros(doc_ids.size, dtype=np.float64)
+        in_range = doc_ids < self.lengths.size
+        lengths[in_range] = self.lengths[doc_ids[in_range]]
+        lengths[lengths == 0] = self.avgdl
+        return lengths
+
+    def is_showable(self, doc_id):
+        return bool(self.showable[doc_id]) if doc_id < self.showable.size else False
+
+    def showable_mask(self, doc_ids):
+        # vectorized is_showable()
+        mask = doc_ids < self.showable.size
+        mask[mask] = self.showable[doc_ids[mask]]
+        return mask
+
+    def pr_norms(self, doc_ids):
+        # vectorized pr_norm()
+        values = np.zeros(doc_ids.size, dtype=np.float64)
+        in_range = doc_ids < self.pr_norm_values.size
+        values[in_range] = self.pr_norm_values[doc_ids[in_range]]
+        return values
+
+    def title_docs(self, query_hashes):
+        # sorted ids of the docs whose title holds any of the hashes; the inverted title
+        # signatures are built on first use (only tier-1 retrieval needs them)
+        if self._title_index is None:
+            order = np.argsort(self.title_hashes, kind='stable')
+            owners = np.searchsorted(self.title_offsets, order, side='right') - 1
+            self._title_index = (self.title_hashes[order], owners)
+        hashes, owners = self._title_index
+        query_hashes = np.asarray(query_hashes, dtype=hashes.dtype)
+        starts = np.searchsorted(hashes, query_hashes, side='left')
+        ends = np.searchsorted(hashes, query_hashes, side='right')
+        # each hash's owners ascend (stable sort), a doc holds a hash once
+        parts = [owners[s:e] for s, e in zip(starts.tolist(), ends.tolist()) if e > s]
+        if len(parts) == 1:
+            return parts[0].astype(np.int64)
+        docs = np.sort(np.concatenate(parts + [owners[:0]])).astype(np.int64)
+        return docs[np.flatnonzero(np.diff(docs, prepend=-1))]
+
+    def title(self, doc_id):
+        return self.titles[doc_id] if doc_id < len(self.titles) else None
+
+    def ordinal(self, title):
+        return self.title_to_ordinal.get(title)
@@ -0,0 +1,45 @@
+import numpy as np
+
+from serving.wand import END_DOC
+
+# Conjunctive (AND) matching: the docs holding every query term. Lists are intersected rarest
+# first, so the candidates only ever shrink and each step costs about candidates x log(list
+# length) instead of a pass over the longer list. The union of the lists is never built.
+
+
+def intersect_arrays(lists):
+    # doc-id sorted arrays, rarest first -> sorted doc ids present in all of them
+    docs = lists[0]
+    for term_docs in lists[1:]:
+        if not docs.size: break
+        # binary search of every candidate; the candidates are sorted, so numpy starts each
+        # search at the previous one's position and the long list is never scanned
+        pos = np.searchsorted(term_docs, docs)
+        hit = pos < term_docs.size
+        hit[hit] = term_docs[pos[hit]] == docs[hit]
+        docs = docs[hit]
+    return docs
+
+
+def intersect_cursors(cursors):
+    # serving/wand.py cursors, rarest first; yields every doc on all of them, with each cursor
+    # sitting on it. The rarest list leads and the others leapfrog to it with next_geq(), which
+    # jumps over whole blocks through the block directory (skip pointers) and decodes only the
+    # blocks it lands in.
+    lead, others = cursors[0], cursors[1:]
+    while lead.doc != END_DOC:
+        target = lead.doc
+        ahead = None
+        for c in others:
+            c.next_geq(target)
+            if c.doc != target:
+                ahead = c
+                break
+
+        if ahead is None:
+            yield target
+            lead.next()
+        elif ahead.doc == END_DOC:
+            return
+        else:
+            lead.next_geq(ahead.doc)
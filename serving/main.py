@@ -1,10 +1,19 @@
-import time
+import os
+import asyncio
 import logging
-from fastapi import FastAPI, Query
-from typing import List
-from pydantic import BaseModel
+import redis
+from functools import partial
+from contextvars import copy_context
+from fastapi import FastAPI, Query, Response, HTTPException
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional, Literal
+from pydantic import BaseModel, Field
 from serving.search_engine import SearchEngine
+from serving.result_cache import ResultCache, result_cache_key
+from serving.singleflight import AsyncSingleFlight
 from serving.admin import router as admin_router
+from serving.metrics import traced, render_metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -12,7 +21,70 @@ logger = logging.getLogger(__name__)
 app = FastAPI(title="Distributed Search Engine")
 app.include_router(admin_router)
 
-engine = SearchEngine()
+# SEARCH_ENGINE=async: asyncpg pool + concurrent sub-queries (serving/async_search_engine.py)
+# SEARCH_ENGINE=segments: embedded, mmap'd index segments, no Postgres (serving/segment_search_engine.py)
+# SEARCH_ENGINE=coordinator: scatter-gather over the shard backends in SHARD_URLS (serving/shard_coordinator.py)
+# default sync: psycopg2 pool, engine calls run in the threadpool
+SEARCH_ENGINE = os.getenv("SEARCH_ENGINE", "sync")
+COORDINATOR = SEARCH_ENGINE == "coordinator"
+ASYNC_ENGINE = SEARCH_ENGINE == "async" or COORDINATOR
+if SEARCH_ENGINE == "async":
+    from serving.async_search_engine import AsyncSearchEngine
+    engine = AsyncSearchEngine()
+elif COORDINATOR:
+    from serving.shard_coordinator import ShardCoordinator
+    engine = ShardCoordinator()
+elif SEARCH_ENGINE == "segments":
+    from serving.segment_search_engine import SegmentSearchEngine
+    engine = SegmentSearchEngine()
+else:
+    engine = SearchEngine()
+
+
+@app.on_event("startup")
+async def start_engine():
+    if ASYNC_ENGINE:
+        await engine.start()
+
+
+@app.on_event("shutdown")
+async def stop_engine():
+    if ASYNC_ENGINE:
+        await engine.close()
+
+
+async def call_engine(fn, *args, **kwargs):
+    if asyncio.iscoroutinefunction(fn):
+        return await fn(*args, **kwargs)
+    # the request's trace (serving/metrics.py) follows the call into the threadpool
+    return await run_in_threadpool(copy_context().run, partial(fn, *args, **kwargs))
+
+
+# Full-response cache; RESULT_CACHE_BACKEND=redis shares it between backend replicas
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "local")
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+
+result_cache_redis = None
+if RESULT_CACHE_BACKEND == "redis":
+    result_cache_redis = redis.Redis(host=REDIS_HOST, port=6379, socket_timeout=0.1)
+
+result_cache = ResultCache(
+    max_entries=int(os.getenv("RESULT_CACHE_ENTRIES", "10000")),
+    ttl=int(os.getenv("RESULT_CACHE_TTL", "300")),
+    redis_client=result_cache_redis,
+)
+
+# concurrent identical cache misses run one search and share it
+search_flight = AsyncSingleFlight()
+
+SEARCH_BATCH_MAX = int(os.getenv("SEARCH_BATCH_MAX", "5000"))
+
+# SERVER_TIMING=1: per-stage timings of each search in a Server-Timing response header
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+
+# "or": any query term, "and": all of them, "auto": all if enough docs have them (SearchEngine.match_mode)
+MatchMode = Literal["or", "and", "auto"]
 
 
 class SearchResult(BaseModel):
@@ -23,27 +95,190 @@ class SearchResult(BaseModel):
 
 
 @app.get("/search", response_model=List[SearchResult])
-def search_api(
-        q: str = Query(..., min_length=1, description="Search query"),
+async def search_api(
+        response: Response,
+        q: str = Query(..., min_length=1,
+                       description="Search query; words in \"double quotes\" must appear as a phrase"),
         limit: int = Query(20, ge=1, le=100, description="Max results to return"),
         pagerank: bool = Query(True, description="Whether to use PageRank for ranking"),
         semantics: bool = Query(False, description="Whether to use semantic search"),
         alpha: float = Query(None, ge=0.0, le=1.0, description="Balance between semantic and lexical search"),
-        beta: float = Query(None, ge=0.0, le=1.0, description="Weight for PageRank in final scoring")
+        beta: float = Query(None, ge=0.0, le=1.0, description="Weight for PageRank in final scoring"),
+        deadline_ms: int = Query(None, ge=1, le=60000,
+                                 description="Time budget; past it the best results so far come back as partial"),
+        match: Optional[MatchMode] = Query(None, description="Require any (or), all (and) or preferably all "
+                                                             "(auto) query terms; server default if unset")
 
 ):
-    start_time = time.time()
+    with traced("search", q=q, limit=limit, deadline_ms=deadline_ms, match=match) as trace:
+        results = await _search(response, trace, q, limit, pagerank, semantics, alpha, beta, deadline_ms, match)
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = trace.server_timing()
+    return results
+
 
-    logger.info(f"Received query: '{q}' with limit {limit}")
+async def _search(response, trace, q, limit, pagerank, semantics, alpha, beta, deadline_ms, match):
+    # key on the analyzed query, so "Wars" and "war" share an entry; defaults resolved first.
+    # Analysis (stemming) is CPU work, it runs in the threadpool like the engine calls
+    if match is None: match = engine.match_mode
+    tokens, phrases = await run_in_threadpool(lambda: (engine.query_tokens(q), engine.query_phrases(q)))
+    key = result_cache_key(tokens, limit, pagerank, semantics, engine.alpha if alpha is None else alpha,
+                           engine.beta if beta is None else beta, match, phrases)
+    version = engine.stats.version
 
-    results = engine.search(q, topk=limit, pagerank=pagerank, use_semantics=semantics, alpha=alpha, beta=beta)
+    # the shared (Redis) level does blocking I/O, keep it off the event loop
+    cache_call = run_in_threadpool if result_cache.redis is not None else call_engine
 
-    duration = time.time() - start_time
-    logger.info(f"Query processed in {duration:.4f}s. Found {len(results)} results.")
+    async def run_search():
+        # (results, partial); partial if the deadline cut the search short or a shard is missing
+        if COORDINATOR:
+            return await engine.search_shards(q, topk=limit, pagerank=pagerank, use_semantics=semantics,
+                                              alpha=alpha, beta=beta, deadline_ms=deadline_ms, match=match)
+        return await call_engine(engine.search_anytime, q, topk=limit, pagerank=pagerank, use_semantics=semantics,
+                                 alpha=alpha, beta=beta, deadline_ms=deadline_ms, match=match)
 
+    # a cached result is always complete, whatever the deadline; partial ones are never cached
+    results, cache_status = await cache_call(result_cache.get, version, key)
+    partial_results = False
+    if results is None:
+        # only requests with the same deadline share a computation
+        flight_key = (version, key, deadline_ms)
+        (results, partial_results), shared = await search_flight.do(flight_key, run_search)
+        if shared:
+            cache_status = "COALESCED"
+        elif not partial_results:
+            await cache_call(result_cache.put, version, key, results)
+        if partial_results:
+            response.headers["X-Partial-Results"] = "true"
+    response.headers["X-Cache"] = cache_status
+
+    trace.fields.update(cache=cache_status, results=len(results), partial=partial_results)
     return results
 
 
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    limit: int = Field(20, ge=1, le=100)
+    pagerank: bool = True
+    semantics: bool = False
+    alpha: Optional[float] = Field(None, ge=0.0, le=1.0)
+    beta: Optional[float] = Field(None, ge=0.0, le=1.0)
+    match: Optional[MatchMode] = None
+
+
+# Many queries in one request (offline jobs, evaluation), one result list per query in request order.
+# Cached per query like /search; the misses are ranked together by engine.search_many.
+@app.post("/search/batch", response_model=List[List[SearchResult]])
+async def search_batch_api(request: BatchSearchRequest, response: Response):
+    if len(request.queries) > SEARCH_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {SEARCH_BATCH_MAX} queries per batch")
+
+    with traced("batch", queries=len(request.queries), limit=request.limit) as trace:
+        results = await _search_batch(request, response, trace)
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = trace.server_timing()
+    return results
+
+
+async def _search_batch(request, response, trace):
+    queries = request.queries
+    alpha = engine.alpha if request.alpha is None else request.alpha
+    beta = engine.beta if request.beta is None else request.beta
+    match = engine.match_mode if request.match is None else request.match
+    version = engine.stats.version
+
+    def lookup():
+        # analysis and the (maybe Redis) cache lookups, off the event loop
+        keys = [result_cache_key(engine.query_tokens(q), request.limit, request.pagerank, request.semantics, alpha,
+                                 beta, match, engine.query_phrases(q))
+                for q in queries]
+        return keys, [result_cache.get(version, key)[0] for key in keys]
+
+    keys, results = await run_in_threadpool(lookup)
+    misses = [i for i, cached in enumerate(results) if cached is None]
+
+    if misses:
+        batch = [queries[i] for i in misses]
+        options = dict(topk=request.limit, pagerank=request.pagerank, use_semantics=request.semantics,
+                       alpha=request.alpha, beta=request.beta, match=match)
+        partial_results = False
+        if COORDINATOR:
+            computed, partial_results = await engine.search_many_shards(batch, **options)
+        else:
+            computed = await call_engine(engine.search_many, batch, **options)
+
+        for i, result in zip(misses, computed):
+            results[i] = result
+        if partial_results:
+            response.headers["X-Partial-Results"] = "true"
+        else:
+            await run_in_threadpool(lambda: [result_cache.put(version, keys[i], results[i]) for i in misses])
+    response.headers["X-Cache-Hits"] = str(len(queries) - len(misses))
+
+    trace.fields.update(cache_hits=len(queries) - len(misses))
+    return results
+
+
+# Local top-k of this backend's index, for a coordinator merging shards; no result cache here
+@app.get("/shard/search")
+async def shard_search(
+        q: str = Query(..., min_length=1),
+        limit: int = Query(20, ge=1, le=100),
+        pagerank: bool = Query(True),
+        semantics: bool = Query(False),
+        alpha: float = Query(None, ge=0.0, le=1.0),
+        beta: float = Query(None, ge=0.0, le=1.0),
+        deadline_ms: int = Query(None, ge=1),
+        match: Optional[MatchMode] = Query(None)
+):
+    version = engine.stats.version
+    with traced("shard_search", q=q, limit=limit, deadline_ms=deadline_ms, match=match):
+        results, partial = await call_engine(engine.search_anytime, q, topk=limit, pagerank=pagerank,
+                                             use_semantics=semantics, alpha=alpha, beta=beta,
+                                             deadline_ms=deadline_ms, match=match)
+    return {"index_version": version, "results": results, "partial": partial}
+
+
+# Batch form of /shard/search, for a coordinator's /search/batch
+@app.post("/shard/search/batch")
+async def shard_search_batch(request: BatchSearchRequest):
+    version = engine.stats.version
+    with traced("shard_batch", queries=len(request.queries), limit=request.limit):
+        results = await call_engine(engine.search_many, request.queries, topk=request.limit,
+                                    pagerank=request.pagerank, use_semantics=request.semantics,
+                                    alpha=request.alpha, beta=request.beta, match=request.match)
+    return {"index_version": version, "results": results}
+
+
+# Call after the pipeline publishes a new index version; no-op if the version is unchanged
+@app.post("/index/reload")
+async def reload_index(force: bool = Query(False, description="Reload even if the index version is unchanged")):
+    reloaded = await call_engine(engine.reload_doc_stats, force=force)
+    stats = engine.stats
+    return {"reloaded": reloaded, "index_version": stats.version, "docs": stats.N}
+
+
+@app.get("/stats")
+def serving_stats():
+    stats = {
+        "index_version": engine.stats.version,
+        "result_cache": result_cache.stats(),
+        "singleflight": search_flight.stats(),
+    }
+    if COORDINATOR:
+        stats["shards"] = engine.shard_stats()
+    else:
+        stats["postings_cache"] = engine.postings_cache.stats()
+    return stats
+
+
+# Prometheus scrape target: request and per-stage latency histograms, candidate and postings
+# counts, cache and shard counters of the search endpoints (serving/metrics.py)
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/healthcheck")
 def health_check():
     return {"status": "ok"}
\ No newline at end of file
@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Per-request search instrumentation for serving/main.py.
+# Each request runs inside traced(endpoint), which binds a SearchTrace to the request's context;
+# engine code marks its stages with `with stage("score"):` and its counters with count(...),
+# both no-ops outside a traced request (offline scripts, cache warmup). When the request ends the
+# trace is folded into process-wide Prometheus histograms and counters (text format on /metrics),
+# and a sample of requests (SEARCH_LOG_SAMPLE, plus every one slower than SEARCH_SLOW_MS) is
+# logged as one JSON line.
+#
+# Stages: analyze, postings_fetch, decode, phrase, positions_fetch, score, pushdown, metadata, snippet,
+# semantic, shards, merge.
+# Stages don't nest, except on the async engine where postings_fetch is the wall time of the
+# concurrent per-term queries and overlaps their decode. A stage timed on several threads
+# (async engine, batches) adds up their times.
+
+SEARCH_LOG_SAMPLE = float(os.getenv("SEARCH_LOG_SAMPLE", "0.01"))
+SEARCH_SLOW_MS = float(os.getenv("SEARCH_SLOW_MS", "1000"))
+
+# seconds; spans a cached hit (~100us) to a cold multi-term query over Postgres
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# candidates / postings per request
+SIZE_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+logger = logging.getLogger("serving.search")
+
+
+def _labels(names, values):
+    if not names: return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        names = self.label_names + ("le",)
+        with self._lock:
+            for labels, (counts, total, n) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, c in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += c
+                    lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {n}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("search_request_seconds", "Search request latency", ("endpoint",))
+STAGE_SECONDS = Histogram("search_stage_seconds", "Time spent per search stage", ("endpoint", "stage"))
+REQUESTS = Counter("search_requests_total", "Search requests by result cache status", ("endpoint", "cache"))
+CANDIDATES = Histogram("search_candidates", "Retrieved candidates per request", ("endpoint",), SIZE_BUCKETS)
+POSTINGS = Histogram("search_postings_scanned", "Postings of the lists scored per request", ("endpoint",),
+                     SIZE_BUCKETS)
+EVENTS = Counter("search_events_total", "Per-request counters summed over requests", ("endpoint", "event"))
+
+REGISTRY = [REQUEST_SECONDS, STAGE_SECONDS, REQUESTS, CANDIDATES, POSTINGS, EVENTS]
+
+
+def render_metrics():
+    # Prometheus text exposition format 0.0.4
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+class SearchTrace:
+    def __init__(self, endpoint, **fields):
+        self.endpoint = endpoint
+        self.fields = fields
+        self.stages = {}
+        self.counts = {}
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def total(self):
+        return self.elapsed if self.elapsed is not None else time.perf_counter() - self.started
+
+    def server_timing(self):
+        # Server-Timing header value, durations in ms
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages.items()]
+        parts.append(f"total;dur={self.total() * 1000:.2f}")
+        return ", ".join(parts)
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        endpoint = (self.endpoint,)
+        REQUEST_SECONDS.observe(endpoint, self.elapsed)
+        REQUESTS.inc((self.endpoint, self.fields.get("cache", "NONE")))
+        for name, seconds in self.stages.items():
+            STAGE_SECONDS.observe((self.endpoint, name), seconds)
+        # counts are only there for requests that reached the engine, not for cache hits
+        for name, n in self.counts.items():
+            if name == "candidates":
+                CANDIDATES.observe(endpoint, n)
+            elif name == "postings_scanned":
+                POSTINGS.observe(endpoint, n)
+            else:
+                EVENTS.inc((self.endpoint, name), n)
+
+        if self.elapsed * 1000 >= SEARCH_SLOW_MS or random.random() < SEARCH_LOG_SAMPLE:
+            logger.info(json.dumps({
+                "endpoint": self.endpoint,
+                "ms": round(self.elapsed * 1000, 2),
+                "stages_ms": {name: round(s * 1000, 2) for name, s in self.stages.items()},
+                "counts": self.counts,
+                **self.fields,
+            }, default=str))
+
+
+_current = ContextVar("search_trace", default=None)
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextmanager
+def traced(endpoint, **fields):
+    trace = SearchTrace(endpoint, **fields)
+    token = _current.set(trace)
+    try:
+        yield trace
+    except Exception as e:
+        trace.fields["error"] = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        trace.finish()
+
+
+@contextmanager
+def stage(name):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_stage(name, time.perf_counter() - start)
+
+
+def count(name, n=1):
+    trace = _current.get()
+    if trace is not None:
+        trace.count(name, n)
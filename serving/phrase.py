@@ -0,0 +1,94 @@
+import re
+import numpy as np
+
+from compute.utils.tokenizer import analyzer
+from compute.utils.postings_codec import BLOCK_SIZE
+from compute.utils.positions_codec import decode_block_positions
+from serving.intersect import intersect_arrays
+from serving.metrics import count
+
+# Phrase queries: the words of a double-quoted phrase ("river king") must occur next to each other.
+# Phrases are matched in two steps: their words' posting lists are intersected like an AND
+# (serving/intersect.py), then the positions (compute/utils/positions_codec.py) of the docs left
+# are checked. Only the position blocks those docs fall in are fetched and decoded.
+# Phrases are analyzed like the rest of the query, so a stop word inside one is skipped over
+# ("king of rivers" matches "king rivers"). Terms indexed without positions match as plain words.
+
+PHRASE_RE = re.compile(r'"([^"]*)"')
+
+
+def query_phrases(query):
+    # analyzed phrases of two or more tokens, in query order; an unpaired quote is ignored
+    phrases = (tuple(analyzer.analyze(text)) for text in PHRASE_RE.findall(query))
+    return tuple(dict.fromkeys(p for p in phrases if len(p) > 1))
+
+
+def _sorted_unique(values):
+    return values[np.flatnonzero(np.diff(values, prepend=-1))]
+
+
+def _expand(starts, lengths):
+    # concatenated ranges [start, start + length)
+    return np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+
+
+def plan_phrases(phrases, postings):
+    # -> (candidates, wanted): sorted docs holding every word of every phrase, and per word
+    # the position blocks of those docs ({term: [block index]})
+    terms = sorted({term for phrase in phrases for term in phrase})
+    if any(term not in postings for term in terms):
+        return np.zeros(0, dtype=np.int64), {}
+    lists = {term: postings[term].decode()[0] for term in terms}
+    candidates = intersect_arrays([lists[t] for t in sorted(terms, key=lambda t: lists[t].size)])
+    wanted = {term: _sorted_unique(np.searchsorted(lists[term], candidates) // BLOCK_SIZE).tolist()
+              for term in terms}
+    return candidates, wanted
+
+
+def candidate_positions(reader, candidates, blocks):
+    # positions of the candidates in one posting list, from the list's position blocks
+    # ({block index: bytes}) -> (positions, owner), owner being the index of the candidate
+    if not candidates.size:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    doc_ids, tfs = reader.decode()
+    idx = np.searchsorted(doc_ids, candidates)
+    wanted = _sorted_unique(idx // BLOCK_SIZE)
+
+    # blocks are self-contained, joined they decode in one go as the docs of all wanted blocks
+    starts = wanted * BLOCK_SIZE
+    in_blocks = _expand(starts, np.minimum(starts + BLOCK_SIZE, tfs.size) - starts)
+    decoded = decode_block_positions(b''.join(blocks[block] for block in wanted.tolist()), tfs[in_blocks])
+    firsts = np.cumsum(tfs[in_blocks]) - tfs[in_blocks]
+
+    lengths = tfs[idx]
+    positions = decoded[_expand(firsts[np.searchsorted(in_blocks, idx)], lengths)]
+    return positions, np.repeat(np.arange(candidates.size), lengths)
+
+
+def verify_phrase(phrase, positions):
+    # candidate indices where the phrase occurs (once per occurrence): word i at some position
+    # p + i for all i. Each word's (candidate, position - i) pairs are packed into one int64;
+    # owners ascend and so do a doc's positions, so the keys come sorted and are intersected
+    # like posting lists.
+    keys = []
+    for offset, term in enumerate(phrase):
+        pos, owner = positions[term]
+        ok = pos >= offset
+        keys.append((owner[ok] << 32) | (pos[ok] - offset))
+    return intersect_arrays(sorted(keys, key=lambda k: k.size)) >> 32
+
+
+def match_phrases(phrases, postings, candidates, blocks):
+    # blocks: {term: {block index: bytes}} for the terms that have positions
+    # -> the candidates that contain every phrase
+    positions = {term: candidate_positions(postings[term], candidates, term_blocks)
+                 for term, term_blocks in blocks.items()}
+    keep = np.ones(candidates.size, dtype=bool)
+    for phrase in phrases:
+        if any(term not in positions for term in phrase):
+            count("phrases_unverified")
+            continue
+        found = np.zeros(candidates.size, dtype=bool)
+        found[verify_phrase(phrase, positions)] = True
+        keep &= found
+    return candidates[keep]
@@ -0,0 +1,113 @@
+import threading
+from collections import OrderedDict
+
+from compute.utils.postings_codec import PostingsReader
+
+# Byte-budgeted LRU cache of decoded posting lists, shared by all request threads.
+# Keys are (index version, term) so a newly published index never serves stale postings;
+# entries of older versions are dropped when SearchEngine reloads its doc stats.
+# Terms missing from the index are cached too (as None), they cost a round trip just the same.
+
+MISSING_ENTRY_BYTES = 64
+
+
+class DecodedPostings(PostingsReader):
+    # PostingsReader that decodes the whole list once; arrays are read-only and shared
+    # across threads. Block-level access (Block-Max WAND) still works off the blob.
+    # copy=False keeps a view of the caller's buffer (an mmap'd segment) instead of a private copy.
+
+    def __init__(self, blob, copy=True):
+        super().__init__(bytes(blob) if copy else blob)
+        self.doc_ids, self.tfs = super().decode()
+        self.doc_ids.flags.writeable = False
+        self.tfs.flags.writeable = False
+        self.nbytes = (len(self.blob) if copy else 0) + self.doc_ids.nbytes + self.tfs.nbytes
+
+    def decode(self, limit=None):
+        if limit is None:
+            return self.doc_ids, self.tfs
+        return self.doc_ids[:limit], self.tfs[:limit]
+
+
+class PostingsCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        # a single huge list must not flush the whole cache
+        self.max_entry_bytes = max_bytes // 4
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _entry_bytes(term, postings):
+        size = len(term) + MISSING_ENTRY_BYTES
+        return size if postings is None else size + postings.nbytes
+
+    def get_many(self, version, terms):
+        # returns ({term: postings or None} for cached terms, [terms to fetch])
+        found = {}
+        missing = []
+        with self._lock:
+            for term in terms:
+                key = (version, term)
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[term] = self._entries[key][0]
+                    self.hits += 1
+                else:
+                    missing.append(term)
+                    self.misses += 1
+        return found, missing
+
+    def peek(self, version, terms):
+        # like get_many, without touching LRU order or hit counters
+        with self._lock:
+            found = {t: self._entries[(version, t)][0] for t in terms if (version, t) in self._entries}
+        return found, [t for t in terms if t not in found]
+
+    def put(self, version, term, postings):
+        nbytes = self._entry_bytes(term, postings)
+        if nbytes > self.max_entry_bytes:
+            return
+
+        key = (version, term)
+        with self._lock:
+            if key in self._entries:
+                self.bytes_used -= self._entries.pop(key)[1]
+            self._entries[key] = (postings, nbytes)
+            self.bytes_used += nbytes
+
+            while self.bytes_used > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.bytes_used -= evicted_bytes
+                self.evictions += 1
+
+    def retain_version(self, version):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] != version]:
+                self.bytes_used -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes_used = 0
+
+    def is_full(self, headroom=0.9):
+        return self.bytes_used >= self.max_bytes * headroom
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes_used": self.bytes_used,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,109 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Full-response cache for /search, keyed by the analyzed query and ranking parameters.
+# Local level: in-process TTL + LRU. Optional shared level: Redis, so backend replicas
+# share hits. Entries belong to one index version; a new version invalidates everything
+# (local entries are dropped, Redis keys carry the version and simply expire).
+
+CACHE_MISS = "MISS"
+CACHE_HIT = "HIT"
+CACHE_HIT_SHARED = "HIT-SHARED"
+CACHE_BYPASS = "BYPASS"
+
+
+def result_cache_key(tokens, limit, pagerank, semantics, alpha, beta, match="or", phrases=()):
+    return json.dumps([sorted(set(tokens)), limit, pagerank, semantics, alpha, beta, match, [list(p) for p in phrases]])
+
+
+class ResultCache:
+    def __init__(self, max_entries=10000, ttl=300, redis_client=None, redis_prefix="search:results"):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.redis = redis_client
+        self.redis_prefix = redis_prefix
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def _redis_key(self, version, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return f"{self.redis_prefix}:v{version}:{digest}"
+
+    def _check_version(self, version):
+        # caller holds the lock
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def get(self, version, key):
+        # returns (value or None, cache status)
+        now = time.time()
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value, CACHE_HIT
+                del self._entries[key]
+
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(self._redis_key(version, key))
+            except Exception as e:
+                print(f" Result cache Redis get failed: {e}", flush=True)
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self._put_local(version, key, value)
+                with self._lock:
+                    self.shared_hits += 1
+                return value, CACHE_HIT_SHARED
+
+        with self._lock:
+            self.misses += 1
+        return None, CACHE_MISS
+
+    def _put_local(self, version, key, value):
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, version, key, value):
+        self._put_local(version, key, value)
+        if self.redis is not None:
+            try:
+                self.redis.setex(self._redis_key(version, key), self.ttl, json.dumps(value))
+            except Exception as e:
+                print(f" Result cache Redis set failed: {e}", flush=True)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "shared": self.redis is not None,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            }
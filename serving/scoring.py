@@ -0,0 +1,408 @@
+import numpy as np
+
+from compute.utils.bm25 import K1, B, bm25_idf, bm25_tf_norm
+from serving.wand import EPSILON, PostingCursor, block_max_wand
+from serving.intersect import intersect_arrays, intersect_cursors
+from serving.metrics import count
+from compute.utils.title_terms import term_hashes
+
+# Candidate retrieval for SearchEngine.search. All paths score
+#     base(d) = bm25_weight * bm25(d) [+ pr_weight * pr_norm(d)]
+# and return survivors as parallel arrays (doc_ids, base, bm25): every doc that can still
+# make the final top-k once the caller multiplies base by a title boost of at most boost_max.
+# Docs that can't be shown (DocStats.showable) are left out before any k-th best score is taken,
+# so they never push a shown doc out of the top k.
+# BM25 sums always add terms in the caller's token order, so all paths agree bit for bit.
+
+# Title-match boost: exact token-set match, query within title, title within query
+TITLE_BOOST_EXACT = 3.0
+TITLE_BOOST_QUERY_IN_TITLE = 1.5
+TITLE_BOOST_TITLE_IN_QUERY = 2.0
+TITLE_BOOST_MAX = max(TITLE_BOOST_EXACT, TITLE_BOOST_QUERY_IN_TITLE, TITLE_BOOST_TITLE_IN_QUERY)
+
+
+def survivor_arrays(survivors):
+    if not survivors:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+    doc_ids, base, bm25 = zip(*survivors)
+    return np.array(doc_ids, dtype=np.int64), np.array(base), np.array(bm25)
+
+
+def _base_score(stats, doc_id, bm25_score, bm25_weight, pr_weight):
+    if pr_weight:
+        return (bm25_weight * bm25_score) + (pr_weight * stats.pr_norm(doc_id))
+    return bm25_weight * bm25_score
+
+
+def retrieve_exhaustive(stats, tokens, postings, k, bm25_weight=1.0, pr_weight=0.0, boost_max=1.0, k1=K1, b=B):
+    # Reference path: pure python loop over every posting, no pruning
+    bm25_scores = {}
+    for term in tokens:
+        if term not in postings: continue
+        reader = postings[term]
+        idf = bm25_idf(stats.N, reader.collection_df)
+        doc_ids, tfs = reader.decode()
+        for doc_id, tf in zip(doc_ids.tolist(), tfs.tolist()):
+            score = idf * bm25_tf_norm(tf, stats.doc_length(doc_id), stats.avgdl, k1, b)
+            bm25_scores[doc_id] = bm25_scores.get(doc_id, 0.0) + score
+
+    return survivor_arrays([
+        (doc_id, _base_score(stats, doc_id, bm25_score, bm25_weight, pr_weight), bm25_score)
+        for doc_id, bm25_score in bm25_scores.items()
+    ])
+
+
+def retrieve_vectorized(stats, tokens, postings, k, bm25_weight=1.0, pr_weight=0.0, boost_max=1.0, k1=K1, b=B):
+    # Whole posting lists decoded into doc-id / tf arrays, BM25 as array arithmetic
+    doc_parts = []
+    score_parts = []
+    for term in tokens:
+        if term not in postings: continue
+        reader = postings[term]
+        idf = bm25_idf(stats.N, reader.collection_df)
+        doc_ids, tfs = reader.decode()
+        doc_parts.append(doc_ids)
+        score_parts.append(idf * bm25_tf_norm(tfs.astype(np.float64), stats.doc_lengths(doc_ids), stats.avgdl, k1, b))
+
+    if not doc_parts:
+        return survivor_arrays([])
+
+    all_docs = np.concatenate(doc_parts)
+    all_scores = np.concatenate(score_parts)
+
+    # accumulate per doc; bincount adds in input order (= token order), like np.add.at but faster
+    docs, inverse = np.unique(all_docs, return_inverse=True)
+    bm25 = np.bincount(inverse, weights=all_scores, minlength=docs.size)
+
+    base = bm25_weight * bm25
+    if pr_weight:
+        base = base + pr_weight * stats.pr_norms(docs)
+    return _prune(stats, docs, base, bm25, k, boost_max)
+
+
+def _prune(stats, docs, base, bm25, k, boost_max):
+    # k-th best base score of the showable docs is a lower bound for the k-th best final score
+    shown = stats.showable_mask(docs)
+    docs, base, bm25 = docs[shown], base[shown], bm25[shown]
+    if docs.size > k:
+        top = np.argpartition(base, docs.size - k)[docs.size - k:]
+        theta = float(base[top].min())
+        keep = np.flatnonzero(base * boost_max >= theta - abs(theta) * EPSILON)
+        docs, base, bm25 = docs[keep], base[keep], bm25[keep]
+
+    return docs, base, bm25
+
+
+def retrieve_block_max_wand(stats, tokens, postings, k, bm25_weight=1.0, pr_weight=0.0, boost_max=1.0, k1=K1, b=B):
+    cursors = [
+        PostingCursor(term, postings[term], bm25_idf(stats.N, postings[term].collection_df), stats.bound_scale)
+        for term in tokens if term in postings
+    ]
+
+    def score_matched(doc_id, matched):
+        if not stats.is_showable(doc_id):
+            return None
+        doc_len = stats.doc_length(doc_id)
+        bm25_score = 0.0
+        for c in matched:
+            bm25_score += c.idf * bm25_tf_norm(c.tf, doc_len, stats.avgdl, k1, b)
+        return _base_score(stats, doc_id, bm25_score, bm25_weight, pr_weight), bm25_score
+
+    static_max = pr_weight * stats.max_pr_norm if pr_weight else 0.0
+    return survivor_arrays(block_max_wand(cursors, k, score_matched, bm25_weight=bm25_weight,
+                                           static_max=static_max, boost_max=boost_max))
+
+
+# Early termination over PageRank-ordered doc ids (compute/indexing/reorder_docs.py numbers docs by
+# descending PageRank): the lists are scored in doc-id windows of doubling size, and the scan
+# stops once no doc past the window can beat the k-th best final score. From doc id D on, a doc
+# scores at most its terms' block-max impacts from D on plus pr_weight * DocStats.pr_norm_bound(D),
+# which in PageRank order is the pr_norm of D itself. Docs whose title holds a query term are
+# scored up front (binary searches), so the rest have a title boost of 1. Any doc order gives the
+# same results; without the reordering the scan just rarely stops early.
+
+ORDERED_FIRST_WINDOW = 4096
+
+
+class _Slice:
+    # a doc-id range of a decoded posting list, scored like the whole list
+    def __init__(self, doc_ids, tfs, collection_df):
+        self.doc_ids, self.tfs, self.collection_df = doc_ids, tfs, collection_df
+
+    def decode(self):
+        return self.doc_ids, self.tfs
+
+
+def retrieve_ordered(stats, tokens, postings, k, bm25_weight=1.0, pr_weight=0.0, boost_max=1.0, k1=K1, b=B,
+                     conjunctive=False):
+    terms = [term for term in tokens if term in postings]
+    if not terms or (conjunctive and len(terms) < len(tokens)):
+        return survivor_arrays([])
+    lists = {term: postings[term].decode() for term in terms}
+
+    def score(docs):
+        bm25, held = _bm25_within(stats, tokens, postings, docs, k1, b)
+        base = bm25_weight * bm25
+        if pr_weight:
+            base = base + pr_weight * stats.pr_norms(docs)
+        return base, bm25, held
+
+    # title-boosted docs holding the query terms, exact wherever they are in the lists
+    query_hashes = term_hashes(tokens)
+    boosted = stats.title_docs(query_hashes)
+    boosted = boosted[stats.showable_mask(boosted)]
+    base, bm25, held = score(boosted)
+    match = np.logical_and.reduce if conjunctive else np.logical_or.reduce
+    keep = match([held[term] for term in terms])
+    boosted, parts = boosted[keep], [(boosted[keep], base[keep], bm25[keep])]
+    top = base[keep] * title_boosts(stats, boosted, query_hashes)
+
+    # best BM25 part of each term from every block on
+    block_ub = {term: bm25_weight * bm25_idf(stats.N, postings[term].collection_df) * stats.bound_scale
+                * np.maximum.accumulate(postings[term].block_max_impact[::-1])[::-1] for term in terms}
+    end = max(int(postings[term].block_last_doc[-1]) for term in terms) + 1
+    start, window = 0, ORDERED_FIRST_WINDOW
+    while start < end:
+        stop = min(start + window, end)
+        window_postings = {}
+        for term in terms:
+            doc_ids, tfs = lists[term]
+            lo, hi = np.searchsorted(doc_ids, start), np.searchsorted(doc_ids, stop)
+            window_postings[term] = _Slice(doc_ids[lo:hi], tfs[lo:hi], postings[term].collection_df)
+        if conjunctive:
+            docs = intersect_arrays(sorted((p.doc_ids for p in window_postings.values()), key=lambda d: d.size))
+            docs, base, bm25 = retrieve_within(stats, tokens, window_postings, docs, k, bm25_weight, pr_weight,
+                                               boost_max, k1, b)
+        else:
+            docs, base, bm25 = retrieve_vectorized(stats, tokens, window_postings, k, bm25_weight, pr_weight,
+                                                   boost_max, k1, b)
+        keep = ~_member(docs, boosted)
+        docs, base, bm25 = docs[keep], base[keep], bm25[keep]
+        parts.append((docs, base, bm25))
+        top = np.concatenate([top, base])
+        if top.size > k:
+            top = np.partition(top, top.size - k)[top.size - k:]
+        start, window = stop, window * 2
+
+        if top.size >= k and start < end:
+            theta = float(top.min())
+            blocks = {term: np.searchsorted(postings[term].block_last_doc, start) for term in terms}
+            left = [float(block_ub[term][blocks[term]]) for term in terms if blocks[term] < block_ub[term].size]
+            if conjunctive and len(left) < len(terms):
+                break
+            bound = sum(left) + (pr_weight * stats.pr_norm_bound(start) if pr_weight else 0.0)
+            if not left or bound < theta - abs(theta) * EPSILON:
+                break
+
+    count("postings_scanned", sum(int(np.searchsorted(lists[term][0], start)) for term in terms))
+    docs, base, bm25 = (np.concatenate(arrays) for arrays in zip(*parts))
+    return _prune(stats, docs, base, bm25, k, boost_max)
+
+
+RETRIEVERS = {
+    "exhaustive": retrieve_exhaustive,
+    "vectorized": retrieve_vectorized,
+    "bmw": retrieve_block_max_wand,
+    "ordered": retrieve_ordered,
+}
+
+
+# Conjunctive (AND) retrieval: only docs holding every token are scored; a token without
+# postings matches nothing. Scores of the docs that do match equal the disjunctive paths' bit for bit.
+
+def retrieve_conjunctive_vectorized(stats, tokens, postings, k, bm25_weight=1.0, pr_weight=0.0, boost_max=1.0,
+                                    k1=K1, b=B):
+    # decoded lists intersected with vectorized binary searches, BM25 of the intersection as arrays
+    if any(term not in postings for term in tokens):
+        return survivor_arrays([])
+    lists = {term: postings[term].decode()[0] for term in tokens}
+    docs = intersect_arrays([lists[term] for term in sorted(tokens, key=lambda t: lists[t].size)])
+    return retrieve_within(stats, tokens, postings, docs, k, bm25_weight, pr_weight, boost_max, k1, b)
+
+
+def retrieve_within(stats, tokens, postings, docs, k, bm25_weight=1.0, pr_weight=0.0, boost_max=1.0, k1=K1, b=B):
+    # scores only `docs` (sorted doc ids, e.g. an intersection or phrase matches)
+    bm25, _ = _bm25_within(stats, tokens, postings, docs, k1, b)
+    base = bm25_weight * bm25
+    if pr_weight:
+        base = base + pr_weight * stats.pr_norms(docs)
+    return _prune(stats, docs, base, bm25, k, boost_max)
+
+
+def _bm25_within(stats, tokens, postings, docs, k1, b):
+    # BM25 of sorted `docs` with binary searches into the decoded lists -> (bm25, {term: held}),
+    # held flags the docs found in the term's list; a term a doc doesn't hold adds nothing
+    bm25 = np.zeros(docs.size)
+    held = {}
+    doc_lengths = stats.doc_lengths(docs)
+    for term in tokens:
+        if term not in postings: continue
+        doc_ids, tfs = postings[term].decode()
+        idf = bm25_idf(stats.N, postings[term].collection_df)
+        pos = np.minimum(np.searchsorted(doc_ids, docs), doc_ids.size - 1)
+        held[term] = doc_ids[pos] == docs
+        tf = np.where(held[term], tfs[pos], 0).astype(np.float64)
+        bm25 = bm25 + idf * bm25_tf_norm(tf, doc_lengths, stats.avgdl, k1, b)
+    return bm25, held
+
+
+def retrieve_conjunctive_cursors(stats, tokens, postings, k, bm25_weight=1.0, pr_weight=0.0, boost_max=1.0,
+                                 k1=K1, b=B):
+    # block cursors leapfrogging over the lists; blocks no candidate falls in are never decoded
+    if any(term not in postings for term in tokens):
+        return survivor_arrays([])
+    cursors = [PostingCursor(term, postings[term], bm25_idf(stats.N, postings[term].collection_df))
+               for term in tokens]
+
+    survivors = []
+    for doc_id in intersect_cursors(sorted(cursors, key=lambda c: c.df)):
+        doc_len = stats.doc_length(doc_id)
+        bm25_score = 0.0
+        for c in cursors:
+            bm25_score += c.idf * bm25_tf_norm(c.tf, doc_len, stats.avgdl, k1, b)
+        survivors.append((doc_id, _base_score(stats, doc_id, bm25_score, bm25_weight, pr_weight), bm25_score))
+
+    docs, base, bm25 = survivor_arrays(survivors)
+    return _prune(stats, docs, base, bm25, k, boost_max)
+
+
+def retrieve_conjunctive_ordered(stats, tokens, postings, k, bm25_weight=1.0, pr_weight=0.0, boost_max=1.0,
+                                 k1=K1, b=B):
+    # windows intersected instead of merged, the scan stops once a term's list runs out
+    return retrieve_ordered(stats, tokens, postings, k, bm25_weight, pr_weight, boost_max, k1, b, conjunctive=True)
+
+
+CONJUNCTIVE_RETRIEVERS = {
+    "exhaustive": retrieve_conjunctive_cursors,
+    "vectorized": retrieve_conjunctive_vectorized,
+    "bmw": retrieve_conjunctive_cursors,
+    "ordered": retrieve_conjunctive_ordered,
+}
+
+
+def title_boosts(stats, doc_ids, query_hashes):
+    # Title boost per doc from the precomputed title signatures (doc_ids must have titles).
+    # Signatures hold distinct tokens, so counting title tokens found in the query is enough:
+    # all title tokens matched -> title within query, all query tokens matched -> query within title.
+    starts = stats.title_offsets[doc_ids]
+    counts = stats.title_offsets[doc_ids + 1] - starts
+
+    owner = np.repeat(np.arange(doc_ids.size), counts)
+    positions = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+    hits = np.isin(stats.title_hashes[positions], query_hashes)
+    matched = np.bincount(owner, weights=hits, minlength=doc_ids.size)
+
+    title_in_query = (counts > 0) & (matched == counts)
+    query_in_title = (counts > 0) & (matched == len(query_hashes))
+
+    boosts = np.ones(doc_ids.size)
+    boosts[query_in_title] = TITLE_BOOST_QUERY_IN_TITLE
+    boosts[title_in_query] = TITLE_BOOST_TITLE_IN_QUERY
+    boosts[title_in_query & query_in_title] = TITLE_BOOST_EXACT
+    return boosts
+
+
+# Tier-1 retrieval from champion lists (compute/utils/champions.py): each term's best postings by
+# static score, with the bound of the ones left out (None when the list is complete). Docs held
+# by every cut list are scored exactly; every other doc gets an upper bound, from
+#     impact(d) <= bound - pr_weight * pr_norm(d)    for each cut list d is not in,
+# times its exact title boost (1 unless its title holds a query term). When the k-th best exact
+# final score beats every bound, the champions' top k is the full lists' top k.
+
+def _member(values, sorted_docs):
+    # flags the values found in sorted_docs
+    if not sorted_docs.size:
+        return np.zeros(values.size, dtype=bool)
+    pos = np.minimum(np.searchsorted(sorted_docs, values), sorted_docs.size - 1)
+    return sorted_docs[pos] == values
+
+
+def retrieve_champions(stats, tokens, champions, k, conjunctive=False, bm25_weight=1.0, pr_weight=0.0,
+                       boost_max=1.0, k1=K1, b=B):
+    # champions: {term: DecodedPostings with .collection_df, .bound, .pr_weight}
+    # -> survivors like the retrievers above (only docs scored exactly), or None when the full
+    # lists are needed. conjunctive: rank only docs holding every token, like match=and
+    terms = [term for term in tokens if term in champions]
+    if not terms or (conjunctive and len(terms) < len(tokens)):
+        return None
+    cut = [term for term in terms if champions[term].bound is not None]
+    lists = [champions[term].decode()[0] for term in terms]
+    docs = lists[0] if len(lists) == 1 else np.unique(np.concatenate(lists))
+    bm25, held = _bm25_within(stats, tokens, champions, docs, k1, b)
+    pr = stats.pr_norms(docs)
+    base = bm25_weight * bm25
+    if pr_weight:
+        base = base + pr_weight * pr
+
+    # best BM25 part of a term for docs outside its champion list with log-PageRank p (0: none can hold it)
+    weights = {term: bm25_weight * bm25_idf(stats.N, champions[term].collection_df) * stats.bound_scale
+               for term in cut}
+
+    def left_out(term, p):
+        return weights[term] * np.maximum(0.0, champions[term].bound - champions[term].pr_weight * p)
+
+    complete = np.ones(docs.size, dtype=bool)
+    for term in cut:
+        complete &= held[term]
+    # docs outside a complete list don't hold its term, those outside a cut list may
+    possible = np.ones(docs.size, dtype=bool)
+    upper = base.copy()
+    for term in cut:
+        outside = ~held[term]
+        gain = left_out(term, pr[outside])
+        upper[outside] += gain
+        if conjunctive:
+            possible[np.flatnonzero(outside)[gain <= 0]] = False
+    if conjunctive:
+        for term in terms:
+            if champions[term].bound is None:
+                possible &= held[term]
+        complete &= possible
+
+    # docs that can't be shown never count; only a title holding a query term gives a boost
+    shown = stats.showable_mask(docs)
+    query_hashes = term_hashes(tokens)
+    title_docs = stats.title_docs(query_hashes)
+    in_union = _member(title_docs, docs)
+    boosted = np.searchsorted(docs, title_docs[in_union])
+    boosts = np.ones(docs.size)
+    boosts[boosted] = title_boosts(stats, docs[boosted], query_hashes)
+
+    exact = complete & shown
+    if np.count_nonzero(exact) < k:
+        return None
+    final = base[exact] * boosts[exact]
+    theta = float(np.partition(final, final.size - k)[final.size - k])
+
+    rest = ~complete & shown & possible
+    best_other = float((upper[rest] * boosts[rest]).max()) if rest.any() else 0.0
+
+    # docs in no champion list: hold a cut term only while some bound is above pr_weight * p
+    # (every cut term for AND, whose complete lists must then be empty); the bound is convex
+    # in p, so its maximum over a range of p is at one end
+    if cut and (not conjunctive or len(cut) == len(terms)):
+        reach = [champions[term].bound / champions[term].pr_weight if champions[term].pr_weight > 0 else np.inf
+                 for term in cut]
+        p_max = min(stats.max_pr_norm, min(reach) if conjunctive else max(reach))
+
+        def outside_bound(p):
+            return sum(left_out(term, p) for term in cut) + (pr_weight * p if pr_weight else 0.0)
+
+        if p_max >= 0:
+            best_other = max(best_other, float(outside_bound(0.0)), float(outside_bound(p_max)))
+            # their title boost is 1, unless the title holds a query term
+            unseen = title_docs[~in_union]
+            unseen = unseen[stats.showable_mask(unseen)]
+            if unseen.size:
+                unseen_pr = stats.pr_norms(unseen)
+                bounds = outside_bound(unseen_pr)
+                # exact boosts only where the largest one could matter
+                near = np.flatnonzero((unseen_pr <= p_max) & (bounds * boost_max >= theta - abs(theta) * EPSILON))
+                if near.size:
+                    bounds = bounds[near] * title_boosts(stats, unseen[near], query_hashes)
+                    best_other = max(best_other, float(bounds.max()))
+
+    if best_other >= theta - abs(theta) * EPSILON:
+        return None
+    keep = np.flatnonzero(exact)
+    return _prune(stats, docs[keep], base[keep], bm25[keep], k, boost_max)
@@ -3,12 +3,13 @@ import re
 import psycopg2
 from psycopg2 import pool
 from psycopg2.extras import RealDictCursor
-import math
 import os
 import logging
 from contextlib import contextmanager
 import sys
-from utils import timer
+import threading
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor
 
 # Use semantic search if sentence-transformers is installed
 # Currently not using it for simplicity of Docker images
@@ -25,23 +26,105 @@ import numpy as np
 
 sys.path.append("/app")
 from compute.utils.tokenizer import analyzer
+from compute.utils.bm25 import K1, B, bm25_idf, bm25_tf_norm
+from serving.doc_stats import DocStats
+from serving.postings_cache import PostingsCache, DecodedPostings
+from serving.metrics import stage, count
+from serving.deadline import Deadline, AnytimeSearch
+from serving.scoring import (RETRIEVERS, CONJUNCTIVE_RETRIEVERS, TITLE_BOOST_MAX, title_boosts, survivor_arrays,
+                             retrieve_within, retrieve_champions)
+from serving.intersect import intersect_arrays
+from serving.phrase import query_phrases, plan_phrases, match_phrases
+from compute.utils.title_terms import term_hashes
+from compute.utils.term_offsets import decode_offsets, query_positions, best_window
+from compute.utils.doc_store import DocStore, MANIFEST_FILE as DOC_STORE_MANIFEST
+from compute.utils.positions_codec import directory_size, read_directory, block_range
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SNIPPET_WINDOW = 150
+# characters fetched past the window so its last word is not cut
+SNIPPET_SLACK = 30
+
+# one substring per (doc_id, start) pair, i is the pair's 1-based position; starts are 1-based like substr()
+SNIPPET_WINDOWS_SQL = """
+    SELECT w.i, substr(m.text, w.start, %s) AS fragment
+    FROM unnest(%s::int[], %s::int[]) WITH ORDINALITY AS w(doc_id, start, i)
+    JOIN doc_texts m ON m.doc_id = w.doc_id
+"""
+
+# leading bytes (header + block directory) of the positions of each term, see _fetch_position_blocks()
+POSITIONS_HEAD_SQL = """
+    SELECT t.term, substring(t.positions from 1 for h.len)
+    FROM unnest(%s::text[], %s::int[]) AS h(term, len)
+    JOIN inverted_index t ON t.term = h.term
+    WHERE t.positions IS NOT NULL
+"""
+
+# one byte range of a term's positions per row, i is the range's 1-based position; starts are 1-based
+POSITIONS_BLOCKS_SQL = """
+    SELECT b.i, substring(t.positions from b.start for b.len)
+    FROM unnest(%s::text[], %s::int[], %s::int[]) WITH ORDINALITY AS b(term, start, len, i)
+    JOIN inverted_index t ON t.term = b.term
+"""
+
+# top-k survivors (doc_id, base, bm25) scored inside Postgres, see _retrieve_pushdown()
+PUSHDOWN_SQL = "SELECT doc_id, base, bm25 FROM bm25_pr_topk(%s::text[], %s, %s, %s, %s, %s, %s, %s, %s)"
+
+# tier-1 lists (compute/utils/champions.py); a term without one is its own tier 1, bound NULL
+CHAMPION_COLUMNS = "term, df, coalesce(champions, postings), champion_bound, champion_pr_weight"
+
+# terms per postings query in search_many()
+BATCH_TERMS = 500
+
 
 class SearchEngine:
     def __init__(self):
+        self._init_settings()
+
+        self._initialize_database_conn_pool()
+        self.reload_doc_stats(force=True)
+        self._initialize_database_indexes()
+        self.warm_postings_cache()
+
+    def _init_settings(self):
         self.pg_host = os.getenv("PG_HOST", "postgres")
         self.pg_user = os.getenv("PG_USER", "admin")
         self.pg_pass = os.getenv("PG_PASS", "password")
         self.pg_db = os.getenv("PG_DB", "search_engine")
 
-        self.k1 = 1.5
-        self.b = 0.4
+        # compressed article texts written by compute/export_metadata.py (compute/utils/doc_store.py);
+        # snippets come from Postgres when the directory has no store
+        self.doc_store_dir = os.getenv("DOC_STORE_DIR", "/app/data/docstore")
+        self.doc_store = None
+
+        self.k1 = K1
+        self.b = B
         self.alpha = 0.7
         self.beta = 0.3
 
+        # "vectorized": numpy scoring of whole posting lists, "bmw": Block-Max WAND top-k,
+        # "exhaustive": python loop over every posting (reference / debugging), see serving/scoring.py
+        # "ordered": vectorized in doc-id windows, stopping early once the rest of the lists can't
+        # reach the top k; pays off with docs numbered by PageRank (compute/indexing/reorder_docs.py)
+        # "pushdown": BM25 + PageRank top-k inside Postgres (bm25_pr_topk in compute/db_utils.py).
+        # Decoding postings in SQL is far slower than numpy (test/bench_pushdown.py), worst on the
+        # longest lists, so it only pays off when moving the lists is the bottleneck (remote
+        # database, tiny cache). The former "auto" mode pushed exactly the largest queries down.
+        self.retrieval_mode = os.getenv("SEARCH_RETRIEVAL", "vectorized")
+        if self.retrieval_mode == "auto":
+            print("SEARCH_RETRIEVAL=auto was removed, using vectorized", flush=True)
+            self.retrieval_mode = "vectorized"
+
+        # default for the match parameter of a search: "or" scores every doc holding any query term,
+        # "and" only docs holding all of them, "auto" is "and" unless that leaves fewer than k docs.
+        # Conjunctive queries are always scored locally, pushdown is disjunctive.
+        self.match_mode = os.getenv("SEARCH_MATCH", "or")
+
+        # threads scoring the queries of one search_many() batch
+        self.batch_workers = int(os.getenv("SEARCH_BATCH_WORKERS", str(os.cpu_count() or 4)))
+
 
         self.enable_semantic = False
         self.semantic_topk = 50  # semantic rerank for top K (try set larger but query time increase)
@@ -57,9 +140,18 @@ class SearchEngine:
             self.semantic_model = None
             self.enable_semantic = False
 
-        self._initialize_database_conn_pool()
-        self._load_global_stats()
-        self._initialize_database_indexes()
+        # decoded postings of hot terms; warmed with the highest-df terms (or a query log file)
+        self.postings_cache = PostingsCache(int(os.getenv("POSTINGS_CACHE_MB", "256")) * 1024 * 1024)
+        self.cache_warm_terms = int(os.getenv("POSTINGS_CACHE_WARM_TERMS", "2000"))
+        self.cache_warm_file = os.getenv("POSTINGS_CACHE_WARM_FILE")
+
+        # tier 1: rank from the terms' champion lists (compute/utils/champions.py) first, and fetch
+        # the full posting lists only when those can't prove their top k (serving/scoring.py)
+        self.use_champions = os.getenv("SEARCH_CHAMPIONS", "1") == "1"
+        self.champion_cache = PostingsCache(int(os.getenv("CHAMPION_CACHE_MB", "64")) * 1024 * 1024)
+
+        self.stats = None
+        self._reload_lock = threading.Lock()
 
     def _initialize_database_conn_pool(self):
         print("Initializing PostgreSQL Connection Pool...", flush=True)
@@ -118,255 +210,546 @@ class SearchEngine:
         finally:
             self.pg_pool.putconn(conn)
 
-    def _load_global_stats(self):
-        print("Loading global stats...", flush=True)
+    def _current_index_version(self):
+        with self._get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT value FROM config WHERE key=%s", ('index_version',))
+                row = cur.fetchone()
+                return int(row[0]) if row else 0
+
+    def reload_doc_stats(self, force=False):
+        # Reload per-doc arrays if a new index version was published (or always, with force).
+        # Searches keep using the old snapshot until the new one is swapped in.
+        with self._reload_lock:
+            try:
+                if not force and self.stats is not None and self._current_index_version() == self.stats.version:
+                    return False
+
+                print("Loading doc stats...", flush=True)
+                with self._get_conn() as conn:
+                    stats = DocStats.load(conn)
+            except Exception as e:
+                print(f" Doc stats failed: {e}", flush=True)
+                if self.stats is None:
+                    self.stats = DocStats.empty()
+                return False
+
+            self._swap_doc_stats(stats)
+            return True
+
+    def _swap_doc_stats(self, stats):
+        self.stats = stats
+        self.postings_cache.retain_version(stats.version)
+        self.champion_cache.retain_version(stats.version)
+        print(f" Doc stats loaded: version={stats.version}, N={stats.N}, AvgDL={stats.avgdl:.2f}, "
+              f"{len(stats.titles)} ordinals", flush=True)
+        self._open_doc_store()
+
+    def _open_doc_store(self):
+        # (re)mapped with every doc stats reload, export_metadata.py rewrites it with the texts
+        if not self.doc_store_dir or not os.path.exists(os.path.join(self.doc_store_dir, DOC_STORE_MANIFEST)):
+            self.doc_store = None
+            return
         try:
-            with self._get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("SELECT value FROM config WHERE key=%s", ('avgdl',))
-                    row = cur.fetchone()
-                    self.avgdl = float(row[0]) if row else 100.0
-
-                    cur.execute("SELECT count(*) FROM metadata")
-                    row = cur.fetchone()
-                    self.N = int(row[0]) if row else 0
-            print(f" Stats loaded: N={self.N}, AvgDL={self.avgdl:.2f}", flush=True)
+            self.doc_store = DocStore(self.doc_store_dir)
+            print(f" Doc store mapped: {self.doc_store.manifest['n_docs']} texts ({self.doc_store.codec})", flush=True)
         except Exception as e:
-            print(f" Stats failed: {e}", flush=True)
-            self.avgdl = 200.0;
-            self.N = 100000
+            print(f" Doc store failed, snippets from Postgres: {e}", flush=True)
+            self.doc_store = None
 
-    @timer
-    def get_metadata_bulk(self, doc_ids):
-        res = {}
-        if not doc_ids: return res
-        clean_map = {did: did.lstrip('_') for did in doc_ids}
-        clean_ids = list(set(clean_map.values()))
+    def get_snippets_bulk(self, doc_ids, query_tokens):
+        if not doc_ids: return {}
+        return self.get_snippets_many([(doc_ids, query_tokens)])[0]
 
-        with self._get_conn() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                sql = "SELECT doc_id, length FROM metadata WHERE doc_id IN %s"
-                cur.execute(sql, (tuple(clean_ids),))
-                temp_data = {row['doc_id']: row['length'] for row in cur.fetchall()}
-                for raw_id in doc_ids:
-                    clean = clean_map[raw_id]
-                    if clean in temp_data: res[raw_id] = temp_data[clean]
-        return res
-    @timer
-    def get_pagerank_bulk(self, doc_ids):
-        res = {}
-        if not doc_ids: return res
-        clean_map = {did: did.lstrip('_') for did in doc_ids}
-        clean_ids = list(set(clean_map.values()))
+    def get_snippets_many(self, requests):
+        # requests: [(doc_ids, query_tokens)] -> one {doc_id: snippet} per request.
+        # Only the window around the query terms is read: doc_texts.term_offsets picks it,
+        # substr() fetches it; one query each for the offsets and the windows of all requests.
+        # Articles exported without offsets fall back to the full text.
+        if self.doc_store is not None:
+            return [self.store_snippets(self.doc_store, doc_ids, tokens) for doc_ids, tokens in requests]
+
+        snippets = [{} for _ in requests]
+        all_ids = sorted({doc_id for doc_ids, _ in requests for doc_id in doc_ids})
+        if not all_ids: return snippets
 
         with self._get_conn() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                sql = "SELECT doc_id, score FROM pagerank WHERE doc_id IN %s"
-                cur.execute(sql, (tuple(clean_ids),))
-                temp_scores = {row['doc_id']: row['score'] for row in cur.fetchall()}
-                for raw_id in doc_ids:
-                    clean = clean_map[raw_id]
-                    if clean in temp_scores: res[raw_id] = temp_scores[clean]
-        return res
+            with conn.cursor() as cur:
+                cur.execute("SELECT doc_id, term_offsets FROM doc_texts WHERE doc_id = ANY(%s)", (all_ids,))
+                blobs = dict(cur.fetchall())
+
+                pairs, missing = [], []
+                for n, (doc_ids, tokens) in enumerate(requests):
+                    windows, no_offsets = self.snippet_windows(
+                        [(doc_id, blobs[doc_id]) for doc_id in doc_ids if doc_id in blobs], tokens)
+                    pairs.extend((n, doc_id, window) for doc_id, window in windows.items())
+                    missing.extend((n, doc_id) for doc_id in no_offsets)
+
+                if pairs:
+                    cur.execute(SNIPPET_WINDOWS_SQL, (SNIPPET_WINDOW + SNIPPET_SLACK + 1,
+                                                      [doc_id for _, doc_id, _ in pairs],
+                                                      [window[0] + 1 for _, _, window in pairs]))
+                    for i, fragment in cur.fetchall():
+                        n, doc_id, window = pairs[i - 1]
+                        snippets[n][doc_id] = self.window_snippet(fragment, *window)
+
+                if missing:
+                    cur.execute("SELECT doc_id, text FROM doc_texts WHERE doc_id = ANY(%s)",
+                                (sorted({doc_id for _, doc_id in missing}),))
+                    texts = dict(cur.fetchall())
+                    for n, doc_id in missing:
+                        if doc_id in texts:
+                            snippets[n][doc_id] = self.make_snippet(texts[doc_id], requests[n][1])
+        return snippets
 
-    @timer
-    def get_snippets_bulk(self, doc_ids, query_tokens):
+    def store_snippets(self, store, doc_ids, query_tokens):
+        # Snippets from a local text store (DocStore, or a segment's DocSegment). Windows are
+        # picked in utf-8 bytes there, so one may start or end inside a character, which decoding drops
         snippets = {}
-        if not doc_ids: return snippets
-        clean_map = {did: did.lstrip('_') for did in doc_ids}
-        clean_ids = list(set(clean_map.values()))
-
-        with self._get_conn() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                sql = "SELECT doc_id, text FROM metadata WHERE doc_id IN %s"
-                cur.execute(sql, (tuple(clean_ids),))
-                temp_texts = {row['doc_id']: row['text'] for row in cur.fetchall()}
-                for raw_id in doc_ids:
-                    clean = clean_map[raw_id]
-                    if clean in temp_texts:
-                        snippets[raw_id] = self.make_snippet(temp_texts[clean], query_tokens)
+        query_hashes = term_hashes(query_tokens)
+        for doc_id in doc_ids:
+            offsets = store.term_offsets(doc_id)
+            if offsets is None:
+                text = store.text(doc_id)
+                if text is not None:
+                    snippets[doc_id] = self.make_snippet(text, query_tokens)
+                continue
+
+            start, anchor = self.snippet_window(query_positions(*offsets, query_hashes))
+            fragment = store.text_bytes(doc_id, start, SNIPPET_WINDOW + SNIPPET_SLACK + 1)
+            snippets[doc_id] = self.window_snippet(fragment.decode('utf-8', errors='ignore'), start, anchor)
         return snippets
 
+    def store_text_samples(self, store, doc_ids, limit):
+        res = {}
+        for doc_id in doc_ids:
+            # a character is at most 4 utf-8 bytes
+            sample = store.text_bytes(doc_id, 0, limit * 4)
+            if sample:
+                res[doc_id] = sample.decode('utf-8', errors='ignore')[:limit]
+        return res
+
 
     def calculate_bm25(self, tf, doc_length, doc_freq):
-        val = (self.N - doc_freq + 0.5) / (doc_freq + 0.5) + 1
+        idf = bm25_idf(self.stats.N, doc_freq)
+        return idf * bm25_tf_norm(tf, doc_length, self.stats.avgdl, self.k1, self.b)
 
-        # Prevent log(0) issue
-        if val <= 0: val = 1.00001
-        idf = math.log(val)
-        numerator = tf * (self.k1 + 1)
-        denominator = tf + self.k1 * (1 - self.b + self.b * (doc_length / self.avgdl))
-        return idf * (numerator / denominator)
+    def _fetch_postings(self, terms):
+        postings = {}
 
-    @timer
-    def _get_inverted_index(self, tokens):
-        docs_tracker = {}
+        with stage("postings_fetch"), self._get_conn() as conn:
+            with conn.cursor() as cur:
+                sql = "SELECT term, postings FROM inverted_index WHERE term IN %s"
+                cur.execute(sql, (tuple(terms),))
+                rows = cur.fetchall()
 
-        with self._get_conn() as conn:
+        with stage("decode"):
+            for term, postings_blob in rows:
+                if not postings_blob: continue
+                postings[term] = DecodedPostings(postings_blob)
+        return postings
+
+    def _get_postings(self, tokens, version):
+        cached, missing = self.postings_cache.get_many(version, tokens)
+        postings = {term: p for term, p in cached.items() if p is not None}
+        count("postings_cache_hits", len(cached))
+        count("postings_cache_misses", len(missing))
+
+        if missing:
+            fetched = self._fetch_postings(missing)
+            for term in missing:
+                self.postings_cache.put(version, term, fetched.get(term))
+            postings.update(fetched)
+        return postings
+
+    def _fetch_champions(self, terms):
+        champions = {}
+        with stage("postings_fetch"), self._get_conn() as conn:
             with conn.cursor() as cur:
-                sql = "SELECT term, df, postings FROM inverted_index WHERE term IN %s"
-                cur.execute(sql, (tuple(tokens),))
+                cur.execute(f"SELECT {CHAMPION_COLUMNS} FROM inverted_index WHERE term IN %s", (tuple(terms),))
                 rows = cur.fetchall()
-                for term, df, postings_dict in rows:
-                    if not postings_dict: continue
 
-                    count = 0
-                    for doc_id, tf in postings_dict.items():
-                        count += 1
-                        if count > 20000: break
+        with stage("decode"):
+            for term, df, blob, bound, pr_weight in rows:
+                if not blob: continue
+                champions[term] = self._champion_list(blob, df, bound, pr_weight)
+        return champions
+
+    @staticmethod
+    def _champion_list(blob, df, bound, pr_weight):
+        champions = DecodedPostings(blob)
+        # idf comes from the full list; bound None: the list is complete
+        champions.collection_df = df
+        champions.bound = bound
+        champions.pr_weight = pr_weight
+        return champions
+
+    def _get_champions(self, tokens, version):
+        cached, missing = self.champion_cache.get_many(version, tokens)
+        champions = {term: p for term, p in cached.items() if p is not None}
+        if missing:
+            fetched = self._fetch_champions(missing)
+            for term in missing:
+                self.champion_cache.put(version, term, fetched.get(term))
+            champions.update(fetched)
+        return champions
+
+    def _retrieve_champions(self, stats, tokens, k, bm25_weight, pr_weight, match):
+        champions = self._get_champions(tokens, stats.version)
+        with stage("score"):
+            return self._rank_champions(stats, tokens, champions, k, bm25_weight, pr_weight, match)
+
+    def _rank_champions(self, stats, tokens, champions, k, bm25_weight, pr_weight, match):
+        # survivors from the champion lists, None when the full lists are needed
+        count("postings_scanned", sum(p.df for p in champions.values()))
+        survivors = retrieve_champions(stats, tokens, champions, k, conjunctive=match != "or",
+                                       bm25_weight=bm25_weight, pr_weight=pr_weight,
+                                       boost_max=TITLE_BOOST_MAX, k1=self.k1, b=self.b)
+        count("tier1_answers" if survivors is not None else "tier1_fallbacks")
+        return survivors
+
+    def _get_postings_within(self, tokens, version, deadline):
+        # _get_postings() under a deadline: uncached lists are fetched one at a time, rarest term
+        # first, until the deadline passes; at least one list is always returned if any exists.
+        # Returns (postings, skipped), skipped lists the terms left out.
+        cached, missing = self.postings_cache.get_many(version, tokens)
+        postings = {term: p for term, p in cached.items() if p is not None}
+        count("postings_cache_hits", len(cached))
+        count("postings_cache_misses", len(missing))
+        if not missing:
+            return postings, []
+
+        with stage("postings_fetch"):
+            dfs = self._fetch_dfs(missing)
+        for term in missing:
+            if term not in dfs:
+                self.postings_cache.put(version, term, None)
+
+        order = sorted(dfs, key=lambda term: (dfs[term], term))
+        for i, term in enumerate(order):
+            if postings and deadline.expired():
+                count("deadline_skipped_terms", len(order) - i)
+                return postings, order[i:]
+            fetched = self._fetch_postings([term]).get(term)
+            self.postings_cache.put(version, term, fetched)
+            if fetched is not None:
+                postings[term] = fetched
+        return postings, []
+
+    def _fetch_position_blocks(self, wanted, postings):
+        # wanted: {term: [block index]} -> {term: {block index: bytes}} for the terms indexed with
+        # positions. Two round trips, block directories first, then only the wanted blocks,
+        # each cut out with substring() so the rest of the column is never read.
+        terms = list(wanted)
+        with self._get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(POSITIONS_HEAD_SQL, (terms, [directory_size(postings[t].df) for t in terms]))
+                heads = {term: read_directory(bytes(head)) for term, head in cur.fetchall()}
+
+                ranges = [(term, block) + block_range(*heads[term], block) for term in heads for block in wanted[term]]
+                blocks = {term: {} for term in heads}
+                if ranges:
+                    cur.execute(POSITIONS_BLOCKS_SQL, ([r[0] for r in ranges], [r[2] + 1 for r in ranges],
+                                                       [r[3] - r[2] for r in ranges]))
+                    for i, data in cur.fetchall():
+                        term, block = ranges[i - 1][:2]
+                        blocks[term][block] = bytes(data)
+        return blocks
+
+    def _phrase_docs(self, phrases, postings):
+        # sorted docs containing every phrase, see serving/phrase.py
+        with stage("phrase"):
+            candidates, wanted = plan_phrases(phrases, postings)
+        if not candidates.size:
+            return candidates
+        count("phrase_candidates", candidates.size)
+        with stage("positions_fetch"):
+            blocks = self._fetch_position_blocks(wanted, postings)
+        with stage("phrase"):
+            return match_phrases(phrases, postings, candidates, blocks)
+
+    def _warm_file_terms(self):
+        # POSTINGS_CACHE_WARM_FILE: one query per line, e.g. a query log
+        if not self.cache_warm_file or not os.path.exists(self.cache_warm_file):
+            return None
+        with open(self.cache_warm_file, 'r', encoding='utf-8') as f:
+            return list(dict.fromkeys(t for line in f for t in analyzer.analyze(line)))
+
+    def _top_df_terms(self, limit):
+        with self._get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT term FROM inverted_index ORDER BY df DESC LIMIT %s", (limit,))
+                return [row[0] for row in cur.fetchall()]
 
-                        if doc_id not in docs_tracker:
-                            docs_tracker[doc_id] = {'matches': []}
+    def warm_postings_cache(self, terms=None, batch_size=200):
+        # Default: terms analyzed from POSTINGS_CACHE_WARM_FILE if set,
+        # otherwise the highest-df terms of the index. Stops once the cache is nearly full.
+        try:
+            if terms is None:
+                terms = self._warm_file_terms()
+            if terms is None:
+                terms = self._top_df_terms(self.cache_warm_terms)
+        except Exception as e:
+            print(f" Postings cache warmup failed: {e}", flush=True)
+            return
 
-                        docs_tracker[doc_id]['matches'].append({
-                            'term': term,
-                            'tf': tf,
-                            'df': df
-                        })
-        return docs_tracker
+        version = self.stats.version
+        print(f"Warming postings cache with up to {len(terms)} terms...", flush=True)
+        for i in range(0, len(terms), batch_size):
+            if self.postings_cache.is_full(): break
+            self._get_postings(terms[i: i + batch_size], version)
 
-    def search(self, query, topk=20, pagerank=True, use_semantics=False, alpha=None, beta=None):
-        print(f" Searching for: {query}, use page rank: {pagerank}, use semantics: {use_semantics}, alpha:{alpha}, beta:{beta}", flush=True)
+        stats = self.postings_cache.stats()
+        print(f" Postings cache warm: {stats['entries']} terms, {stats['bytes_used'] / 1024 / 1024:.1f} MB", flush=True)
 
-        if self.N == 0 or self.avgdl == 0.0:
-            print(f"Detected self.N == {self.N}, self.avgdl == {self.avgdl}, attempting to reload stats...", flush=True)
-            self._load_global_stats()
+    def _fetch_dfs(self, terms):
+        with self._get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT term, df FROM inverted_index WHERE term IN %s", (tuple(terms),))
+                return dict(cur.fetchall())
 
-        if self.N == 0:
+    def _retrieve_pushdown(self, stats, tokens, k, bm25_weight, pr_weight, timeout_ms=None):
+        with self._get_conn() as conn:
+            with conn.cursor() as cur:
+                if timeout_ms is not None:
+                    # ends with the transaction, which the pool rolls back
+                    cur.execute("SET LOCAL statement_timeout = %s", (max(1, int(timeout_ms)),))
+                cur.execute(PUSHDOWN_SQL, self._pushdown_params(stats, tokens, k, bm25_weight, pr_weight))
+                rows = cur.fetchall()
+        return survivor_arrays(rows)
+
+    def _pushdown_params(self, stats, tokens, k, bm25_weight, pr_weight):
+        return (list(tokens), stats.N, stats.avgdl, self.k1, self.b, bm25_weight, pr_weight, TITLE_BOOST_MAX, k)
+
+    def retrieve(self, stats, tokens, postings, k, bm25_weight, pr_weight, match="or", within=None):
+        # within: sorted doc ids the results are limited to (phrase matches), None for no limit
+        options = dict(bm25_weight=bm25_weight, pr_weight=pr_weight, boost_max=TITLE_BOOST_MAX, k1=self.k1, b=self.b)
+        # the "ordered" scan counts the postings it actually reaches
+        if within is not None or self.retrieval_mode != "ordered":
+            count("postings_scanned", sum(postings[term].df for term in tokens if term in postings))
+        if within is not None:
+            docs = within
+            if match != "or":
+                if any(term not in postings for term in tokens):
+                    held = within[:0]
+                else:
+                    lists = [within] + [postings[term].decode()[0] for term in tokens]
+                    held = intersect_arrays(sorted(lists, key=lambda d: d.size))
+                if match == "and" or held.size >= k:
+                    docs = held
+                else:
+                    count("match_fallbacks")
+            return retrieve_within(stats, tokens, postings, docs, k, **options)
+
+        if match != "or" and len(tokens) > 1:
+            conjunctive = CONJUNCTIVE_RETRIEVERS.get(self.retrieval_mode, CONJUNCTIVE_RETRIEVERS["vectorized"])
+            survivors = conjunctive(stats, tokens, postings, k, **options)
+            if match == "and" or survivors[0].size >= k:
+                return survivors
+            # "auto": too few docs hold every term, rank the union instead
+            count("match_fallbacks")
+
+        retrieve = RETRIEVERS.get(self.retrieval_mode, RETRIEVERS["vectorized"])
+        return retrieve(stats, tokens, postings, k, **options)
+
+    def query_tokens(self, query):
+        # analyzed query terms, sorted so BM25 sums always add terms in the same order
+        return sorted(set(analyzer.analyze(query)))
+
+    def query_phrases(self, query):
+        # analyzed "quoted phrases" of the query, see serving/phrase.py
+        return query_phrases(query)
+
+    def search(self, query, topk=20, pagerank=True, use_semantics=False, alpha=None, beta=None, match=None):
+        # match: "or", "and" or "auto", see match_mode
+        results, _ = self.search_anytime(query, topk, pagerank, use_semantics, alpha, beta, match=match)
+        return results
+
+    def search_anytime(self, query, topk=20, pagerank=True, use_semantics=False, alpha=None, beta=None,
+                       deadline_ms=None, match=None):
+        # search() within a time budget (serving/deadline.py): returns (results, partial), partial is
+        # True if the deadline cut terms, the semantic re-ranking or snippets. No deadline, no cuts.
+        deadline = Deadline(deadline_ms)
+        stats = self.stats
+        if stats.N == 0 or stats.avgdl == 0.0:
+            print(f"Detected N == {stats.N}, avgdl == {stats.avgdl}, attempting to reload stats...", flush=True)
+            self.reload_doc_stats(force=True)
+            stats = self.stats
+
+        if stats.N == 0:
             print("Error: Metadata table is empty!", flush=True)
-            return []
-
-
-        # tokenize query
-        tokens = analyzer.analyze(query)
-        tokens = list(set(tokens))
-
-        if not tokens: return []
-        print(f"   Tokens: {tokens}", flush=True)
-
-        # docs_tracker = {}
-        #
-        # with self._get_conn() as conn:
-        #     with conn.cursor() as cur:
-        #
-        #         sql = "SELECT term, df, postings FROM inverted_index WHERE term IN %s"
-        #         cur.execute(sql, (tuple(tokens),))
-        #         rows = cur.fetchall()
-        #
-        #         for term, df, postings_dict in rows:
-        #             if not postings_dict: continue
-        #
-        #             count = 0
-        #             for doc_id, tf in postings_dict.items():
-        #                 count += 1
-        #                 if count > 20000: break
-        #
-        #                 if doc_id not in docs_tracker:
-        #                     docs_tracker[doc_id] = {'matches': []}
-        #
-        #                 docs_tracker[doc_id]['matches'].append({
-        #                     'term': term,
-        #                     'tf': tf,
-        #                     'df': df
-        #                 })
-        docs_tracker = self._get_inverted_index(tokens)
-        candidate_ids = list(docs_tracker.keys())
-        if not candidate_ids: return []
-
-        print(f"   Candidates: {len(candidate_ids)}. Fetching metadata...", flush=True)
-
-        doc_lengths = self.get_metadata_bulk(candidate_ids)
-        pr_scores = self.get_pagerank_bulk(candidate_ids)
-
-        scored_results = []
-        for doc_id, data in docs_tracker.items():
-            doc_len = doc_lengths.get(doc_id, self.avgdl)
-
-            bm25_score = 0.0
-            for match in data['matches']:
-                bm25_score += self.calculate_bm25(match['tf'], doc_len, match['df'])
-
-            if pagerank:
-                pr_score = pr_scores.get(doc_id, 0.0)
-                normalized_pr = math.log(1 + pr_score * 10000000)
-                if alpha is None: alpha = self.alpha
-                if beta is None: beta = self.beta
-                final_score = (alpha * bm25_score) + (beta * normalized_pr)
-            else:
-                normalized_pr = 0.0
-                final_score = bm25_score
-
-            clean_id = doc_id.replace("_", " ").lower()
-            query_lower = query.lower()
-
-
-            # TODO: Tune these multipliers
-            # Try to give exact match more weight
-            # 3.0 might to too much?
-            # if clean_id == query_lower:
-            #     final_score *= 3.0
-            # elif query_lower in clean_id:
-            #     final_score *= 1.2
+            return [], False
 
+        with stage("analyze"):
+            tokens = self.query_tokens(query)
+            phrases = self.query_phrases(query)
+        if not tokens: return [], False
+        q = AnytimeSearch(self, stats, tokens, phrases, deadline, topk, pagerank, use_semantics, alpha, beta, match)
 
+        survivors = None
+        if q.wants_champions():
+            survivors = self._retrieve_champions(stats, tokens, q.k, q.bm25_weight, q.pr_weight, q.match)
 
-            id_text = doc_id.replace("_", " ")
-            id_tokens = analyzer.analyze(id_text)
-            query_set = set(tokens)
-            id_set = set(id_tokens)
-
-            # Try both-way matching for fuzzy title match
-            if not id_set:
-                pass
-
-            elif query_set == id_set:
-                final_score *= 3.0
-
-            elif query_set.issubset(id_set):
-                final_score *= 1.5
+        if survivors is None and q.wants_pushdown():
+            try:
+                with stage("pushdown"):
+                    survivors = self._retrieve_pushdown(stats, tokens, q.k, q.bm25_weight, q.pr_weight,
+                                                        timeout_ms=deadline.remaining_ms())
+            except Exception as e:
+                print(f"   Pushdown failed, scoring locally: {e}", flush=True)
 
-            elif id_set.issubset(query_set):
-                final_score *= 2.0
+        if survivors is None:
+            if deadline.at is None:
+                postings = self._get_postings(tokens, stats.version)
+            else:
+                postings, skipped = self._get_postings_within(tokens, stats.version, deadline)
+                q.skip_terms(skipped)
+            if not postings: return q.finish([])
+            within = self._phrase_docs(q.phrases, postings) if q.phrases else None
+            with stage("score"):
+                survivors = self.retrieve(stats, q.scored_tokens, postings, q.k, q.bm25_weight, q.pr_weight,
+                                          q.match, within)
+
+        with stage("metadata"):
+            scored_results = self.rank_candidates(stats, tokens, survivors, q.k, pagerank)
+
+        if q.wants_rerank(scored_results):
+            with stage("semantic"):
+                scored_results = self.semantic_rerank(query, scored_results, tokens)
+
+        top_results, snippet_ids = q.cut(scored_results)
+        with stage("snippet"):
+            snippets_map = self.get_snippets_bulk(snippet_ids, tokens)
+
+        with stage("metadata"):
+            return q.finish(self.build_results(top_results, q.snippets(snippets_map)))
+
+    def search_many(self, queries, topk=20, pagerank=True, use_semantics=False, alpha=None, beta=None, match=None):
+        # Batch form of search(): one result list per query, in order. Identical analyzed queries
+        # are ranked once, the postings of all distinct terms are fetched in a few bulk queries,
+        # queries are scored on SEARCH_BATCH_WORKERS threads and the snippets of the whole batch
+        # come from one pass over the texts. Always scores locally, pushdown is per query.
+        stats = self.stats
+        if stats.N == 0 or stats.avgdl == 0.0:
+            self.reload_doc_stats(force=True)
+            stats = self.stats
+        if stats.N == 0:
+            print("Error: Metadata table is empty!", flush=True)
+            return [[] for _ in queries]
+
+        if alpha is None: alpha = self.alpha
+        if beta is None: beta = self.beta
+        if match is None: match = self.match_mode
+        bm25_weight, pr_weight = (alpha, beta) if pagerank else (1.0, 0.0)
+        k = max(topk, self.semantic_topk) if use_semantics else topk
+
+        with stage("analyze"):
+            keys_of, unique, terms = self._plan_batch(queries)
+
+        postings = {}
+        for i in range(0, len(terms), BATCH_TERMS):
+            postings.update(self._get_postings(terms[i: i + BATCH_TERMS], stats.version))
+
+        def rank(key):
+            tokens, phrases = key
+            within = self._phrase_docs(phrases, postings) if phrases else None
+            return self._rank_batch_query(stats, tokens, postings, k, bm25_weight, pr_weight, pagerank, match, within)
+
+        # each task runs in a copy of the request's context so its stages land in the request's trace
+        with ThreadPoolExecutor(max_workers=self.batch_workers) as pool:
+            ranked = [f.result() for f in [pool.submit(copy_context().run, rank, key) for key in unique]]
+
+        if use_semantics and self.semantic_model is not None:
+            first_query = {}
+            for query, key in zip(queries, keys_of):
+                first_query.setdefault(key, query)
+            ranked = [self.semantic_rerank(first_query[key], scored, list(key[0])) if scored else scored
+                      for key, scored in zip(unique, ranked)]
+        ranked = [scored[:topk] for scored in ranked]
+
+        with stage("snippet"):
+            snippets = self.get_snippets_many([([r['doc_id'] for r in top], list(tokens))
+                                               for (tokens, _), top in zip(unique, ranked)])
+        return self._batch_results(keys_of, unique, ranked, snippets)
+
+    def _plan_batch(self, queries):
+        # (analyzed tokens, phrases) of every query, the distinct ones with tokens, and all their terms
+        keys_of = [(tuple(self.query_tokens(query)), self.query_phrases(query)) for query in queries]
+        unique = list(dict.fromkeys(key for key in keys_of if key[0]))
+        terms = sorted({term for tokens, _ in unique for term in tokens})
+        return keys_of, unique, terms
+
+    def _rank_batch_query(self, stats, tokens, postings, k, bm25_weight, pr_weight, pagerank, match="or",
+                          within=None):
+        # one query of a batch: postings holds the lists of every term in the batch,
+        # within the docs matching the query's phrases (None without phrases)
+        query_postings = {term: postings[term] for term in tokens if term in postings}
+        if not query_postings: return []
+        with stage("score"):
+            survivors = self.retrieve(stats, list(tokens), query_postings, k, bm25_weight, pr_weight, match, within)
+        with stage("metadata"):
+            return self.rank_candidates(stats, list(tokens), survivors, k, pagerank)
+
+    def _batch_results(self, keys_of, unique, ranked, snippets):
+        by_key = {key: self.build_results(top, snippets_map) for key, top, snippets_map in zip(unique, ranked, snippets)}
+        return [by_key.get(key, []) for key in keys_of]
+
+    def rank_candidates(self, stats, tokens, survivors, k, pagerank):
+        # CPU-only part of search(): title boost and ordering of the top k retrieved candidates
+        doc_ids, base_scores, bm25_scores = survivors
+        count("candidates", doc_ids.size)
+
+        # docs that can't be shown (no title, e.g. an index newer than the loaded doc stats);
+        # the pruning retrievers leave them out already, the exhaustive reference path doesn't
+        shown = stats.showable_mask(doc_ids)
+        doc_ids, base_scores, bm25_scores = doc_ids[shown], base_scores[shown], bm25_scores[shown]
+
+        # title boost from the index-time title signatures, no analysis per candidate
+        final_scores = base_scores * title_boosts(stats, doc_ids, term_hashes(tokens))
+
+        # doc id breaks ties, same order whichever retrieval mode produced the candidates
+        order = np.lexsort((doc_ids, -final_scores))[:k]
 
+        scored_results = []
+        for i in order.tolist():
+            doc_id = int(doc_ids[i])
+            normalized_pr = stats.pr_norm(doc_id) if pagerank else 0.0
             scored_results.append({
                 "doc_id": doc_id,
-                "score": final_score,
-                "detail": f"BM25:{bm25_score:.2f} + PR:{normalized_pr:.2f}"
+                "title": stats.title(doc_id),
+                "score": float(final_scores[i]),
+                "detail": f"BM25:{bm25_scores[i]:.2f} + PR:{normalized_pr:.2f}"
             })
+        return scored_results
 
-        scored_results.sort(key=lambda x: x['score'], reverse=True)
-        if use_semantics and self.semantic_model is not None and scored_results:
-            print("   Performing semantic re-ranking...", flush=True)
-            scored_results = self.semantic_rerank(query, scored_results, tokens)
-        top_results = scored_results[:topk]
-
-        print("   Generating snippets...", flush=True)
-        top_ids = [r['doc_id'] for r in top_results]
-        snippets_map = self.get_snippets_bulk(top_ids, tokens)
-
+    def build_results(self, top_results, snippets_map):
         final_list = []
         for res in top_results:
             snippet = snippets_map.get(res['doc_id'], "No content available.")
 
             if snippet == "No content available.": continue
-            if res['doc_id'].startswith("_born"): continue
 
-            res['snippet'] = snippet
-            final_list.append(res)
+            # API keeps returning titles as doc_id; the ordinal only breaks ties when merging shards
+            final_list.append({
+                "doc_id": res['title'],
+                "ordinal": res['doc_id'],
+                "score": res['score'],
+                "detail": res['detail'],
+                "snippet": snippet
+            })
 
         return final_list
 
 
     # Semantic Reranking (Not used in current stages, saved for future experiments)
-    def semantic_rerank(self, query, scored_results, tokens):
+    def semantic_rerank(self, query, scored_results, tokens, raw_text_map=None):
         if self.semantic_model is not None and scored_results:
             cand_results = scored_results[:self.semantic_topk]
             cand_ids = [r["doc_id"] for r in cand_results]
-            print(f"Cand_ids for semantic re-rank: {cand_ids}", flush=True)
-
-            print("   Semantic Preparing texts for re-ranking...", flush=True)
+            logger.debug("Semantic re-rank of %d candidates: %s", len(cand_ids), cand_ids)
 
-            raw_text_map = self.get_raw_text_sample_bulk(cand_ids, limit=300)
+            if raw_text_map is None:
+                raw_text_map = self.get_raw_text_sample_bulk(cand_ids, limit=300)
 
             doc_texts = []
             valid_items = []
@@ -376,7 +759,7 @@ class SearchEngine:
                 content = raw_text_map.get(did, "")
 
 
-                title = did.replace("_", " ")
+                title = item["title"].replace("_", " ")
 
 
                 semantic_input = f"{title}. {content}"
@@ -417,26 +800,56 @@ class SearchEngine:
     def get_raw_text_sample_bulk(self, doc_ids, limit=300):
         res = {}
         if not doc_ids: return res
-
-        clean_map = {did: did.lstrip('_') for did in doc_ids}
-        clean_ids = list(set(clean_map.values()))
+        if self.doc_store is not None:
+            return self.store_text_samples(self.doc_store, doc_ids, limit)
 
         with self._get_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                sql = "SELECT doc_id, substr(text, 1, %s) as sample FROM metadata WHERE doc_id IN %s"
-                cur.execute(sql, (limit, tuple(clean_ids)))
-
-                temp_data = {row['doc_id']: row['sample'] for row in cur.fetchall()}
+                sql = "SELECT doc_id, substr(text, 1, %s) as sample FROM doc_texts WHERE doc_id = ANY(%s)"
+                cur.execute(sql, (limit, list(doc_ids)))
 
-                for raw_id in doc_ids:
-                    clean = clean_map[raw_id]
-                    if clean in temp_data:
-                        res[raw_id] = temp_data[clean]
+                res = {row['doc_id']: row['sample'] for row in cur.fetchall()}
         return res
 
 
-    # Get a snippet
-    def make_snippet(self, text, query_tokens, window_size=150):
+    def snippet_windows(self, rows, query_tokens):
+        # rows: (doc_id, term offsets blob or None) -> ({doc_id: (start, anchor)}, doc_ids without offsets)
+        query_hashes = term_hashes(query_tokens)
+        windows, missing = {}, []
+        for doc_id, blob in rows:
+            if blob is None:
+                missing.append(doc_id)
+                continue
+            windows[doc_id] = self.snippet_window(query_positions(*decode_offsets(blob), query_hashes))
+        return windows, missing
+
+    def snippet_window(self, positions, window_size=SNIPPET_WINDOW):
+        # Window around the group of query terms that fits in half a window with the most terms.
+        # start: 0-based offset to fetch from; anchor: offset of the group's last term from start
+        group = best_window(positions, window_size // 2)
+        if group is None:
+            return 0, 0
+        first, last = group
+        start = max(0, (first + last) // 2 - window_size // 2)
+        return start, last - start
+
+    def window_snippet(self, fragment, start, anchor, window_size=SNIPPET_WINDOW):
+        # fragment: up to window_size + SNIPPET_SLACK + 1 characters of the text from start
+        if not fragment:
+            return "No content available." if start == 0 else ""
+
+        end = min(len(fragment), max(window_size, anchor + 1))
+        limit = min(len(fragment), window_size + SNIPPET_SLACK)
+        while end < limit and fragment[end].isalnum():
+            end += 1
+
+        snippet = fragment[:end].replace('\n', ' ').strip()
+        prefix = "..." if start > 0 else ""
+        suffix = "..." if end < len(fragment) else ""
+        return f"{prefix}{snippet}{suffix}"
+
+    # Get a snippet by scanning the full text, for articles without term offsets
+    def make_snippet(self, text, query_tokens, window_size=SNIPPET_WINDOW):
 
         if not text: return "No content available."
 
@@ -0,0 +1,132 @@
+import os
+
+from serving.search_engine import SearchEngine
+from serving.doc_stats import DocStats
+from serving.postings_cache import DecodedPostings
+from compute.utils.postings_codec import read_header
+from compute.utils.positions_codec import read_directory, block_range
+from serving.metrics import stage
+from compute.utils.segments import TermSegment, DocSegment, read_manifest, term_partition
+
+# Embedded serving mode (SEARCH_ENGINE=segments in serving/main.py): queries are answered from the
+# index segments in INDEX_SEGMENT_DIR (compute/utils/segments.py), without a database connection.
+# Files are mmap'd: startup only maps them, posting lists are decoded straight from the mapping
+# and repeated reads are page-cache hits. Scoring and ranking are shared with SearchEngine.
+# Postgres stays the system of record; compute/export_segments.py publishes a new segment set.
+
+
+class SegmentIndex:
+    # all segments of one manifest, swapped as a whole on reload
+
+    def __init__(self, directory):
+        self.manifest = read_manifest(directory)
+        self.num_partitions = self.manifest['num_partitions']
+        self.terms = {p: TermSegment(directory, p) for p in self.manifest['partitions']}
+        self.docs = DocSegment(directory)
+        self.stats = DocStats.from_segment(self.manifest, self.docs)
+
+    def postings(self, term):
+        # (zero-copy view of the encoded list, collection df), None if the term is not indexed
+        segment = self.terms.get(term_partition(term, self.num_partitions))
+        if segment is None:
+            return None
+        i = segment.find(term)
+        return (segment.blob(i), int(segment.dfs[i])) if i is not None else None
+
+    def positions(self, term):
+        # zero-copy view of the encoded positions, None if the term has none
+        segment = self.terms.get(term_partition(term, self.num_partitions))
+        i = segment.find(term) if segment is not None else None
+        return segment.positions_blob(i) if i is not None else None
+
+    def top_terms(self, limit):
+        candidates = [item for segment in self.terms.values() for item in segment.top_terms(limit)]
+        return [term for _, term in sorted(candidates, key=lambda item: -item[0])[:limit]]
+
+
+class SegmentSearchEngine(SearchEngine):
+    def __init__(self):
+        self._init_settings()
+        self.segment_dir = os.getenv("INDEX_SEGMENT_DIR", "/app/data/segments")
+        # texts come from the segment's own docs.text
+        self.doc_store_dir = ""
+        # pushdown needs Postgres
+        if self.retrieval_mode == "pushdown":
+            self.retrieval_mode = "vectorized"
+        self.index = None
+
+        self.reload_doc_stats(force=True)
+        self.warm_postings_cache()
+
+    def _current_index_version(self):
+        return int(read_manifest(self.segment_dir)['index_version'])
+
+    def reload_doc_stats(self, force=False):
+        # Map the segment set if the manifest names a new index version (or always, with force)
+        with self._reload_lock:
+            try:
+                if not force and self.stats is not None and self._current_index_version() == self.stats.version:
+                    return False
+
+                print(f"Mapping index segments in {self.segment_dir}...", flush=True)
+                index = SegmentIndex(self.segment_dir)
+            except Exception as e:
+                print(f" Index segments failed: {e}", flush=True)
+                if self.stats is None:
+                    self.stats = DocStats.empty()
+                return False
+
+            self.index = index
+            self._swap_doc_stats(index.stats)
+            return True
+
+    def _fetch_postings(self, terms):
+        postings = {}
+        index = self.index
+        if index is None: return postings
+
+        for term in terms:
+            found = index.postings(term)
+            if found is None: continue
+            blob, df = found
+            with stage("decode"):
+                postings[term] = DecodedPostings(blob, copy=False)
+            # differs from the list's own df in a shard, whose lists only hold its documents
+            postings[term].collection_df = df
+        return postings
+
+    def _fetch_dfs(self, terms):
+        # list lengths, what the deadline orders fetches by (search_anytime)
+        dfs = {}
+        index = self.index
+        if index is None: return dfs
+
+        for term in terms:
+            found = index.postings(term)
+            if found is not None:
+                dfs[term] = read_header(found[0])[0]
+        return dfs
+
+    def _fetch_position_blocks(self, wanted, postings):
+        # slices of the mapping; only the pages of the wanted blocks are ever read
+        blocks = {}
+        index = self.index
+        if index is None: return blocks
+
+        for term, block_ids in wanted.items():
+            blob = index.positions(term)
+            if blob is None: continue
+            head = read_directory(blob)
+            blocks[term] = {block: blob[slice(*block_range(*head, block))] for block in block_ids}
+        return blocks
+
+    def _top_df_terms(self, limit):
+        return self.index.top_terms(limit) if self.index is not None else []
+
+    def get_snippets_many(self, requests):
+        if self.index is None: return [{} for _ in requests]
+        return [self.store_snippets(self.index.docs, doc_ids, tokens) for doc_ids, tokens in requests]
+
+    def get_raw_text_sample_bulk(self, doc_ids, limit=300):
+        if not doc_ids or self.index is None: return {}
+        return self.store_text_samples(self.index.docs, doc_ids, limit)
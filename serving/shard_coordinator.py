@@ -0,0 +1,213 @@
+import os
+import asyncio
+import heapq
+from itertools import islice
+
+import httpx
+
+from compute.utils.tokenizer import analyzer
+from serving.metrics import stage, count
+from serving.phrase import query_phrases
+from serving.deadline import Deadline
+
+# Scatter-gather over document-partitioned shards (SEARCH_ENGINE=coordinator in serving/main.py).
+# Each shard is a backend serving one slice of the collection (SEARCH_ENGINE=segments on a shard
+# directory written by compute/export_segments.py --shards N) and answers /shard/search with its
+# local top-k. Shards score with collection-wide N, avgdl and dfs, so a doc gets the same score
+# as in the full index and merging the local top-k lists yields the global top-k.
+# A shard that fails or misses SHARD_TIMEOUT_MS is left out and the results are marked partial.
+# With a deadline, shards run an anytime search on part of it and the coordinator merges what has
+# come back by the deadline (at least one shard's answer); results are then partial if a shard is
+# missing or cut its own search short. The shard calls of such a request time out with its
+# deadline instead of SHARD_TIMEOUT_MS, which only bounds the wait for a first answer when the
+# deadline is shorter.
+
+# share of a request's deadline given to the shards, the rest covers the round trip and the merge
+SHARD_DEADLINE_SHARE = 0.8
+
+
+class ShardSetStats:
+    # the part of DocStats serving/main.py reads: index version (cache keys) and doc count
+    def __init__(self, version=0, n_docs=0):
+        self.version = version
+        self.N = n_docs
+
+
+class ShardCoordinator:
+    def __init__(self):
+        self.shard_urls = [url.strip().rstrip("/") for url in os.getenv("SHARD_URLS", "").split(",") if url.strip()]
+        self.timeout = float(os.getenv("SHARD_TIMEOUT_MS", "500")) / 1000
+        self.reload_timeout = 60.0
+        self.batch_timeout = float(os.getenv("SHARD_BATCH_TIMEOUT_MS", "60000")) / 1000
+
+        # defaults sent to the shards when a request leaves them unset, same as SearchEngine
+        self.alpha = 0.7
+        self.beta = 0.3
+        self.match_mode = os.getenv("SEARCH_MATCH", "or")
+
+        self.stats = ShardSetStats()
+        self.client = None
+        self.failures = [0] * len(self.shard_urls)
+        self.timeouts = [0] * len(self.shard_urls)
+
+    async def start(self):
+        print(f"Coordinating {len(self.shard_urls)} shards: {', '.join(self.shard_urls)}", flush=True)
+        self.client = httpx.AsyncClient(timeout=self.timeout)
+        await self.reload_doc_stats()
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+
+    def query_tokens(self, query):
+        return sorted(set(analyzer.analyze(query)))
+
+    def query_phrases(self, query):
+        # shards match the phrases themselves, the coordinator only needs them for cache keys
+        return query_phrases(query)
+
+    async def _call_shard(self, i, method, path, params, timeout, body=None):
+        try:
+            response = await self.client.request(method, self.shard_urls[i] + path, params=params, json=body,
+                                                 timeout=timeout)
+            response.raise_for_status()
+            return response.json()
+        except httpx.TimeoutException:
+            self.timeouts[i] += 1
+            print(f" Shard {self.shard_urls[i]} timed out on {path}", flush=True)
+        except Exception as e:
+            self.failures[i] += 1
+            print(f" Shard {self.shard_urls[i]} failed on {path}: {e}", flush=True)
+        return None
+
+    async def _fan_out(self, method, path, params, timeout=None, body=None):
+        # one payload per shard, None where the shard failed; requests run concurrently
+        timeout = self.timeout if timeout is None else timeout
+        return await asyncio.gather(*[
+            self._call_shard(i, method, path, params, timeout, body) for i in range(len(self.shard_urls))
+        ])
+
+    async def _fan_out_within(self, method, path, params, deadline):
+        # _fan_out() that stops waiting once the Deadline passes, unless no shard has answered yet:
+        # then it waits for the first answer (or for all to fail)
+        remaining = deadline.remaining_ms() / 1000
+        timeout = max(remaining, self.timeout)
+        tasks = [asyncio.ensure_future(self._call_shard(i, method, path, params, timeout))
+                 for i in range(len(self.shard_urls))]
+        if not tasks: return []
+        done, pending = await asyncio.wait(tasks, timeout=remaining)
+        while pending and all(task.result() is None for task in done):
+            more, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            done |= more
+        for task in pending:
+            task.cancel()
+        return [task.result() if task in done else None for task in tasks]
+
+    async def search_shards(self, query, topk=20, pagerank=True, use_semantics=False, alpha=None, beta=None,
+                            deadline_ms=None, match=None):
+        # returns (merged top-k, partial); partial is True if any shard is missing from the merge
+        # or returned partial results itself
+        deadline = Deadline(deadline_ms)
+        if match is None: match = self.match_mode
+        params = {"q": query, "limit": topk, "pagerank": pagerank, "semantics": use_semantics}
+        if alpha is not None: params["alpha"] = alpha
+        if beta is not None: params["beta"] = beta
+
+        # "auto" is decided here for the whole collection, as a single engine does, not by each
+        # shard on its own docs: AND everywhere, and the union everywhere when all the shards
+        # together have fewer than topk docs holding every term. Shards return up to topk hits,
+        # so their lengths add up to at least topk exactly when the collection has topk AND docs.
+        partial = False
+        if match == "auto":
+            merged, total, partial = await self._search_round(dict(params, match="and"), topk, deadline)
+            if total >= topk:
+                return merged, partial
+            count("match_fallbacks")
+            match = "or"
+        merged, _, round_partial = await self._search_round(dict(params, match=match), topk, deadline)
+        return merged, partial or round_partial
+
+    async def _search_round(self, params, topk, deadline):
+        # one /shard/search on every shard -> (merged top-k, hits of all shards, partial)
+        with stage("shards"):
+            if deadline.at is None:
+                payloads = await self._fan_out("GET", "/shard/search", params)
+            else:
+                params["deadline_ms"] = max(1, int(deadline.remaining_ms() * SHARD_DEADLINE_SHARE))
+                payloads = await self._fan_out_within("GET", "/shard/search", params, deadline)
+        answered = [payload for payload in payloads if payload is not None]
+        lists = [payload["results"] for payload in answered]
+        count("shards_missing", len(payloads) - len(lists))
+        partial = len(lists) < len(payloads) or any(payload.get("partial") for payload in answered)
+        if partial and deadline.at is not None:
+            count("deadline_exceeded")
+
+        # every shard list is already sorted by score, ties by ordinal like a single engine
+        with stage("merge"):
+            merged = list(islice(heapq.merge(*lists, key=lambda r: (-r["score"], r["ordinal"])), topk))
+        return merged, sum(len(results) for results in lists), partial
+
+    async def search(self, query, topk=20, pagerank=True, use_semantics=False, alpha=None, beta=None, match=None):
+        results, _ = await self.search_shards(query, topk, pagerank, use_semantics, alpha, beta, match=match)
+        return results
+
+    async def search_anytime(self, query, topk=20, pagerank=True, use_semantics=False, alpha=None, beta=None,
+                             deadline_ms=None, match=None):
+        return await self.search_shards(query, topk, pagerank, use_semantics, alpha, beta, deadline_ms, match)
+
+    async def search_many_shards(self, queries, topk=20, pagerank=True, use_semantics=False, alpha=None, beta=None,
+                                 match=None):
+        # batch form of search_shards(): every shard ranks the whole batch in one request, and
+        # with match="auto" the queries short of topk AND hits in a second one, as a union
+        if match is None: match = self.match_mode
+        body = {"limit": topk, "pagerank": pagerank, "semantics": use_semantics, "alpha": alpha, "beta": beta}
+        merged, totals, partial = await self._search_many_round(
+            dict(body, queries=list(queries), match="and" if match == "auto" else match), len(queries), topk)
+        if match == "auto":
+            short = [i for i, total in enumerate(totals) if total < topk]
+            if short:
+                count("match_fallbacks", len(short))
+                union, _, union_partial = await self._search_many_round(
+                    dict(body, queries=[queries[i] for i in short], match="or"), len(short), topk)
+                for i, results in zip(short, union):
+                    merged[i] = results
+                partial = partial or union_partial
+        return merged, partial
+
+    async def _search_many_round(self, body, n_queries, topk):
+        # one /shard/search/batch on every shard -> (merged top-k per query, hits per query, partial)
+        with stage("shards"):
+            payloads = await self._fan_out("POST", "/shard/search/batch", None, self.batch_timeout, body)
+        lists = [payload["results"] for payload in payloads if payload is not None]
+        count("shards_missing", len(payloads) - len(lists))
+
+        with stage("merge"):
+            merged = [list(islice(heapq.merge(*[shard[i] for shard in lists],
+                                              key=lambda r: (-r["score"], r["ordinal"])), topk))
+                      for i in range(n_queries)]
+        totals = [sum(len(shard[i]) for shard in lists) for i in range(n_queries)]
+        return merged, totals, len(lists) < len(payloads)
+
+    async def search_many(self, queries, topk=20, pagerank=True, use_semantics=False, alpha=None, beta=None,
+                          match=None):
+        results, _ = await self.search_many_shards(queries, topk, pagerank, use_semantics, alpha, beta, match)
+        return results
+
+    async def reload_doc_stats(self, force=False):
+        payloads = [p for p in await self._fan_out("POST", "/index/reload", {"force": force}, self.reload_timeout)
+                    if p is not None]
+        if not payloads:
+            return False
+
+        # shards may briefly disagree during a rollout; cache keys follow the newest
+        self.stats = ShardSetStats(max(p["index_version"] for p in payloads), payloads[0]["docs"])
+        return any(p["reloaded"] for p in payloads)
+
+    def shard_stats(self):
+        return {
+            "timeout_ms": self.timeout * 1000,
+            "shards": [
+                {"url": url, "failures": self.failures[i], "timeouts": self.timeouts[i]}
+                for i, url in enumerate(self.shard_urls)
+            ],
+        }
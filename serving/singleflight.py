@@ -0,0 +1,49 @@
+import asyncio
+
+# Single-flight request coalescing: while a computation for a key is running, other
+# callers with the same key wait for it and share its result (or its exception)
+# instead of running it again. Nothing is kept once the computation finishes,
+# longer-lived reuse is the result cache's job.
+
+
+class AsyncSingleFlight:
+    # all callers run on one event loop, so no lock
+
+    def __init__(self):
+        self._calls = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        # fn is a coroutine function; returns (result, shared), shared is True if another
+        # caller started the work
+        task = self._calls.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            # a task of its own, so the caller that started it (its client may disconnect)
+            # going away doesn't cancel it under the callers still waiting
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(_forget(self._calls, key))
+            self.executions += 1
+        return await asyncio.shield(task), shared
+
+    def stats(self):
+        requests = self.executions + self.coalesced
+        return {
+            "in_flight": len(self._calls),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "coalesced_rate": self.coalesced / requests if requests else 0.0,
+        }
+
+
+def _forget(calls, key):
+    def done(task):
+        del calls[key]
+        # mark an exception retrieved, every caller may be gone
+        if not task.cancelled():
+            task.exception()
+    return done
@@ -0,0 +1,168 @@
+import heapq
+from bisect import bisect_left
+
+# Block-Max WAND (Ding & Suel, 2011) over compute/utils/postings_codec.py posting lists.
+# Cursors move through doc-id sorted lists and skip whole blocks whose stored BM25
+# upper bound can't get a document past the current threshold; skipped blocks are
+# never decoded.
+
+END_DOC = 1 << 62
+
+# relative slack on pruning thresholds, bounds and scores are summed in different orders
+EPSILON = 1e-9
+
+
+class PostingCursor:
+    def __init__(self, term, reader, idf, bound_scale=1.0):
+        self.term = term
+        self.reader = reader
+        self.idf = idf
+        self.df = reader.df
+
+        # idf * stored impact bound; bound_scale covers avgdl drift since indexing
+        scale = idf * bound_scale
+        self.block_last = reader.block_last_doc.tolist()
+        self.block_ub = (reader.block_max_impact * scale).tolist()
+        self.max_score = reader.max_impact * scale
+
+        self.block = -1
+        self.docs = []
+        self.tfs = []
+        self.pos = 0
+        self.doc = END_DOC
+        if reader.num_blocks:
+            self._load_block(0)
+
+    def _load_block(self, block_idx):
+        if block_idx >= self.reader.num_blocks:
+            self.doc = END_DOC
+            return
+        doc_ids, tfs = self.reader.decode_block(block_idx)
+        self.block = block_idx
+        self.docs = doc_ids.tolist()
+        self.tfs = tfs.tolist()
+        self.pos = 0
+        self.doc = self.docs[0]
+
+    @property
+    def tf(self):
+        return self.tfs[self.pos]
+
+    def next(self):
+        self.pos += 1
+        if self.pos < len(self.docs):
+            self.doc = self.docs[self.pos]
+        else:
+            self._load_block(self.block + 1)
+
+    def next_geq(self, target):
+        if self.doc >= target:
+            return
+        if target > self.block_last[self.block]:
+            block_idx = bisect_left(self.block_last, target, self.block + 1)
+            self._load_block(block_idx)
+            if self.doc == END_DOC:
+                return
+        self.pos = bisect_left(self.docs, target, self.pos)
+        self.doc = self.docs[self.pos]
+
+    def block_bound(self, target):
+        # (upper bound, last doc) of the block that would hold target, nothing is decoded
+        block_idx = bisect_left(self.block_last, target, max(self.block, 0))
+        if block_idx >= len(self.block_last):
+            return 0.0, END_DOC
+        return self.block_ub[block_idx], self.block_last[block_idx]
+
+
+def block_max_wand(cursors, k, score_doc, bm25_weight=1.0, static_max=0.0, boost_max=1.0):
+    # Candidate generation for scores of the form
+    #     final(d) = boost(d) * base(d),  base(d) = bm25_weight * bm25(d) + static(d)
+    # with 1 <= boost(d) <= boost_max and 0 <= static(d) <= static_max.
+    #
+    # score_doc(doc, matched_cursors) returns (base, bm25) for a fully evaluated doc, or None
+    # for a doc the caller can't return (it doesn't count toward theta).
+    # A size-k heap of base scores gives theta, a lower bound of the k-th best final score.
+    # Any doc with boost_max * base < theta can't make the final top-k, so returned
+    # survivors (doc, base, bm25) are exactly the docs the caller has to boost and rank.
+    cursors = [c for c in cursors if c.doc != END_DOC]
+    heap = []
+    survivors = []
+    theta = float('-inf')
+
+    def bm25_threshold():
+        # sum of term bounds a doc needs to reach boost_max * base >= theta
+        if theta == float('-inf') or bm25_weight <= 0:
+            return float('-inf')
+        threshold = (theta / boost_max - static_max) / bm25_weight
+        return threshold - abs(threshold) * EPSILON
+
+    # scoring order must not depend on cursor movement, keep the caller's term order
+    scoring_order = list(cursors)
+
+    while cursors:
+        cursors.sort(key=lambda c: c.doc)
+        threshold = bm25_threshold()
+
+        # pivot: first cursor where the accumulated list bounds may reach the threshold
+        acc = 0.0
+        pivot = -1
+        for i, c in enumerate(cursors):
+            acc += c.max_score
+            if acc >= threshold:
+                pivot = i
+                break
+        if pivot < 0:
+            break
+
+        pivot_doc = cursors[pivot].doc
+        if pivot_doc == END_DOC:
+            break
+
+        # include cursors sitting on the same doc as the pivot
+        while pivot + 1 < len(cursors) and cursors[pivot + 1].doc == pivot_doc:
+            pivot += 1
+
+        block_sum = 0.0
+        block_end = END_DOC
+        for c in cursors[:pivot + 1]:
+            ub, last = c.block_bound(pivot_doc)
+            block_sum += ub
+            block_end = min(block_end, last)
+
+        if block_sum >= threshold:
+            if cursors[0].doc == pivot_doc:
+                matched = [c for c in scoring_order if c.doc == pivot_doc]
+                scored = score_doc(pivot_doc, matched)
+
+                if scored is not None:
+                    base, bm25 = scored
+                    if len(heap) < k:
+                        heapq.heappush(heap, base)
+                    elif base > heap[0]:
+                        heapq.heapreplace(heap, base)
+                    if len(heap) >= k:
+                        theta = heap[0]
+
+                    if base * boost_max >= theta - abs(theta) * EPSILON:
+                        survivors.append((pivot_doc, base, bm25))
+
+                for c in matched:
+                    c.next()
+            else:
+                # move the lagging cursor with the smallest df up to the pivot
+                lagging = [c for c in cursors[:pivot] if c.doc < pivot_doc]
+                min(lagging, key=lambda c: c.df).next_geq(pivot_doc)
+        else:
+            # the current blocks can't produce a survivor: jump past the shortest one
+            next_doc = block_end + 1
+            if pivot + 1 < len(cursors):
+                next_doc = min(next_doc, cursors[pivot + 1].doc)
+            if next_doc <= pivot_doc:
+                next_doc = pivot_doc + 1
+            for c in cursors[:pivot + 1]:
+                c.next_geq(next_doc)
+
+        cursors = [c for c in cursors if c.doc != END_DOC]
+
+    cutoff = theta - abs(theta) * EPSILON
+    return [s for s in survivors if s[1] * boost_max >= cutoff]
@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from serving.search_engine import SearchEngine
+
+# search_many vs one search() per query against the live index (PG_* env vars).
+# Queries are random 1-3 term combinations of indexed terms; the postings cache is cleared
+# before each run so both sides fetch their lists from Postgres.
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--topk", type=int, default=10)
+    parser.add_argument("--vocab", type=int, default=3000, help="sample terms from the N highest-df terms")
+    args = parser.parse_args()
+
+    engine = SearchEngine()
+    with engine._get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT term FROM inverted_index ORDER BY df DESC LIMIT %s", (args.vocab,))
+            terms = [row[0] for row in cur.fetchall()]
+
+    random.seed(7)
+    queries = [" ".join(random.sample(terms, random.randint(1, 3))) for _ in range(args.queries)]
+
+    engine.postings_cache.clear()
+    start = time.perf_counter()
+    serial = [engine.search(query, topk=args.topk) for query in queries]
+    serial_s = time.perf_counter() - start
+
+    engine.postings_cache.clear()
+    start = time.perf_counter()
+    batched = engine.search_many(queries, topk=args.topk)
+    batch_s = time.perf_counter() - start
+
+    same = sum(a == b for a, b in zip(serial, batched))
+    print(f"\n{len(queries)} queries: serial {serial_s:.2f}s ({len(queries) / serial_s:.0f} q/s), "
+          f"search_many {batch_s:.2f}s ({len(queries) / batch_s:.0f} q/s, {engine.batch_workers} workers), "
+          f"{same}/{len(queries)} identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from serving.search_engine import SearchEngine
+
+# Tier-1 champion lists (compute/utils/champions.py) vs the full posting lists on the live index
+# (PG_* env vars; build the lists with compute/indexing/build_champions.py first): how often
+# tier 1 answers on its own, postings scanned and retrieval time of both, and whether the
+# ranked top k of an answered query is exactly the full lists' one.
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def ranked(engine, stats, tokens, survivors, k):
+    return [(r["doc_id"], r["score"]) for r in engine.rank_candidates(stats, tokens, survivors, k, True)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("queries", nargs="*")
+    parser.add_argument("--random", type=int, default=30, help="random queries when none are given")
+    parser.add_argument("--vocab", type=int, default=2000, help="sample terms from the N highest-df terms")
+    parser.add_argument("--topk", type=int, default=20)
+    parser.add_argument("--match", default="or", choices=("or", "and", "auto"))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    engine = SearchEngine()
+    stats = engine.stats
+    if not stats.champions_valid:
+        print("Champion lists missing or built with other PageRank scores, run compute/indexing/build_champions.py")
+        return
+
+    queries = args.queries
+    if not queries:
+        terms = engine._top_df_terms(args.vocab)
+        random.seed(5)
+        queries = [" ".join(random.sample(terms, random.randint(1, 3))) for _ in range(args.random)]
+
+    weights = (engine.alpha, engine.beta)
+    answered = mismatches = 0
+    scanned = {"tier1": 0, "full": 0}
+    totals = {"tier1": 0.0, "full": 0.0}
+    for query in queries:
+        tokens = engine.query_tokens(query)
+        if not tokens: continue
+        champions = engine._get_champions(tokens, stats.version)
+        postings = engine._get_postings(tokens, stats.version)
+
+        tier1, tier1_ms = timed(lambda: engine._rank_champions(stats, tokens, champions, args.topk, *weights,
+                                                               args.match), args.repeat)
+        full, full_ms = timed(lambda: engine.retrieve(stats, tokens, postings, args.topk, *weights, args.match),
+                              args.repeat)
+        tier1_postings = sum(p.df for p in champions.values())
+        full_postings = sum(p.df for p in postings.values())
+
+        same = True
+        if tier1 is not None:
+            answered += 1
+            same = ranked(engine, stats, tokens, tier1, args.topk) == ranked(engine, stats, tokens, full, args.topk)
+            mismatches += not same
+            scanned["tier1"] += tier1_postings
+            totals["tier1"] += tier1_ms
+        else:
+            # a fallback scans the champions and then the full lists
+            scanned["tier1"] += tier1_postings + full_postings
+            totals["tier1"] += tier1_ms + full_ms
+        scanned["full"] += full_postings
+        totals["full"] += full_ms
+
+        print(f"{str(tokens):40s} {'tier 1  ' if tier1 is not None else 'fallback'} postings "
+              f"{tier1_postings:8d} / {full_postings:8d} | tier 1 {tier1_ms:7.2f}ms  full {full_ms:7.2f}ms"
+              f"{'' if same else '  MISMATCH'}")
+
+    print(f"\n{answered}/{len(queries)} answered by tier 1, {mismatches} mismatches; postings scanned "
+          f"{scanned['tier1']} vs {scanned['full']} full, retrieval {totals['tier1']:.1f}ms vs {totals['full']:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
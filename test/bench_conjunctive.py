@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import random
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from serving.search_engine import SearchEngine
+from serving.scoring import RETRIEVERS, CONJUNCTIVE_RETRIEVERS, TITLE_BOOST_MAX
+
+# Disjunctive (OR) vs conjunctive (AND) retrieval on the live index (PG_* env vars): candidates
+# scored and retrieval time per query, for 2-3 term queries of indexed terms. Also checks that
+# the AND paths agree with each other and with the OR ranking restricted to docs holding every term.
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("queries", nargs="*")
+    parser.add_argument("--random", type=int, default=20, help="random queries when none are given")
+    parser.add_argument("--vocab", type=int, default=2000, help="sample terms from the N highest-df terms")
+    parser.add_argument("--topk", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    engine = SearchEngine()
+    stats = engine.stats
+    queries = args.queries
+    if not queries:
+        terms = engine._top_df_terms(args.vocab)
+        random.seed(7)
+        queries = [" ".join(random.sample(terms, random.randint(2, 3))) for _ in range(args.random)]
+
+    options = dict(bm25_weight=engine.alpha, pr_weight=engine.beta, boost_max=TITLE_BOOST_MAX)
+    totals = {"or": 0.0, "and": 0.0, "and-cursors": 0.0}
+    mismatches = 0
+    for query in queries:
+        tokens = engine.query_tokens(query)
+        postings = engine._get_postings(tokens, stats.version)
+        if len(tokens) < 2 or len(postings) < len(tokens): continue
+
+        union, or_ms = timed(lambda: RETRIEVERS["vectorized"](stats, tokens, postings, args.topk, **options),
+                             args.repeat)
+        inter, and_ms = timed(lambda: CONJUNCTIVE_RETRIEVERS["vectorized"](stats, tokens, postings, args.topk,
+                                                                           **options), args.repeat)
+        leap, cursor_ms = timed(lambda: CONJUNCTIVE_RETRIEVERS["bmw"](stats, tokens, postings, args.topk, **options),
+                                args.repeat)
+        totals["or"] += or_ms
+        totals["and"] += and_ms
+        totals["and-cursors"] += cursor_ms
+
+        # unpruned, every doc holding all terms must score exactly as in the OR path
+        full_or = RETRIEVERS["vectorized"](stats, tokens, postings, 1 << 40, **options)
+        full_and = CONJUNCTIVE_RETRIEVERS["vectorized"](stats, tokens, postings, 1 << 40, **options)
+        in_all = np.isin(full_or[0], full_and[0])
+        same = (np.array_equal(full_or[0][in_all], full_and[0]) and np.array_equal(full_or[1][in_all], full_and[1])
+                and np.array_equal(inter[0], leap[0]) and np.array_equal(inter[1], leap[1]))
+        mismatches += not same
+
+        or_candidates = int(sum(p.df for p in postings.values()))
+        print(f"{str(tokens):40s} postings {or_candidates:9d}  AND {full_and[0].size:7d} docs | "
+              f"OR {or_ms:7.2f}ms  AND {and_ms:7.2f}ms  AND cursors {cursor_ms:8.2f}ms{'' if same else '  MISMATCH'}")
+
+    print(f"\ntotal: OR {totals['or']:.1f}ms  AND {totals['and']:.1f}ms  AND cursors {totals['and-cursors']:.1f}ms, "
+          f"{mismatches} mismatches")
+
+
+if __name__ == "__main__":
+    main()
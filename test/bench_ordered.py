@@ -0,0 +1,105 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from serving.search_engine import SearchEngine
+from serving.scoring import RETRIEVERS, CONJUNCTIVE_RETRIEVERS, TITLE_BOOST_MAX
+from serving.metrics import traced
+
+# Early-terminating "ordered" retrieval vs whole-list vectorized scoring on the live index
+# (PG_* env vars): postings scanned and time per query, and whether the ranked top k agrees.
+# Run it before and after compute/indexing/reorder_docs.py to compare doc orders:
+#     python test/bench_ordered.py --save before.json
+#     python compute/indexing/reorder_docs.py
+#     python test/bench_ordered.py --baseline before.json
+# Runs are compared by title, doc ids change with the reordering.
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("queries", nargs="*")
+    parser.add_argument("--random", type=int, default=30, help="random queries when none are given")
+    parser.add_argument("--vocab", type=int, default=2000, help="sample terms from the N highest-df terms")
+    parser.add_argument("--topk", type=int, default=20)
+    parser.add_argument("--match", default="or", choices=("or", "and"))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", help="write per-query results to this file")
+    parser.add_argument("--baseline", help="compare with a file written by --save")
+    args = parser.parse_args()
+
+    engine = SearchEngine()
+    stats = engine.stats
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    queries = args.queries or (baseline and list(baseline))
+    if not queries:
+        terms = engine._top_df_terms(args.vocab)
+        random.seed(9)
+        queries = [" ".join(random.sample(terms, random.randint(1, 3))) for _ in range(args.random)]
+
+    retrievers = CONJUNCTIVE_RETRIEVERS if args.match == "and" else RETRIEVERS
+    options = dict(bm25_weight=engine.alpha, pr_weight=engine.beta, boost_max=TITLE_BOOST_MAX)
+    results = {}
+    mismatches = 0
+    totals = {"full": 0, "ordered": 0, "before": 0, "full_ms": 0.0, "ordered_ms": 0.0}
+    for query in queries:
+        tokens = engine.query_tokens(query)
+        postings = engine._get_postings(tokens, stats.version)
+        if not postings: continue
+
+        full, full_ms = timed(lambda: retrievers["vectorized"](stats, tokens, postings, args.topk, **options),
+                              args.repeat)
+        with traced("bench") as trace:
+            ordered, ordered_ms = timed(lambda: retrievers["ordered"](stats, tokens, postings, args.topk, **options), 1)
+        scanned = trace.counts.get("postings_scanned", 0)
+        _, ordered_ms = timed(lambda: retrievers["ordered"](stats, tokens, postings, args.topk, **options),
+                              args.repeat)
+
+        ranked = [(r["title"], round(r["score"], 9))
+                  for r in engine.rank_candidates(stats, tokens, ordered, args.topk, True)]
+        same = ranked == [(r["title"], round(r["score"], 9))
+                          for r in engine.rank_candidates(stats, tokens, full, args.topk, True)]
+        before = ""
+        if baseline and query in baseline:
+            same = same and [tuple(r) for r in baseline[query]["ranked"]] == ranked
+            totals["before"] += baseline[query]["scanned"]
+            before = f"  before {baseline[query]['scanned']:8d}"
+        mismatches += not same
+
+        df = sum(p.df for p in postings.values())
+        totals["full"] += df
+        totals["ordered"] += scanned
+        totals["full_ms"] += full_ms
+        totals["ordered_ms"] += ordered_ms
+        results[query] = {"scanned": scanned, "ranked": ranked}
+        print(f"{str(tokens):40s} postings {df:8d}  scanned {scanned:8d}{before} | "
+              f"full {full_ms:7.2f}ms  ordered {ordered_ms:7.2f}ms{'' if same else '  MISMATCH'}")
+
+    summary = (f"\npostings scanned: {totals['ordered']} of {totals['full']} "
+               f"({totals['ordered'] / max(totals['full'], 1):.1%})")
+    if baseline:
+        summary += f", {totals['before']} before"
+    print(summary + f"; retrieval {totals['ordered_ms']:.1f}ms vs {totals['full_ms']:.1f}ms full, "
+                    f"{mismatches} mismatches")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f)
+
+
+if __name__ == "__main__":
+    main()
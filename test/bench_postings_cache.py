@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from compute.utils.postings_codec import encode_postings
+from serving.postings_cache import PostingsCache, DecodedPostings
+
+# Postings cache under a Zipfian query load: share of requests that still need Postgres.
+# Vocabulary and dfs are synthetic; queries draw 1-3 terms from a Zipf distribution over term rank.
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--terms", type=int, default=20000)
+    parser.add_argument("--docs", type=int, default=250000)
+    parser.add_argument("--queries", type=int, default=50000)
+    parser.add_argument("--cache-mb", type=int, default=256)
+    parser.add_argument("--warm", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    # df falls off with term rank, like the query popularity
+    dfs = np.maximum((args.docs * 0.3 / np.arange(1, args.terms + 1) ** 0.8).astype(np.int64), 1)
+    blobs = {}
+
+    def blob(term):
+        rank = int(term[1:])
+        if rank not in blobs:
+            doc_ids = np.sort(rng.choice(args.docs, size=int(dfs[rank]), replace=False))
+            blobs[rank] = encode_postings(doc_ids, np.ones(doc_ids.size, dtype=np.int64))
+        return blobs[rank]
+
+    cache = PostingsCache(args.cache_mb * 1024 * 1024)
+    fetches = 0
+
+    def get_postings(terms):
+        nonlocal fetches
+        _, missing = cache.get_many(1, terms)
+        if missing:
+            fetches += 1
+            for term in missing:
+                cache.put(1, term, DecodedPostings(blob(term)))
+
+    start = time.perf_counter()
+    for rank in range(args.warm):
+        if cache.is_full(): break
+        get_postings([f"t{rank}"])
+    print(f"Warmup: {cache.stats()['entries']} terms in {time.perf_counter() - start:.1f}s")
+
+    cache.hits = cache.misses = 0
+    fetches = 0
+    for _ in range(args.queries):
+        n = rng.integers(1, 4)
+        terms = list({f"t{int(r) - 1}" for r in rng.zipf(1.2, n) if r <= args.terms})
+        if terms:
+            get_postings(terms)
+
+    stats = cache.stats()
+    print(f"Term hit rate: {stats['hit_rate']:.3f}, evictions: {stats['evictions']}, "
+          f"{stats['bytes_used'] / 1024 / 1024:.1f} MB used")
+    print(f"Queries touching Postgres: {fetches / args.queries:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from compute.utils.postings_codec import encode_postings, decode_postings, PostingsReader
+
+# Encode / decode throughput of the binary postings codec against the old JSON postings.
+# Synthetic posting lists with Zipf-distributed df, roughly SimpleWiki sized (~250k docs).
+
+
+def make_postings(rng, num_terms, num_docs):
+    dfs = np.minimum(rng.zipf(1.3, num_terms), num_docs // 2)
+    lists = []
+    for df in dfs:
+        doc_ids = np.sort(rng.choice(num_docs, size=int(df), replace=False))
+        tfs = np.minimum(rng.zipf(2.0, int(df)), 500)
+        lists.append((doc_ids, tfs))
+    return lists
+
+
+def bench(label, fn, items, total_postings):
+    start = time.perf_counter()
+    out = [fn(item) for item in items]
+    duration = time.perf_counter() - start
+    print(f"{label:<28} {duration:8.3f}s  {total_postings / duration / 1e6:8.2f} M postings/s")
+    return out
+
+
+def run_benchmark(num_terms, num_docs, seed):
+    rng = np.random.default_rng(seed)
+    print(f"Generating {num_terms} posting lists over {num_docs} docs...")
+    lists = make_postings(rng, num_terms, num_docs)
+    total_postings = sum(len(d) for d, _ in lists)
+    print(f"Total postings: {total_postings}\n")
+
+    json_blobs = bench("JSON encode", lambda p: json.dumps(dict(zip(map(str, p[0].tolist()), p[1].tolist()))),
+                       lists, total_postings)
+    bin_blobs = bench("Binary encode", lambda p: encode_postings(p[0], p[1]), lists, total_postings)
+
+    bench("JSON decode", json.loads, json_blobs, total_postings)
+    bench("Binary decode (numpy)", decode_postings, bin_blobs, total_postings)
+    bench("Binary decode (lazy iter)", lambda b: sum(1 for _ in PostingsReader(b)), bin_blobs, total_postings)
+
+    capped = sum(min(len(d), 20000) for d, _ in lists)
+    bench("Binary decode (first 20000)", lambda b: decode_postings(b, limit=20000), bin_blobs, capped)
+
+    json_bytes = sum(len(b.encode('utf-8')) for b in json_blobs)
+    bin_bytes = sum(len(b) for b in bin_blobs)
+    print(f"\nJSON size:   {json_bytes / 1e6:8.2f} MB ({json_bytes / total_postings:.2f} bytes/posting)")
+    print(f"Binary size: {bin_bytes / 1e6:8.2f} MB ({bin_bytes / total_postings:.2f} bytes/posting)")
+    print(f"Compression: {json_bytes / bin_bytes:.1f}x")
+
+    for (doc_ids, tfs), blob in zip(lists, bin_blobs):
+        dec_docs, dec_tfs = decode_postings(blob)
+        assert np.array_equal(dec_docs, doc_ids) and np.array_equal(dec_tfs, tfs)
+    print("Round trip check passed.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--terms", type=int, default=20000)
+    parser.add_argument("--docs", type=int, default=250000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    run_benchmark(args.terms, args.docs, args.seed)
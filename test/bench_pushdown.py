@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from serving.search_engine import SearchEngine
+
+# Python scoring vs SQL pushdown (bm25_pr_topk) against the live index (PG_* env vars).
+# The Python path runs cold: postings are fetched and decoded on every repeat, which is
+# the case pushdown competes with.
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("queries", nargs="*")
+    parser.add_argument("--topk", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--local", default="vectorized", help="retriever for the Python path")
+    args = parser.parse_args()
+
+    engine = SearchEngine()
+    engine.retrieval_mode = args.local
+    stats = engine.stats
+
+    queries = args.queries
+    if not queries:
+        with engine._get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT term FROM inverted_index ORDER BY df DESC LIMIT 40")
+                terms = [row[0] for row in cur.fetchall()]
+        # from a single frequent term up to several frequent terms
+        queries = [terms[-1], terms[20], f"{terms[30]} {terms[10]}", f"{terms[0]} {terms[5]}", " ".join(terms[:4])]
+
+    for query in queries:
+        tokens = engine.query_tokens(query)
+        if not tokens: continue
+        dfs = engine._fetch_dfs(tokens)
+        print(f"\nQuery {tokens} ({sum(dfs.values())} postings)")
+
+        for pagerank in (False, True):
+            bm25_weight, pr_weight = (engine.alpha, engine.beta) if pagerank else (1.0, 0.0)
+
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                engine.postings_cache.clear()
+                postings = engine._get_postings(tokens, stats.version)
+                survivors = engine.retrieve(stats, tokens, postings, args.topk, bm25_weight, pr_weight)
+            local_ms = (time.perf_counter() - start) / args.repeat * 1000
+            local = [r["doc_id"] for r in engine.rank_candidates(stats, tokens, survivors, args.topk, pagerank)]
+
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                survivors = engine._retrieve_pushdown(stats, tokens, args.topk, bm25_weight, pr_weight)
+            pushdown_ms = (time.perf_counter() - start) / args.repeat * 1000
+            pushed = [r["doc_id"] for r in engine.rank_candidates(stats, tokens, survivors, args.topk, pagerank)]
+
+            same = "same" if local == pushed else "DIFFERENT"
+            print(f"  pagerank={pagerank!s:<5} {args.local} {local_ms:9.2f}ms  pushdown {pushdown_ms:9.2f}ms  "
+                  f"top-{args.topk} {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from serving.search_engine import SearchEngine
+
+# Snippets from doc_texts.term_offsets windows vs the full-text scan (make_snippet) against the
+# live index (PG_* env vars), and from the compressed doc store when DOC_STORE_DIR has one.
+# Run compute/export_metadata.py first so the offsets and the store exist.
+
+
+def full_text_snippets(engine, doc_ids, tokens):
+    with engine._get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT doc_id, text FROM doc_texts WHERE doc_id = ANY(%s)", (list(doc_ids),))
+            return {doc_id: engine.make_snippet(text, tokens) for doc_id, text in cur.fetchall()}
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("queries", nargs="*", default=["music", "river music", "king history war"])
+    parser.add_argument("--topk", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--show", type=int, default=1, help="snippets to print per query")
+    args = parser.parse_args()
+
+    engine = SearchEngine()
+    for query in args.queries:
+        tokens = engine.query_tokens(query)
+        doc_ids = [r["ordinal"] for r in engine.search(query, topk=args.topk)]
+        if not doc_ids: continue
+
+        store = engine.doc_store
+        scanned, scan_ms = timed(lambda: full_text_snippets(engine, doc_ids, tokens), args.repeat)
+        engine.doc_store = None
+        windowed, window_ms = timed(lambda: engine.get_snippets_bulk(doc_ids, tokens), args.repeat)
+        engine.doc_store = store
+
+        line = f"\nQuery {tokens} ({len(doc_ids)} docs): full text {scan_ms:8.2f}ms  windows {window_ms:8.2f}ms"
+        stored = {}
+        if store is not None:
+            stored, store_ms = timed(lambda: engine.store_snippets(store, doc_ids, tokens), args.repeat)
+            line += f"  doc store {store_ms:8.2f}ms"
+        print(line)
+        for doc_id in doc_ids[:args.show]:
+            print(f"  scan:   {scanned.get(doc_id)}")
+            print(f"  window: {windowed.get(doc_id)}")
+            if store is not None:
+                print(f"  store:  {stored.get(doc_id)}")
+
+if __name__ == "__main__":
+    main()
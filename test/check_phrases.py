@@ -0,0 +1,93 @@
+import os
+import sys
+import random
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from compute.indexing.reducer import reduce_terms
+from compute.utils.positions_codec import encode_doc_positions, read_directory, block_range, doc_chunks
+from serving.postings_cache import DecodedPostings
+from serving.phrase import plan_phrases, match_phrases
+
+# Positional index round trip on a random corpus, no database needed: mapper-style run records
+# -> reduce_terms() -> phrase matching from position blocks, checked against a scan of the docs.
+# Also reports how many position blocks a phrase reads out of the blocks of its words' lists.
+
+
+def build_index(docs):
+    records = []
+    for doc_id, tokens in enumerate(docs):
+        term_positions = {}
+        for position, term in enumerate(tokens):
+            term_positions.setdefault(term, []).append(position)
+        for term, positions in term_positions.items():
+            records.append((term, doc_id, len(positions), encode_doc_positions(positions)))
+    records.sort(key=lambda r: r[0])
+
+    lengths = np.array([len(tokens) for tokens in docs], dtype=np.float64)
+    postings, positions = {}, {}
+    for term, _, _, blob, positions_blob, *_ in reduce_terms(iter(records), lengths, float(lengths.mean())):
+        postings[term] = DecodedPostings(blob)
+        positions[term] = positions_blob
+    return postings, positions
+
+
+def fetch_blocks(positions, wanted):
+    blocks = {}
+    for term, block_ids in wanted.items():
+        head = read_directory(positions[term])
+        blocks[term] = {block: positions[term][slice(*block_range(*head, block))] for block in block_ids}
+    return blocks
+
+
+def scan(docs, vocabularies, phrase):
+    n = len(phrase)
+    words = set(phrase)
+    return [doc_id for doc_id, tokens in enumerate(docs) if words <= vocabularies[doc_id]
+            and any(tuple(tokens[i:i + n]) == phrase for i in range(len(tokens) - n + 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--vocab", type=int, default=3000)
+    parser.add_argument("--phrases", type=int, default=200)
+    args = parser.parse_args()
+
+    random.seed(11)
+    # zipf-ish vocabulary, so common words have long lists and frequent co-occurrence
+    vocab = [f"w{i}" for i in range(args.vocab)]
+    weights = [1.0 / (i + 1) for i in range(args.vocab)]
+    docs = [random.choices(vocab, weights, k=random.randint(5, 300)) for _ in range(args.docs)]
+    vocabularies = [set(tokens) for tokens in docs]
+    postings, positions = build_index(docs)
+
+    # per-doc chunks survive a split (compute/export_segments.py shards)
+    for term in vocab[:5]:
+        doc_ids, tfs = postings[term].decode()
+        chunks = doc_chunks(positions[term], tfs)
+        assert len(chunks) == doc_ids.size and b''.join(chunks) == bytes(positions[term][-len(b''.join(chunks)):])
+
+    mismatches = 0
+    read_blocks = total_blocks = 0
+    for _ in range(args.phrases):
+        doc = random.choice(docs)
+        n = random.randint(2, 4)
+        start = random.randrange(len(doc) - n + 1)
+        phrases = (tuple(doc[start:start + n]),)
+
+        candidates, wanted = plan_phrases(phrases, postings)
+        found = match_phrases(phrases, postings, candidates, fetch_blocks(positions, wanted))
+        expected = scan(docs, vocabularies, phrases[0])
+        mismatches += found.tolist() != expected
+        read_blocks += sum(len(b) for b in wanted.values())
+        total_blocks += sum(postings[t].num_blocks for t in set(phrases[0]))
+
+    print(f"{args.phrases} phrases: {mismatches} mismatches, "
+          f"{read_blocks}/{total_blocks} position blocks read ({read_blocks / max(total_blocks, 1):.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import os
+import sys
+import random
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from compute.db_utils import get_db_connection
+from compute.indexing.reorder_docs import reorder_docs, pagerank_order
+from compute.indexing.build_champions import build_all
+from compute.export_segments import export_segments, SEGMENT_DIR
+from compute.utils.segments import shard_name
+from serving.search_engine import SearchEngine
+from serving.segment_search_engine import SegmentSearchEngine
+
+# Segment and shard serving after compute/indexing/reorder_docs.py must answer exactly like the
+# database engine: same titles, doc ids, scores and snippets. Needs a live index built with --segments
+# (PG_* env vars, term segments in INDEX_SEGMENT_DIR). Renumbers the documents in a random order,
+# re-exports the segments and compares, then puts them back in PageRank order (champion lists and
+# segments rebuilt) and compares again; the database is left in PageRank order.
+
+
+def sample_queries(engine, n, vocab):
+    # 1-3 of the highest-df terms, and phrases of two adjacent words of random texts
+    random.seed(7)
+    terms = engine._top_df_terms(vocab)
+    queries = [" ".join(random.sample(terms, random.randint(1, min(3, len(terms))))) for _ in range(n)]
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT left(text, 300) FROM doc_texts ORDER BY random() LIMIT %s", (n,))
+            texts = [text for (text,) in cur.fetchall()]
+    finally:
+        conn.close()
+    for text in texts:
+        words = text.split()
+        if len(words) > 2:
+            i = random.randrange(len(words) - 1)
+            queries.append(f'"{words[i]} {words[i + 1]}"')
+    return queries
+
+
+def ranked(results):
+    # (title, doc id, score, snippet) of every hit
+    return [(r["doc_id"], r["ordinal"], round(r["score"], 6), r["snippet"]) for r in results]
+
+
+def shard_engines(num_shards):
+    engines = []
+    for shard in range(num_shards):
+        os.environ["INDEX_SEGMENT_DIR"] = os.path.join(SEGMENT_DIR, shard_name(shard))
+        engines.append(SegmentSearchEngine())
+    os.environ["INDEX_SEGMENT_DIR"] = SEGMENT_DIR
+    return engines
+
+
+def compare(label, queries, topk, num_shards):
+    db = SearchEngine()
+    # the segments have no champion lists, compare full-list scoring on both sides
+    db.use_champions = False
+    segments = SegmentSearchEngine()
+    shards = shard_engines(num_shards)
+
+    mismatches = 0
+    for query in queries:
+        expected = ranked(db.search(query, topk=topk))
+        line = []
+        if ranked(segments.search(query, topk=topk)) != expected:
+            mismatches += 1
+            line.append("segments BAD")
+        if shards:
+            # the coordinator's merge: every shard's top k, best scores first, ties by doc id
+            merged = sorted((r for engine in shards for r in ranked(engine.search(query, topk=topk))),
+                            key=lambda r: (-r[2], r[1]))[:topk]
+            if merged != expected:
+                mismatches += 1
+                line.append("shards BAD")
+        if line:
+            print(f"   {query!r:<32} {len(expected)} hits  " + "  ".join(line))
+    print(f"{label}: {len(queries)} queries, {mismatches} mismatches", flush=True)
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=30, help="random term queries, as many phrase queries")
+    parser.add_argument("--vocab", type=int, default=200, help="sample terms from the N highest-df terms")
+    parser.add_argument("--topk", type=int, default=20)
+    parser.add_argument("--shards", type=int, default=2)
+    args = parser.parse_args()
+
+    if not any(name.endswith(".seg") and name.startswith("part-") for name in os.listdir(SEGMENT_DIR)):
+        print(f"No term segments in {SEGMENT_DIR}, build the index with --segments first.")
+        sys.exit(1)
+    os.environ["INDEX_SEGMENT_DIR"] = SEGMENT_DIR
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            size = pagerank_order(cur).size
+    finally:
+        conn.close()
+    reorder_docs(np.random.RandomState(3).permutation(size))
+    export_segments(args.shards)
+    queries = sample_queries(SearchEngine(), args.queries, args.vocab)
+    failures = compare("random order", queries, args.topk, args.shards)
+
+    reorder_docs()
+    build_all()
+    export_segments(args.shards)
+    failures += compare("PageRank order", queries, args.topk, args.shards)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
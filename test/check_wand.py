@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from serving.search_engine import SearchEngine
+from serving.scoring import RETRIEVERS
+
+# Block-Max WAND and vectorized scoring must return exactly what exhaustive scoring returns.
+# Runs every query in all retrieval modes against the live index and compares the ranked lists.
+
+DEFAULT_QUERIES = [
+    "united states", "world war", "computer science", "music", "the history of france",
+    "albert einstein", "river", "football club", "new york city", "solar system planets",
+]
+
+
+def run(engine, mode, query, topk, pagerank):
+    engine.retrieval_mode = mode
+    start = time.perf_counter()
+    results = engine.search(query, topk=topk, pagerank=pagerank)
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--topk", type=int, default=20)
+    parser.add_argument("queries", nargs="*", default=DEFAULT_QUERIES)
+    args = parser.parse_args()
+
+    engine = SearchEngine()
+    failures = 0
+    timings = {mode: 0.0 for mode in RETRIEVERS}
+
+    for query in args.queries:
+        for pagerank in (True, False):
+            expected, _ = run(engine, "exhaustive", query, args.topk, pagerank)
+            line = []
+            for mode in RETRIEVERS:
+                actual, duration = run(engine, mode, query, args.topk, pagerank)
+                timings[mode] += duration
+
+                same = [r["doc_id"] for r in expected] == [r["doc_id"] for r in actual]
+                if not same:
+                    failures += 1
+                line.append(f"{mode} {duration * 1000:7.1f}ms{'' if same else ' BAD'}")
+            print(f"pagerank={pagerank!s:<5} {query!r:<28} " + "  ".join(line))
+
+    total = ", ".join(f"{mode} {t:.2f}s" for mode, t in timings.items())
+    print(f"\nTotal: {total}, mismatches: {failures}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()